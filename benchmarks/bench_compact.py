@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+bench_compact.py
+
+Compares the compact float32 feature path (COMPACT_DTYPE) with the float64
+path on the same float32 spectra, which is how the CDF files store them:
+wall time of each path and the minutes whose features differ by more than
+COMPACT_TOLERANCE, i.e. |compact - float64| > COMPACT_TOLERANCE * max(1, |float64|),
+per feature. Spectra come from benchmarks.synthetic.make_minute_data.
+
+Usage:
+    python -m benchmarks.bench_compact --minutes 500000 --seed 0
+"""
+
+import argparse
+import time
+import numpy as np
+from benchmarks.synthetic import make_minute_data
+from scripts.feature_engineering import COMPACT_DTYPE, COMPACT_TOLERANCE, extract_features
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--minutes', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    ion_spec_df, B_field_df = make_minute_data(args.minutes, args.seed)
+    ion_spec_df = ion_spec_df.astype(np.float32)
+    energy_bins = np.logspace(np.log10(10), np.log10(30000), 32)
+    
+    start = time.perf_counter()
+    reference = extract_features(ion_spec_df, B_field_df['Btot'], energy_bins)
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    compact = extract_features(ion_spec_df, B_field_df['Btot'], energy_bins, dtype=COMPACT_DTYPE)
+    compact_time = time.perf_counter() - start
+    
+    expected = reference.to_numpy()
+    outside = np.abs(compact.to_numpy(dtype=float) - expected) > COMPACT_TOLERANCE * np.maximum(1, np.abs(expected))
+    print(f"{args.minutes} minutes (seed {args.seed}): float64 {reference_time:.2f} s, "
+          f"float32 {compact_time:.2f} s")
+    print(f"Minutes outside COMPACT_TOLERANCE ({COMPACT_TOLERANCE:g}): {int(outside.any(axis=1).sum())}")
+    for name, count in zip(reference.columns, outside.sum(axis=0)):
+        print(f"  {name:<18}{count}")
+
+if __name__ == "__main__":
+    main()
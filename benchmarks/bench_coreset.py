@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+bench_coreset.py
+
+Compares the GMM fit on all minutes (train_gmm) with the coreset fit of
+models/coreset.py on synthetic feature tables of growing size: wall time of
+each fit and the log-likelihood loss per minute of the coreset fit against
+the full fit, scored on all minutes. A share of the rows is set to exact
+zeros, as the pseudofeature does, so the duplicate collapse has work to do.
+
+Usage:
+    python -m benchmarks.bench_coreset --rows 10000 100000 1000000 --size 50000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.synthetic import make_features
+from models.clustering import train_gmm
+from models.coreset import mean_log_likelihood, train_gmm_coreset
+from scripts.storage import read_table, write_table
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--size', type=int, default=50000, help="Coreset draws")
+    parser.add_argument('--resolution', type=float, default=None)
+    parser.add_argument('--zero-share', type=float, default=0.3, help="Share of all-zero rows")
+    parser.add_argument('--max-full-rows', type=int, default=2000000,
+                        help="Skip the full fit above this many rows")
+    args = parser.parse_args()
+    
+    print(f"{'rows':>10}{'full fit [s]':>14}{'coreset fit [s]':>17}{'full LL':>10}{'coreset LL':>12}{'loss':>10}")
+    for n_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'features.frame')
+            features_df = make_features(n_rows)
+            zeros = np.random.default_rng(1).random(n_rows) < args.zero_share
+            features_df.iloc[zeros] = 0.0
+            write_table(features_df, path)
+            del features_df
+    
+            start = time.perf_counter()
+            gmm = train_gmm_coreset(path, coreset_size=args.size, resolution=args.resolution)
+            coreset_time = time.perf_counter() - start
+            coreset_score = mean_log_likelihood(gmm, path)
+            if n_rows <= args.max_full_rows:
+                start = time.perf_counter()
+                full = train_gmm(read_table(path, mmap=False))
+                full_time = time.perf_counter() - start
+                full_score = mean_log_likelihood(full, path)
+                print(f"{n_rows:>10}{full_time:>14.2f}{coreset_time:>17.2f}{full_score:>10.4f}{coreset_score:>12.4f}"
+                      f"{full_score - coreset_score:>10.4f}")
+            else:
+                print(f"{n_rows:>10}{'-':>14}{coreset_time:>17.2f}{'-':>10}{coreset_score:>12.4f}{'-':>10}")
+
+if __name__ == "__main__":
+    main()
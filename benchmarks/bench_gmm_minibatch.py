@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+bench_gmm_minibatch.py
+
+Compares the in-memory GMM fit (train_gmm) with the out-of-core fits of
+train_gmm_minibatch on a synthetic feature table: wall time, peak traced
+memory (tracemalloc) and mean log-likelihood per sample on the full data.
+
+Usage:
+    python -m benchmarks.bench_gmm_minibatch --rows 2000000 --chunk-size 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from benchmarks.synthetic import make_features
+from models.clustering import train_gmm, train_gmm_minibatch
+from scripts.storage import iter_table, read_table, write_table
+
+def mean_log_likelihood(gmm, path, chunk_size):
+    total, count = 0.0, 0
+    for chunk in iter_table(path, chunk_size):
+        total += gmm.score_samples(chunk).sum()
+        count += len(chunk)
+    return total / count
+
+def measure(label, fit):
+    tracemalloc.start()
+    start = time.perf_counter()
+    gmm = fit()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return label, gmm, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--online-passes', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'features.frame')
+        write_table(make_features(args.rows), path)
+
+        results = [
+            measure('in-memory', lambda: train_gmm(read_table(path, mmap=False))),
+            measure('out-of-core batch EM', lambda: train_gmm_minibatch(path, chunk_size=args.chunk_size)),
+            measure('out-of-core online EM', lambda: train_gmm_minibatch(
+                path, chunk_size=args.chunk_size, mode='online', max_iter=args.online_passes
+            ))
+        ]
+
+        print(f"{args.rows} rows, chunk size {args.chunk_size}")
+        print(f"{'fit':<24}{'wall time [s]':>15}{'peak memory [MiB]':>20}{'log-likelihood':>17}")
+        for label, gmm, elapsed, peak in results:
+            score = mean_log_likelihood(gmm, path, args.chunk_size)
+            print(f"{label:<24}{elapsed:>15.2f}{peak / 1024**2:>20.1f}{score:>17.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+check_regressions.py
+
+Regression checks for bugs found in review, run on synthetic data from
+benchmarks/synthetic.py in a temporary directory. Each check prints one
+line; the script exits with status 1 if any check fails.
+
+Usage:
+    python -m benchmarks.check_regressions
+    python -m benchmarks.check_regressions catalog_filtered_update
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import write_cdf_files
+
+def catalog_filtered_update(tmp):
+    """
+    Catalog.update with a pattern keeps the cataloged files outside the pattern.
+    """
+    from scripts.catalog import Catalog
+    from scripts.cdf_index import CDFIndex
+    data_dir = os.path.join(tmp, 'data')
+    write_cdf_files(data_dir, 600, 120)
+    with Catalog(os.path.join(tmp, 'catalog.sqlite'), CDFIndex(os.path.join(tmp, 'index'))) as catalog:
+        catalog.update(data_dir)
+        n_files = len(catalog.files(directory=data_dir))
+        counts = catalog.update(data_dir, pattern='*040000*')
+        kept = len(catalog.files(directory=data_dir))
+        os.remove(catalog.files(directory=data_dir, pattern='*040000*')[0])
+        removed = catalog.update(data_dir, pattern='*040000*')['removed']
+        remaining = len(catalog.files(directory=data_dir))
+    assert counts['removed'] == 0 and kept == n_files, f"{n_files} files cataloged, {kept} kept: {counts}"
+    assert removed == 1 and remaining == n_files - 1, f"deleted file: {removed} removed, {remaining} remaining"
+
+def partitions_past_midnight(tmp):
+    """
+    Records running past midnight into a day on which no file starts get a partition.
+    """
+    from scripts.catalog import Catalog
+    from scripts.cdf_index import CDFIndex
+    from scripts.partitions import process_partitions, read_partitioned
+    data_dir = os.path.join(tmp, 'data')
+    write_cdf_files(data_dir, 3000, 150, start=pd.Timestamp('2015-10-16 23:10'))
+    energy_bins = np.logspace(np.log10(10), np.log10(30000), 32)
+    index = CDFIndex(os.path.join(tmp, 'index'))
+    with Catalog(os.path.join(tmp, 'catalog.sqlite'), index) as catalog:
+        catalog.update(data_dir)
+        for name, source in (('index', {'index': index}), ('catalog', {'catalog': catalog})):
+            output_dir = os.path.join(tmp, name)
+            process_partitions(data_dir, energy_bins, output_dir, probes=['mms1'], n_jobs=1, **source)
+            features_df = read_partitioned(output_dir)
+            assert len(features_df) == 3000, f"{len(features_df)} of 3000 minutes with the {name}"
+
+def ellipses_all_covariance_types(tmp):
+    """
+    plot_gmm_ellipses draws one ellipse per component for every covariance_type.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from benchmarks.synthetic import make_features
+    from models.clustering import train_gmm
+    from visualization.vis_v3 import plot_gmm_ellipses
+    features_df = make_features(5000)
+    for covariance_type in ('full', 'tied', 'diag', 'spherical'):
+        gmm = train_gmm(features_df, 4, covariance_type)
+        fig, ax = plt.subplots()
+        plot_gmm_ellipses(ax, gmm, features_df.to_numpy(), dims=(0, 2))
+        n_patches = len(ax.patches)
+        plt.close(fig)
+        assert n_patches == 4, f"{covariance_type}: {n_patches} ellipses"
+
+def cache_shared_B_minutes(tmp):
+    """
+    Features of minutes whose Btot is merged from two files are recomputed, not taken
+    from the cache entry of either file.
+    """
+    from spacepy import pycdf
+    from scripts.cache import FileCache, process_cdf_files_cached
+    from scripts.feature_engineering import extract_features
+    data_dir = os.path.join(tmp, 'data')
+    paths = write_cdf_files(data_dir, 120, 60)
+    # The second file's B records start in the last minute of the first file.
+    with pycdf.CDF(paths[1]) as cdf:
+        variables = {name: cdf[name][...] for name in cdf}
+    os.remove(paths[1])
+    B_var = next(name for name in variables if '_fgm_' in name)
+    first = pd.Timestamp(variables['Epoch'][0])
+    extra = [(first - pd.Timedelta(seconds=s)).to_pydatetime() for s in (20, 10)]
+    with pycdf.CDF(paths[1], '') as cdf:
+        for name, values in variables.items():
+            if name != B_var:
+                cdf[name] = values
+        cdf['Epoch_fgm'] = extra + list(variables['Epoch'])
+        cdf[B_var] = np.concatenate([np.full((2, 4), 500.0), variables[B_var]])
+        cdf[B_var].attrs['DEPEND_0'] = 'Epoch_fgm'
+    energy_bins = np.logspace(np.log10(10), np.log10(30000), 32)
+    ion_spec_df, B_field_df, features_df = process_cdf_files_cached(data_dir, energy_bins,
+                                                                    FileCache(os.path.join(tmp, 'cache')))
+    expected = extract_features(ion_spec_df, B_field_df['Btot'], energy_bins)
+    different = ~np.isclose(features_df.to_numpy(dtype=float), expected.to_numpy(), equal_nan=True).all(axis=1)
+    assert not different.any(), f"cached features differ at {list(features_df.index[different])}"
+
+CHECKS = [catalog_filtered_update, partitions_past_midnight, ellipses_all_covariance_types, cache_shared_B_minutes]
+
+def main():
+    selected = sys.argv[1:]
+    failed = 0
+    for check in CHECKS:
+        if selected and check.__name__ not in selected:
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                check(tmp)
+                print(f"ok      {check.__name__}")
+            except Exception as e:
+                failed += 1
+                print(f"FAILED  {check.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py
+
+Benchmark suite covering every pipeline stage on synthetic MMS-shaped data
+(see synthetic.py):
+
+    load_cdf_files       decode + resample of synthetic CDF files (read_cdf.py)
+    resample             1-minute resampling of native-cadence frames
+    process_spectrum     the per-spectrum feature function, called row by row
+    process_all_spectra  batch feature extraction (extract_features)
+    train_gmm            in-memory GMM fit (clustering.py)
+    predict              GaussianMixture.predict
+
+Each (stage, size) pair runs in a fresh process, so the reported peak RSS
+(the process high-water mark, including the untimed input generation) is not
+inflated by earlier runs. Results are saved as JSON; with --baseline the
+wall times are compared against a stored result file and regressions beyond
+--tolerance are flagged (exit status 1).
+
+Usage:
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 100000 1000000
+    python -m benchmarks.run_benchmarks --save-baseline
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+
+STAGES = ('load_cdf_files', 'resample', 'process_spectrum', 'process_all_spectra', 'train_gmm', 'predict')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+def _setup(stage, size, tmp):
+    """
+    Build the inputs of a stage (not timed) and return the callable to time.
+    """
+    from benchmarks import synthetic
+    
+    if stage == 'load_cdf_files':
+        from scripts.read_cdf import load_cdf_files
+        synthetic.write_cdf_files(tmp, size)
+        return lambda: load_cdf_files(tmp)
+    if stage == 'resample':
+        ion_df, B_df = synthetic.make_native_data(size)
+        return lambda: (ion_df.resample('1Min').mean(), B_df.resample('1Min').mean())
+    if stage == 'process_spectrum':
+        from scripts.feature_engineering import process_spectrum
+        ion_spec_df, B_field_df = synthetic.make_minute_data(size)
+        spectra, Btot = ion_spec_df.to_numpy(), B_field_df['Btot'].to_numpy()
+        return lambda: [process_spectrum(spectra[i], Btot[i], synthetic.ENERGY_BINS) for i in range(size)]
+    if stage == 'process_all_spectra':
+        from scripts.feature_engineering import extract_features
+        ion_spec_df, B_field_df = synthetic.make_minute_data(size)
+        return lambda: extract_features(ion_spec_df, B_field_df['Btot'], synthetic.ENERGY_BINS)
+    if stage == 'train_gmm':
+        from models.clustering import train_gmm
+        features_df = synthetic.make_features(size)
+        return lambda: train_gmm(features_df)
+    if stage == 'predict':
+        from models.clustering import train_gmm
+        gmm = train_gmm(synthetic.make_features(10000, seed=1))
+        features_df = synthetic.make_features(size)
+        return lambda: gmm.predict(features_df)
+    raise ValueError(f"Unknown stage '{stage}'")
+
+def run_stage(stage, size, repeat=3):
+    """
+    Run one stage on one input size and measure it (called in a fresh process).
+    The reported wall time is the best of repeat runs.
+    """
+    import warnings
+    warnings.simplefilter('ignore')
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        func = _setup(stage, size, tmp)
+        seconds = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            seconds = min(seconds, time.perf_counter() - start)
+    return {
+        'stage': stage,
+        'size': size,
+        'seconds': seconds,
+        'throughput': size / seconds if seconds > 0 else float('inf'),
+        'peak_rss_mb': _peak_rss_mb()
+    }
+
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    """
+    Flag results whose wall time exceeds the baseline by more than tolerance.
+    Runs shorter than min_seconds are too noisy to compare and are ignored.
+    
+    Returns:
+        list: (stage, size, seconds, baseline_seconds) of each regression
+    """
+    reference = {(r['stage'], r['size']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for r in results:
+        base = reference.get((r['stage'], r['size']))
+        if base is not None and max(r['seconds'], base) >= min_seconds and r['seconds'] > base * (1 + tolerance):
+            regressions.append((r['stage'], r['size'], r['seconds'], base))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Input sizes in 1-minute bins (up to 10**7)")
+    parser.add_argument('--max-native-minutes', type=int, default=10000,
+                        help="Largest size for the native-cadence stages (load_cdf_files, resample)")
+    parser.add_argument('--max-loop-minutes', type=int, default=10000,
+                        help="Largest size for the row-by-row process_spectrum stage")
+    parser.add_argument('--output', default=None, help="Result file (default: benchmarks/results/<time>.json)")
+    parser.add_argument('--baseline', default=None, help="Result file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown (default 0.2)")
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help="Ignore runs shorter than this when comparing (default 0.05)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage and size; the best is kept")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Also store the results as {DEFAULT_BASELINE}")
+    args = parser.parse_args()
+    
+    limits = {'load_cdf_files': args.max_native_minutes, 'resample': args.max_native_minutes,
+              'process_spectrum': args.max_loop_minutes}
+    tasks = [(stage, size) for stage in args.stages for size in sorted(args.sizes)
+             if size <= limits.get(stage, size)]
+    
+    results = []
+    context = multiprocessing.get_context('spawn')
+    print(f"{'stage':<22}{'size':>10}{'seconds':>12}{'rows/s':>14}{'peak RSS [MB]':>16}")
+    for stage, size in tasks:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            r = executor.submit(run_stage, stage, size, args.repeat).result()
+        results.append(r)
+        print(f"{stage:<22}{size:>10}{r['seconds']:>12.3f}{r['throughput']:>14.0f}{r['peak_rss_mb']:>16.1f}")
+    
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {DEFAULT_BASELINE}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_seconds)
+        for stage, size, seconds, base in regressions:
+            print(f"REGRESSION {stage} size={size}: {seconds:.3f}s vs baseline {base:.3f}s")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
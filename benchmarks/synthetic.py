@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+synthetic.py
+
+Synthetic MMS-shaped inputs for the benchmarks.
+
+Minute spectra are drawn from a mix of the shapes the pipeline has to handle:
+single-peaked and double-peaked ion spectra, spectra rising with energy
+above 300 eV (which trigger the pseudofeature) and flat noise. A fraction of
+the minutes falls into NaN data gaps. Native-cadence data (FPI fast survey,
+4.5 s) and CDF files with the variables read by read_cdf.py can be derived
+from the same generator.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from scripts.feature_engineering import FEATURE_NAMES
+
+N_CHANNELS = 32
+ENERGY_BINS = np.logspace(np.log10(10), np.log10(30000), N_CHANNELS)
+NATIVE_CADENCE = pd.Timedelta('4.5s')
+START = pd.Timestamp('2015-10-17 00:00')
+
+def make_spectra(n_rows, seed=0, gap_fraction=0.02):
+    """
+    Generate n_rows ion spectra of 32 channels.
+    
+    Returns:
+        tuple: (spectra, kinds) - (n_rows, 32) counts and the shape of each row
+               ('single', 'double', 'pseudofeature' or 'noise'; 'gap' for NaN rows)
+    """
+    rng = np.random.default_rng(seed)
+    channels = np.arange(N_CHANNELS)
+    kinds = rng.choice(np.array(['single', 'double', 'pseudofeature', 'noise']), size=n_rows,
+                       p=[0.5, 0.25, 0.15, 0.1])
+    
+    def peak(center, width, amplitude):
+        return amplitude * np.exp(-0.5 * ((channels - center) / width) ** 2)
+    
+    centers = rng.uniform(6, 26, (n_rows, 1))
+    widths = rng.uniform(1.5, 5, (n_rows, 1))
+    amplitudes = 10 ** rng.uniform(3, 6, (n_rows, 1))
+    spectra = peak(centers, widths, amplitudes)
+    
+    double = kinds == 'double'
+    spectra[double] += peak(rng.uniform(6, 26, (double.sum(), 1)), widths[double], amplitudes[double] / 3)
+    
+    pseudo = kinds == 'pseudofeature'
+    spectra[pseudo] = amplitudes[pseudo] * (ENERGY_BINS / ENERGY_BINS[-1]) ** rng.uniform(0.5, 2, (pseudo.sum(), 1))
+    
+    noise = kinds == 'noise'
+    spectra[noise] = 10 ** rng.uniform(0, 2, (noise.sum(), N_CHANNELS))
+    
+    spectra *= rng.lognormal(0, 0.1, spectra.shape)
+    spectra += 1.0
+    
+    # NaN gaps come in blocks of consecutive minutes.
+    n_gaps = int(n_rows * gap_fraction / 10)
+    for start in rng.integers(0, max(n_rows - 10, 1), n_gaps):
+        spectra[start:start + 10] = np.nan
+        kinds[start:start + 10] = 'gap'
+    return spectra, kinds
+
+def make_minute_data(n_minutes, seed=0):
+    """
+    1-minute resampled inputs as produced by read_cdf.load_cdf_files.
+    
+    Returns:
+        tuple: (ion_spec_df, B_field_df)
+    """
+    spectra, _ = make_spectra(n_minutes, seed)
+    index = pd.date_range(START, periods=n_minutes, freq='1min')
+    rng = np.random.default_rng(seed + 1)
+    Btot = np.abs(rng.normal(30, 20, n_minutes))
+    return pd.DataFrame(spectra, index=index), pd.DataFrame({'Btot': Btot}, index=index)
+
+def make_native_data(n_minutes, seed=0):
+    """
+    Native-cadence (4.5 s) ion spectra and B field covering n_minutes.
+    
+    Returns:
+        tuple: (ion_df, B_df) indexed by record time
+    """
+    n_records = int(n_minutes * pd.Timedelta('1min') / NATIVE_CADENCE)
+    rng = np.random.default_rng(seed)
+    offsets = np.arange(n_records) * NATIVE_CADENCE.value + rng.integers(0, 10**8, n_records)
+    index = START + pd.to_timedelta(np.sort(offsets), unit='ns')
+    spectra, _ = make_spectra(n_minutes, seed)
+    minute = ((index - START) // pd.Timedelta('1min')).to_numpy().clip(max=n_minutes - 1)
+    ion = spectra[minute] * rng.lognormal(0, 0.05, (n_records, N_CHANNELS))
+    Btot = np.abs(rng.normal(30, 20, n_records))
+    return pd.DataFrame(ion, index=index), pd.DataFrame({'Btot': Btot}, index=index)
+
+def write_cdf_files(directory, n_minutes, minutes_per_file=120, seed=0, probe='mms1', start=START):
+    """
+    Write synthetic CDF files with the variables read by read_cdf.read_cdf_file.
+    
+    Returns:
+        list: Paths of the written files, in time order.
+    """
+    from spacepy import pycdf
+    
+    os.makedirs(directory, exist_ok=True)
+    ion_df, B_df = make_native_data(n_minutes, seed)
+    ion_df.index = ion_df.index + (start - START)
+    B_df.index = B_df.index + (start - START)
+    file_starts = pd.date_range(start, periods=-(-n_minutes // minutes_per_file),
+                                freq=pd.Timedelta(minutes=minutes_per_file))
+    paths = []
+    for file_start in file_starts:
+        mask = (ion_df.index >= file_start) & (ion_df.index < file_start + pd.Timedelta(minutes=minutes_per_file))
+        path = os.path.join(directory, f"{probe}_fpi_fast_l2_dis-moms_{file_start:%Y%m%d%H%M%S}_v3.4.0.cdf")
+        if os.path.exists(path):
+            os.remove(path)
+        with pycdf.CDF(path, '') as cdf:
+            cdf['Epoch'] = ion_df.index[mask].to_pydatetime()
+            cdf[f'{probe}_dis_energyspectr_px_fast'] = ion_df.to_numpy()[mask]
+            B = np.zeros((mask.sum(), 4))
+            B[:, 0] = B_df['Btot'].to_numpy()[mask]
+            B[:, 3] = B[:, 0]
+            cdf[f'{probe}_fgm_b_gse_brst_l2'] = B
+        paths.append(path)
+    return paths
+
+def write_fgm_files(directory, n_minutes, rate_hz=16, minutes_per_file=120, seed=0, probe='mms1', start=START,
+                    data_rate='srvy'):
+    """
+    Write synthetic FGM CDF files with their own high-cadence epoch.
+    
+    Returns:
+        list: Paths of the written files, in time order.
+    """
+    from spacepy import pycdf
+    
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for file_start in pd.date_range(start, periods=-(-n_minutes // minutes_per_file),
+                                    freq=pd.Timedelta(minutes=minutes_per_file)):
+        n_records = int(min(minutes_per_file, n_minutes - (file_start - start) / pd.Timedelta('1min')) * 60 * rate_hz)
+        offsets = np.arange(n_records) * int(1e9 / rate_hz) + rng.integers(0, 10**6, n_records)
+        epoch = file_start + pd.to_timedelta(offsets, unit='ns')
+        B = np.zeros((n_records, 4))
+        B[:, :3] = rng.normal(0, 20, (n_records, 3))
+        B[:, 3] = np.linalg.norm(B[:, :3], axis=1)
+        path = os.path.join(directory, f"{probe}_fgm_{data_rate}_l2_{file_start:%Y%m%d%H%M%S}_v4.18.0.cdf")
+        if os.path.exists(path):
+            os.remove(path)
+        with pycdf.CDF(path, '') as cdf:
+            cdf['Epoch'] = epoch.to_pydatetime()
+            cdf[f'{probe}_fgm_b_gse_{data_rate}_l2'] = B
+            cdf[f'{probe}_fgm_b_gse_{data_rate}_l2'].attrs['DEPEND_0'] = 'Epoch'
+        paths.append(path)
+    return paths
+
+def make_features(n_rows, seed=0):
+    """
+    Synthetic features with four clusters, including the all-zero pseudofeature rows.
+    """
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0.20, 1.00, 0.50], [0.50, 0.80, 1.00], [0.10, 1.10, 0.20], [0.0, 0.0, 0.0]])
+    scales = np.array([[0.05, 0.05, 0.20], [0.10, 0.02, 0.05], [0.02, 0.10, 0.10], [1e-3, 1e-3, 1e-3]])
+    labels = rng.choice(4, size=n_rows, p=[0.3, 0.3, 0.25, 0.15])
+    values = centers[labels] + rng.normal(size=(n_rows, 3)) * scales[labels]
+    index = pd.date_range('2015-09-01', periods=n_rows, freq='1min')
+    return pd.DataFrame(values, index=index, columns=list(FEATURE_NAMES))
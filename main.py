@@ -1,6 +1,196 @@
-#simple main.py
-def main():
-    print("Hello, World!")
+#!/usr/bin/env python3
+"""
+main.py
+
+Command-line entry point of the MMS GMM pipeline.
+
+Without a command (or with `run`), the whole pipeline (CDF ingest, feature
+extraction, GMM training and plotting) runs as a dependency graph: stages
+whose outputs are newer than their inputs and code are skipped, and
+independent stages run concurrently. The other commands run one step.
+
+Startup is kept short: only the standard library is imported here, and each
+command imports the modules it needs when it runs. `predict` loads the .npz
+export of the model (see models/inference.py), so it does not import
+scikit-learn, SciPy or matplotlib. --timing reports the startup time (process
+start to command dispatch) and the time of the command itself.
+
+Usage:
+    python main.py                         # uses pipeline.json if present
+    python main.py --config reprocess.json --n-jobs 4
+    python main.py --dry-run
+    python main.py --force
+    python main.py ingest                  # ingest stage(s) of the config only
+    python main.py features
+    python main.py train
+    python main.py predict --features data/processed/features.frame --output data/processed/labels.frame
+    python main.py plot --mode sample
+    python main.py inspect data --report
+    python main.py --timing predict
+    python main.py --config reprocess.json --timing
+"""
+
+import time
+_START = time.perf_counter()
+
+import argparse
+import os
+import sys
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline.json')
+
+# Pipeline stages run by each single-step command.
+COMMAND_STAGES = {
+    'ingest': ['ingest'],
+    'features': ['features', 'combine'],
+    'train': ['train']
+}
+
+COMMANDS = ['run', *COMMAND_STAGES, 'predict', 'plot', 'inspect']
+
+def _process_age():
+    """
+    Seconds since the process started (interpreter startup included), or None
+    where /proc is not available.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+def _config_path(path):
+    if path is None and os.path.exists(DEFAULT_CONFIG_PATH):
+        return DEFAULT_CONFIG_PATH
+    return path
+
+def run(args, stages=None):
+    """
+    Run the pipeline graph of the config, optionally restricted to some stage types.
+    """
+    from scripts.pipeline import load_config, run_pipeline
+    overrides = {'stages': stages} if stages else None
+    results = run_pipeline(load_config(_config_path(args.config), overrides), args.force, args.dry_run, args.n_jobs)
+    if args.dry_run:
+        return 0
+    
+    print("\nStage summary:")
+    for name, result in results.items():
+        line = f"  {name:<24}{result['status']:<9}"
+        if result['status'] == 'ran':
+            line += f"{result['seconds']:.2f} s"
+        elif result['error']:
+            line += result['error']
+        print(line)
+    return 1 if any(result['status'] in ('failed', 'blocked') for result in results.values()) else 0
+
+def predict(args):
+    """
+    Label every minute of a feature table and write the labels table ('cluster' column).
+    """
+    import numpy as np
+    import pandas as pd
+    from models.inference import GMMPredictor
+    from scripts.feature_engineering import FEATURE_NAMES
+    from scripts.storage import read_table, write_table
+    predictor = GMMPredictor(args.model)
+    features_df = read_table(args.features)
+    X = features_df[list(FEATURE_NAMES)]
+    labels = [predictor.predict(X.iloc[start:start + args.chunk_size].to_numpy(dtype=float))
+              for start in range(0, len(X), args.chunk_size)]
+    labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int64)
+    labels_df = pd.DataFrame({'cluster': labels}, index=features_df.index)
+    write_table(labels_df, args.output)
+    print(f"Labeled {len(labels_df)} minutes -> {args.output}")
+    return 0
+
+def plot(args):
+    """
+    Write the density, pair and 3D cluster figures.
+    """
+    from visualization.density import render_figures
+    render_figures(args.features, args.model, args.labels, args.output_dir, args.mode, args.bins, args.max_points)
+    return 0
+
+def inspect(args):
+    """
+    Update the CDF catalog of a directory and optionally write an inspection report.
+    """
+    if args.report:
+        from scripts.inspect_cdf import write_report
+        write_report(args.data_dir)
+        return 0
+    from scripts.catalog import Catalog
+    with Catalog() as catalog:
+        counts = catalog.update(args.data_dir)
+        print(', '.join(f"{n} {status}" for status, n in counts.items()))
+        print(catalog.summary()[['path', 'n_records', 'start', 'end']].to_string(index=False))
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the MMS GMM pipeline.")
+    parser.add_argument('--timing', action='store_true', help="Report startup and command time")
+    # --timing is accepted after the command too; SUPPRESS keeps a flag given before it.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--timing', action='store_true', default=argparse.SUPPRESS,
+                        help="Report startup and command time")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    def pipeline_flags(sub):
+        sub.add_argument('--config', default=None,
+                         help="JSON pipeline config (default: pipeline.json next to main.py, if present)")
+        sub.add_argument('--n-jobs', type=int, default=None, help="Number of stages run concurrently")
+        sub.add_argument('--force', action='store_true', help="Rerun all stages, even if fresh")
+        sub.add_argument('--dry-run', action='store_true', help="Only show which stages would run")
+    
+    pipeline_flags(subparsers.add_parser('run', parents=[common], help="Run the whole pipeline (default)"))
+    for command, stages in COMMAND_STAGES.items():
+        pipeline_flags(subparsers.add_parser(command, parents=[common],
+                                             help=f"Run the {'/'.join(stages)} stage(s) of the config"))
+    
+    sub = subparsers.add_parser('predict', parents=[common], help="Label a feature table with a trained model")
+    sub.add_argument('--features', default='data/processed/features.frame')
+    sub.add_argument('--model', default='models/gmm_model.pkl')
+    sub.add_argument('--output', default='data/processed/labels.frame')
+    sub.add_argument('--chunk-size', type=int, default=1000000)
+    
+    sub = subparsers.add_parser('plot', parents=[common], help="Render the cluster figures")
+    sub.add_argument('--features', default='data/processed/features.frame')
+    sub.add_argument('--model', default='models/gmm_model.pkl')
+    sub.add_argument('--labels', default='data/processed/labels.frame',
+                     help="Stored cluster labels to reuse ('' to predict all minutes)")
+    sub.add_argument('--output-dir', default='output_figures')
+    sub.add_argument('--mode', choices=['density', 'sample'], default='density')
+    sub.add_argument('--bins', type=int, default=400)
+    sub.add_argument('--max-points', type=int, default=100000)
+    
+    sub = subparsers.add_parser('inspect', parents=[common], help="Catalog the CDF files of a directory")
+    sub.add_argument('data_dir', nargs='?', default='data')
+    sub.add_argument('--report', action='store_true', help="Also write a full inspection report")
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_parser()
+    # Keep `python main.py [--config ...]` running the whole pipeline.
+    position = 1 if argv[:1] == ['--timing'] else 0
+    if not (argv[position:position + 1] and (argv[position] in COMMANDS or argv[position] in ('-h', '--help'))):
+        argv.insert(position, 'run')
+    args = parser.parse_args(argv)
+    
+    dispatched = time.perf_counter()
+    if args.command in COMMAND_STAGES:
+        status = run(args, COMMAND_STAGES[args.command])
+    else:
+        status = {'run': run, 'predict': predict, 'plot': plot, 'inspect': inspect}[args.command](args)
+    if args.timing:
+        age = _process_age()
+        total = f" ({age - (time.perf_counter() - dispatched):.2f} s including interpreter startup)" if age else ""
+        print(f"Startup: {dispatched - _START:.3f} s{total}, {args.command}: {time.perf_counter() - dispatched:.2f} s")
+    return status
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -3,14 +3,25 @@
 clustering.py
 
 This script trains a Gaussian Mixture Model (GMM) on the engineered features and saves the model.
+
+Besides the in-memory fit (train_gmm), train_gmm_minibatch fits the same model
+out of core: feature chunks are streamed from disk and EM runs on sufficient
+statistics accumulated over the chunks, so memory does not grow with the
+number of training rows. The result is a regular GaussianMixture.
 """
 
 import os
+import numpy as np
 import pandas as pd
+from scipy.linalg import solve_triangular
+from scipy.special import logsumexp
 from sklearn.mixture import GaussianMixture
 import joblib
+from scripts.instrumentation import instrumented, stage
+from scripts.storage import iter_table, read_table
 
-def train_gmm(features_df, n_components=4, covariance_type='full', random_state=42):
+@instrumented('gmm.fit')
+def train_gmm(features_df, n_components=4, covariance_type='full', random_state=42, dtype=None):
     """
     Trains a GMM with the specified number of components and covariance type.
     
@@ -19,10 +30,14 @@ def train_gmm(features_df, n_components=4, covariance_type='full', random_state=
         n_components (int): Number of clusters (default is 4).
         covariance_type (str): Type of covariance to use (default 'full').
         random_state (int): Random seed for reproducibility.
+        dtype: Fit in this floating point type (e.g. float32 for the compact path);
+               default: the type of the features.
     
     Returns:
         gmm (GaussianMixture): Trained GMM model.
     """
+    if dtype is not None:
+        features_df = features_df.astype(dtype, copy=False)
     gmm = GaussianMixture(
         n_components=n_components,
         covariance_type=covariance_type,
@@ -31,27 +46,277 @@ def train_gmm(features_df, n_components=4, covariance_type='full', random_state=
     gmm.fit(features_df)
     return gmm
 
+def _full_precisions_cholesky(gmm):
+    """
+    Per-component Cholesky factors of the precision matrices, shape (K, D, D),
+    for any covariance_type.
+    """
+    n_components, n_features = gmm.means_.shape
+    prec_chol = gmm.precisions_cholesky_
+    if gmm.covariance_type == 'full':
+        return prec_chol
+    if gmm.covariance_type == 'tied':
+        return np.broadcast_to(prec_chol, (n_components, n_features, n_features))
+    if gmm.covariance_type == 'diag':
+        return np.stack([np.diag(p) for p in prec_chol])
+    return prec_chol[:, None, None] * np.eye(n_features)
+
+def _full_covariances(gmm):
+    """
+    Per-component covariance matrices, shape (K, D, D), for any covariance_type.
+    """
+    n_components, n_features = gmm.means_.shape
+    covariances = gmm.covariances_
+    if gmm.covariance_type == 'full':
+        return covariances
+    if gmm.covariance_type == 'tied':
+        return np.broadcast_to(covariances, (n_components, n_features, n_features))
+    if gmm.covariance_type == 'diag':
+        return np.stack([np.diag(c) for c in covariances])
+    return covariances[:, None, None] * np.eye(n_features)
+
+def _estimate_log_prob_resp(gmm, X):
+    """
+    E-step for a chunk: per-sample log-likelihood and responsibilities.
+    """
+    prec_chol = _full_precisions_cholesky(gmm)
+    n_features = X.shape[1]
+    log_det = np.log(np.diagonal(prec_chol, axis1=1, axis2=2)).sum(axis=1)
+    
+    weighted_log_prob = np.empty((len(X), gmm.n_components))
+    for k in range(gmm.n_components):
+        y = (X - gmm.means_[k]) @ prec_chol[k]
+        weighted_log_prob[:, k] = -0.5 * (n_features * np.log(2 * np.pi) + np.sum(y**2, axis=1)) + log_det[k]
+    weighted_log_prob += np.log(gmm.weights_)
+    
+    log_prob = logsumexp(weighted_log_prob, axis=1)
+    resp = np.exp(weighted_log_prob - log_prob[:, None])
+    return log_prob, resp
+
+def _chunk_statistics(gmm, X, sample_weight=None):
+    """
+    Sufficient statistics of one chunk under the current model: weighted
+    responsibility sums N_k, first moments S_k, second moments Q_k, total
+    weight and weighted log-likelihood.
+    """
+    log_prob, resp = _estimate_log_prob_resp(gmm, X)
+    if sample_weight is not None:
+        resp = resp * sample_weight[:, None]
+        log_prob = log_prob * sample_weight
+    return {
+        'N': resp.sum(axis=0),
+        'S': resp.T @ X,
+        'Q': np.stack([(X * resp[:, k:k + 1]).T @ X for k in range(resp.shape[1])]),
+        'weight': len(X) if sample_weight is None else sample_weight.sum(),
+        'log_likelihood': log_prob.sum()
+    }
+
+def _add_statistics(total, stats, scale=1.0):
+    if total is None:
+        return {key: value * scale for key, value in stats.items()}
+    for key, value in stats.items():
+        total[key] = total[key] + value * scale
+    return total
+
+def _m_step(gmm, stats, reg_covar):
+    """
+    Set the parameters of gmm from accumulated sufficient statistics (as in
+    GaussianMixture's M-step).
+    """
+    n_features = stats['S'].shape[1]
+    N = stats['N'] + 10 * np.finfo(float).eps
+    means = stats['S'] / N[:, None]
+    covariances = stats['Q'] / N[:, None, None] - np.einsum('kd,ke->kde', means, means)
+    covariances += reg_covar * np.eye(n_features)
+    
+    if gmm.covariance_type == 'full':
+        cov = covariances
+    elif gmm.covariance_type == 'tied':
+        cov = np.einsum('k,kde->de', N, covariances - reg_covar * np.eye(n_features)) / N.sum()
+        cov += reg_covar * np.eye(n_features)
+    elif gmm.covariance_type == 'diag':
+        cov = np.diagonal(covariances, axis1=1, axis2=2).copy()
+    else:
+        cov = np.diagonal(covariances, axis1=1, axis2=2).mean(axis=1)
+    
+    gmm.weights_ = N / N.sum()
+    gmm.means_ = means
+    gmm.covariances_ = cov
+    _set_precisions(gmm)
+
+def _set_precisions(gmm):
+    """
+    Compute precisions_cholesky_ and precisions_ from covariances_.
+    """
+    cov = gmm.covariances_
+    if gmm.covariance_type in ('full', 'tied'):
+        covs = cov if gmm.covariance_type == 'full' else cov[None]
+        prec_chol = np.empty_like(covs)
+        for k, c in enumerate(covs):
+            try:
+                cov_chol = np.linalg.cholesky(c)
+            except np.linalg.LinAlgError:
+                raise ValueError("Fitting the mixture model failed because some components have "
+                                 "ill-defined empirical covariance. Try increasing reg_covar.")
+            prec_chol[k] = solve_triangular(cov_chol, np.eye(len(c)), lower=True).T
+        gmm.precisions_cholesky_ = prec_chol if gmm.covariance_type == 'full' else prec_chol[0]
+        if gmm.covariance_type == 'full':
+            gmm.precisions_ = np.einsum('kij,klj->kil', prec_chol, prec_chol)
+        else:
+            gmm.precisions_ = gmm.precisions_cholesky_ @ gmm.precisions_cholesky_.T
+    else:
+        if np.any(cov <= 0):
+            raise ValueError("Fitting the mixture model failed because some components have "
+                             "ill-defined empirical covariance. Try increasing reg_covar.")
+        gmm.precisions_cholesky_ = 1.0 / np.sqrt(cov)
+        gmm.precisions_ = 1.0 / cov
+
+def _as_chunk(chunk):
+    """
+    Split a chunk into a float array and optional sample weights. A chunk is a
+    DataFrame or array of features, or an (X, sample_weight) tuple.
+    """
+    if isinstance(chunk, tuple):
+        X, sample_weight = chunk
+        return np.asarray(X, dtype=float), np.asarray(sample_weight, dtype=float)
+    return np.asarray(chunk, dtype=float), None
+
+@instrumented('gmm.fit_minibatch')
+def train_gmm_minibatch(chunks, n_components=4, covariance_type='full', random_state=42,
+                        mode='batch', max_iter=100, tol=1e-3, reg_covar=1e-6,
+                        step_decay=0.6, chunk_size=100000, init_model=None):
+    """
+    Trains a GMM on feature chunks streamed from disk instead of an in-memory DataFrame.
+    
+    Two EM variants are available:
+      - 'batch': every iteration passes over all chunks, accumulating the sufficient
+        statistics of the E-step, followed by one M-step. This is exact EM, the
+        same algorithm as GaussianMixture.fit, with memory bounded by the chunk size.
+      - 'online': stepwise EM. The statistics of each chunk are blended into running
+        statistics with step size (t + 2) ** -step_decay and an M-step follows every
+        chunk; max_iter is then the number of passes over the data.
+    
+    Parameters:
+        chunks: Path to a feature table (read with storage.iter_table), or a callable
+                returning a fresh iterable of chunks for every pass. A chunk is a
+                DataFrame/array of features or an (X, sample_weight) tuple.
+        n_components (int): Number of clusters (default is 4).
+        covariance_type (str): 'full', 'tied', 'diag' or 'spherical' (default 'full').
+        random_state (int): Random seed used to initialize from the first chunk.
+        mode (str): 'batch' or 'online'.
+        max_iter (int): Maximum number of EM iterations ('batch') or passes ('online').
+        tol (float): Convergence threshold on the change of the mean log-likelihood.
+        reg_covar (float): Non-negative regularization added to the covariance diagonals.
+        step_decay (float): Decay exponent of the online step size, in (0.5, 1].
+        chunk_size (int): Rows per chunk when reading a feature table.
+        init_model (GaussianMixture or str): Model (or path to a joblib file) to warm-start from.
+    
+    Returns:
+        gmm (GaussianMixture): Trained GMM model, usable like one returned by train_gmm.
+    """
+    if mode not in ('batch', 'online'):
+        raise ValueError(f"Unknown mode '{mode}', expected 'batch' or 'online'")
+    if isinstance(chunks, str):
+        path = chunks
+        chunks = lambda: iter_table(path, chunk_size)
+    
+    gmm = GaussianMixture(
+        n_components=n_components,
+        covariance_type=covariance_type,
+        random_state=random_state,
+        reg_covar=reg_covar,
+        max_iter=max_iter,
+        tol=tol
+    )
+    feature_names = None
+    
+    if init_model is not None:
+        if isinstance(init_model, str):
+            with stage('io.load_model'):
+                init_model = joblib.load(init_model)
+        if init_model.n_components != n_components or init_model.covariance_type != covariance_type:
+            raise ValueError("init_model must have the same n_components and covariance_type")
+        gmm.weights_ = init_model.weights_.copy()
+        gmm.means_ = init_model.means_.copy()
+        gmm.covariances_ = init_model.covariances_.copy()
+        _set_precisions(gmm)
+        feature_names = getattr(init_model, 'feature_names_in_', None)
+    else:
+        # Initialize with an in-memory fit on the first chunk.
+        first = next(iter(chunks()))
+        X, sample_weight = _as_chunk(first)
+        init = GaussianMixture(n_components=n_components, covariance_type=covariance_type,
+                               random_state=random_state, reg_covar=reg_covar)
+        init.fit(X)
+        gmm.weights_, gmm.means_, gmm.covariances_ = init.weights_, init.means_, init.covariances_
+        _set_precisions(gmm)
+    
+    lower_bound = -np.inf
+    gmm.converged_ = False
+    n_steps = 0
+    for n_iter in range(1, max_iter + 1):
+        total = None
+        for chunk in chunks():
+            if feature_names is None and isinstance(chunk, pd.DataFrame):
+                feature_names = np.asarray(chunk.columns, dtype=object)
+            X, sample_weight = _as_chunk(chunk)
+            if len(X) == 0:
+                continue
+            stats = _chunk_statistics(gmm, X, sample_weight)
+            if mode == 'batch':
+                total = _add_statistics(total, stats)
+            else:
+                # Running statistics are kept per unit weight.
+                step = (n_steps + 2) ** -step_decay
+                scaled = {key: value / stats['weight'] for key, value in stats.items()}
+                if total is None:
+                    total = scaled
+                else:
+                    total = _add_statistics({k: v * (1 - step) for k, v in total.items()}, scaled, step)
+                _m_step(gmm, total, reg_covar)
+                n_steps += 1
+        if total is None:
+            raise ValueError("No training data in chunks")
+        
+        if mode == 'batch':
+            _m_step(gmm, total, reg_covar)
+        previous, lower_bound = lower_bound, total['log_likelihood'] / total['weight']
+        if abs(lower_bound - previous) < tol:
+            gmm.converged_ = True
+            break
+    
+    gmm.n_iter_ = n_iter
+    gmm.lower_bound_ = lower_bound
+    gmm.n_features_in_ = gmm.means_.shape[1]
+    if feature_names is not None and all(isinstance(name, str) for name in feature_names):
+        gmm.feature_names_in_ = np.asarray(feature_names, dtype=object)
+    return gmm
+
+@instrumented('io.save_model')
 def save_model(model, model_path):
     """
-    Saves the trained model to disk using joblib.
+    Saves the trained model to disk using joblib. A Gaussian mixture is also
+    exported to a .npz file next to it, which inference.GMMPredictor loads
+    without importing scikit-learn.
     
     Parameters:
         model: The model object to be saved.
         model_path (str): File path where the model will be saved.
     """
     joblib.dump(model, model_path)
+    if isinstance(model, GaussianMixture):
+        from models.inference import export_model, exported_path
+        export_model(model, exported_path(model_path))
     print(f"Model saved to {model_path}")
 
 def main():
-    # Load engineered features from a CSV or DataFrame.
-    # For testing purposes, let's assume you've saved your features from feature_engineering.py.
-    # Alternatively, you can import process_all_spectra from feature_engineering and process your dummy data.
-    features_csv = "/Users/nathan/CursorProjects/gus_first_project /data/processed/features.csv"  # Update this if needed.
+    # Load engineered features saved by feature_engineering.py (a '.csv' path is also accepted).
+    features_path = os.path.join(os.path.dirname(__file__), "..", "data", "processed", "features.frame")
     
-    if not os.path.exists(features_csv):
-        raise FileNotFoundError(f"{features_csv} not found. Ensure you have generated your features first.")
+    if not os.path.exists(features_path):
+        raise FileNotFoundError(f"{features_path} not found. Ensure you have generated your features first.")
     
-    features_df = pd.read_csv(features_csv, index_col=0)
+    features_df = read_table(features_path)
     
     # Train the GMM model
     gmm_model = train_gmm(features_df)
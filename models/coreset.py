@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+coreset.py
+
+Trains the GMM on a small weighted coreset instead of every feature minute.
+
+Two reduction steps run before the fit:
+
+1. collapse_rows merges identical rows into one point whose weight is the
+   number of minutes it stands for. Every minute where the pseudofeature fires
+   or no peak is found is the point (0, 0, 0), so this alone removes a large
+   share of a mission. With a resolution, rows that fall in the same grid cell
+   (near-duplicates from quiet intervals) are merged into their weighted mean.
+   Feature tables are collapsed chunk by chunk, so memory is bounded by the
+   number of distinct points.
+2. lightweight_coreset draws a fixed number of points by importance sampling
+   (Bachem et al., "Scalable k-Means Clustering via Lightweight Coresets",
+   KDD 2018): half of the sampling mass is proportional to the weight of a
+   point and half to its weight times its squared standardized distance to the
+   data mean, so rare outlying regions are kept. A drawn point gets the weight
+   w / (m q), which makes every weighted sum over the coreset (and so the
+   log-likelihood of any model) an unbiased estimate of the sum over all
+   minutes.
+
+train_gmm_coreset then runs weighted EM (train_gmm_minibatch) on the coreset,
+so the fit costs the same for ten thousand or ten million minutes. The loss
+is checked empirically: log_likelihood_loss scores a model on all minutes in
+chunks (one cheap pass with GMMPredictor) and compares it with a reference
+model such as the full fit of train_gmm.
+
+Usage:
+    python -m models.coreset --features data/processed/features.frame --size 50000 --check
+"""
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from sklearn.mixture import GaussianMixture
+from models.clustering import save_model, train_gmm, train_gmm_minibatch
+from models.inference import GMMPredictor
+from scripts.instrumentation import instrumented, stage
+from scripts.storage import iter_table, read_table
+
+def collapse_rows(X, sample_weight=None, resolution=None):
+    """
+    Merge duplicate rows into weighted points.
+    
+    Parameters:
+        X (np.array): (n, d) features.
+        sample_weight (np.array): Weight of each row (default 1).
+        resolution (float or np.array): Grid cell size per feature. Rows in the same cell
+                                        are merged into their weighted mean. None merges
+                                        only identical rows.
+    
+    Returns:
+        tuple: (points of shape (m, d), weights of shape (m,)), in order of first occurrence.
+               The points keep the floating point type of X (float64 for other types).
+    """
+    X = np.asarray(X)
+    if not np.issubdtype(X.dtype, np.floating):
+        X = X.astype(float)
+    w = np.ones(len(X)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+    keys = X if resolution is None else np.floor(X / resolution)
+    # One 64-bit hash per row, then a hash-table factorize: linear in the number of rows.
+    hashed = pd.util.hash_pandas_object(pd.DataFrame(keys), index=False).to_numpy()
+    codes, uniques = pd.factorize(hashed)
+    n_points = len(uniques)
+    weights = np.bincount(codes, weights=w, minlength=n_points)
+    if resolution is not None:
+        points = np.column_stack([np.bincount(codes, weights=w * X[:, j], minlength=n_points)
+                                  for j in range(X.shape[1])])
+        return (points / np.where(weights > 0, weights, 1)[:, None]).astype(X.dtype, copy=False), weights
+    
+    first = np.empty(n_points, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(X) - 1, -1, -1)
+    points = X[first]
+    # Rows whose hash collides with a different row keep their own point.
+    same = (X == points[codes]) | (np.isnan(X) & np.isnan(points[codes]))
+    collided = np.flatnonzero(~same.all(axis=1))
+    if len(collided):
+        np.subtract.at(weights, codes[collided], w[collided])
+        points = np.concatenate([points, X[collided]])
+        weights = np.concatenate([weights, w[collided]])
+    return points, weights
+
+def collapse_table(features, chunk_size=1000000, resolution=None, dtype=None):
+    """
+    collapse_rows over a whole feature set, chunk by chunk.
+    
+    Parameters:
+        features: DataFrame, array, or path to a feature table (read with storage.iter_table).
+        chunk_size (int): Rows collapsed at a time.
+        resolution: See collapse_rows.
+        dtype: Floating point type of the points (e.g. float32 for the compact path);
+               default: the type of the features.
+    
+    Returns:
+        tuple: (points, weights, feature names or None)
+    """
+    if isinstance(features, str):
+        chunks = iter_table(features, chunk_size)
+    else:
+        chunks = (features[start:start + chunk_size] for start in range(0, len(features), chunk_size))
+    names = list(features.columns) if isinstance(features, pd.DataFrame) else None
+    points, weights = [], []
+    for chunk in chunks:
+        if isinstance(chunk, pd.DataFrame):
+            names = list(chunk.columns)
+        chunk = np.asarray(chunk) if dtype is None else np.asarray(chunk, dtype=dtype)
+        p, w = collapse_rows(chunk, resolution=resolution)
+        points.append(p)
+        weights.append(w)
+    if not points:
+        raise ValueError("No training data in features")
+    if len(points) == 1:
+        return points[0], weights[0], names
+    # Merge the per-chunk points; duplicates across chunks share a key again.
+    points, weights = collapse_rows(np.concatenate(points), np.concatenate(weights), resolution)
+    return points, weights, names
+
+def lightweight_coreset(points, weights, size, random_state=42):
+    """
+    Importance-sampled coreset of weighted points.
+    
+    Parameters:
+        points (np.array): (m, d) points.
+        weights (np.array): Weight of each point.
+        size (int): Number of draws. Points drawn more than once are merged, so the
+                    coreset can be smaller.
+        random_state (int): Seed of the draws.
+    
+    Returns:
+        tuple: (coreset points, coreset weights). The weights sum to the total weight
+               in expectation. With size >= m, the input is returned unchanged.
+    """
+    if len(points) <= size:
+        return points, weights
+    rng = np.random.default_rng(random_state)
+    total = weights.sum()
+    mean = weights @ points / total
+    scale = np.sqrt(weights @ (points - mean) ** 2 / total)
+    d2 = (((points - mean) / np.where(scale > 0, scale, 1)) ** 2).sum(axis=1)
+    q = 0.5 * weights / total + 0.5 * weights * d2 / max(weights @ d2, np.finfo(float).tiny)
+    q /= q.sum()
+    drawn, counts = np.unique(rng.choice(len(points), size=size, p=q), return_counts=True)
+    return points[drawn], counts * weights[drawn] / (size * q[drawn])
+
+@instrumented('gmm.fit_coreset')
+def train_gmm_coreset(features, n_components=4, covariance_type='full', random_state=42, coreset_size=50000,
+                      resolution=None, chunk_size=1000000, init_size=20000, max_iter=100, tol=1e-3,
+                      reg_covar=1e-6, dtype=None, return_report=False):
+    """
+    Trains a GMM on a weighted coreset of the features.
+    
+    Parameters:
+        features: DataFrame, array, or path to a feature table.
+        n_components (int): Number of clusters (default is 4).
+        covariance_type (str): Type of covariance to use (default 'full').
+        random_state (int): Random seed of the coreset draws and the initialization.
+        coreset_size (int): Number of importance-sampled draws.
+        resolution: Grid cell size for merging near-duplicate rows (see collapse_rows).
+        chunk_size (int): Rows collapsed at a time.
+        init_size (int): Size of the weight-proportional sample the initial GMM is fitted on.
+        max_iter, tol, reg_covar: EM settings, as in train_gmm_minibatch.
+        dtype: Floating point type of the collapsed points, the coreset and the initial fit
+               (e.g. float32 for the compact path); default: the type of the features. The
+               EM statistics over the coreset are accumulated in float64.
+        return_report (bool): Also return the size of each reduction step.
+    
+    Returns:
+        gmm (GaussianMixture): Trained GMM model. lower_bound_ is the coreset estimate of the
+                               mean log-likelihood per minute.
+        If return_report is set, a dict with 'n_rows', 'n_distinct' and 'n_coreset' follows.
+    """
+    with stage('gmm.coreset_collapse'):
+        points, weights, names = collapse_table(features, chunk_size, resolution, dtype)
+    with stage('gmm.coreset_sample'):
+        coreset, coreset_weights = lightweight_coreset(points, weights, coreset_size, random_state)
+    
+    # Initialize on a sample that follows the data distribution (points drawn by weight),
+    # as GaussianMixture.fit would on all minutes.
+    rng = np.random.default_rng(random_state)
+    init_rows = rng.choice(len(points), size=init_size, p=weights / weights.sum())
+    init_X = points[init_rows] if names is None else pd.DataFrame(points[init_rows], columns=names)
+    init = GaussianMixture(n_components=n_components, covariance_type=covariance_type,
+                           random_state=random_state, reg_covar=reg_covar).fit(init_X)
+    gmm = train_gmm_minibatch(lambda: [(coreset, coreset_weights)], n_components, covariance_type,
+                              random_state, max_iter=max_iter, tol=tol, reg_covar=reg_covar, init_model=init)
+    if return_report:
+        return gmm, {'n_rows': int(round(weights.sum())), 'n_distinct': len(points), 'n_coreset': len(coreset)}
+    return gmm
+
+def mean_log_likelihood(model, features, chunk_size=1000000):
+    """
+    Mean log-likelihood per minute of a model on a DataFrame, array or feature table.
+    """
+    predictor = GMMPredictor(model)
+    if isinstance(features, str):
+        chunks = iter_table(features, chunk_size)
+    else:
+        chunks = (features[start:start + chunk_size] for start in range(0, len(features), chunk_size))
+    total, count = 0.0, 0
+    for chunk in chunks:
+        total += predictor.score_samples(np.asarray(chunk, dtype=float)).sum()
+        count += len(chunk)
+    return total / count
+
+def log_likelihood_loss(model, reference_model, features, chunk_size=1000000):
+    """
+    Empirical check of a coreset fit: mean log-likelihood of both models on all minutes.
+    
+    Returns:
+        dict: 'log_likelihood', 'reference_log_likelihood' and 'loss', the reference minus
+              the model log-likelihood per minute (positive when the model fits worse).
+    """
+    score = mean_log_likelihood(model, features, chunk_size)
+    reference = mean_log_likelihood(reference_model, features, chunk_size)
+    return {'log_likelihood': score, 'reference_log_likelihood': reference, 'loss': reference - score}
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the GMM on a weighted coreset of the features.")
+    parser.add_argument('--features', default='data/processed/features.frame')
+    parser.add_argument('--model', default='models/gmm_model.pkl')
+    parser.add_argument('--size', type=int, default=50000, help="Coreset draws")
+    parser.add_argument('--resolution', type=float, default=None, help="Grid cell for near-duplicate rows")
+    parser.add_argument('--n-components', type=int, default=4)
+    parser.add_argument('--check', action='store_true',
+                        help="Also fit on all minutes and report the log-likelihood loss")
+    args = parser.parse_args()
+    
+    gmm, reduction = train_gmm_coreset(args.features, args.n_components, coreset_size=args.size,
+                                       resolution=args.resolution, return_report=True)
+    print(f"Coreset: {reduction['n_rows']} minutes -> {reduction['n_distinct']} distinct points "
+          f"-> {reduction['n_coreset']} weighted points")
+    if args.check:
+        report = log_likelihood_loss(gmm, train_gmm(read_table(args.features), args.n_components), args.features)
+        print(f"Mean log-likelihood: coreset fit {report['log_likelihood']:.4f}, "
+              f"full fit {report['reference_log_likelihood']:.4f}, loss {report['loss']:.4f}")
+    os.makedirs(os.path.dirname(args.model) or '.', exist_ok=True)
+    save_model(gmm, args.model)
+
+if __name__ == "__main__":
+    main()
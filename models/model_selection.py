@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+model_selection.py
+
+Parallel model-selection sweep for the GMM over the number of components,
+the covariance type and the random seed.
+
+The sweep runs in up to three stages, each spread over a process pool:
+  1. Screening: every (n_components, covariance_type) pair is fitted with the
+     first seed, on a random subsample of the features if one is requested.
+     Pairs whose criterion (BIC or AIC) is worse than the best pair by more
+     than early_stop_margin are dropped.
+  2. Seeds: the remaining pairs are fitted with the other seeds.
+  3. Refinement: when a subsample was used, the refine_top best fits are
+     refitted on the full data.
+Every fit is recorded with its BIC, AIC and log-likelihood; the results table
+and the winning model are saved.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.mixture import GaussianMixture
+from models.clustering import save_model
+from scripts.storage import read_table
+
+_worker_data = {}
+
+def _init_worker(datasets):
+    """
+    Make the training arrays available in a worker process once, instead of
+    sending them with every task.
+    """
+    _worker_data.update(datasets)
+
+def _fit_candidate(task):
+    """
+    Fit and score one configuration on one of the worker datasets.
+    """
+    dataset, n_components, covariance_type, seed, max_iter = task
+    X = _worker_data[dataset]
+    start = time.perf_counter()
+    gmm = GaussianMixture(
+        n_components=n_components,
+        covariance_type=covariance_type,
+        random_state=seed,
+        max_iter=max_iter
+    )
+    gmm.fit(X)
+    return {
+        'stage': dataset,
+        'n_components': n_components,
+        'covariance_type': covariance_type,
+        'seed': seed,
+        'n_samples': len(X),
+        'bic': gmm.bic(X),
+        'aic': gmm.aic(X),
+        'log_likelihood': gmm.score(X) * len(X),
+        'converged': gmm.converged_,
+        'n_iter': gmm.n_iter_,
+        'fit_seconds': time.perf_counter() - start,
+        'model': gmm
+    }
+
+def sweep_gmm(features_df, n_components_grid=range(2, 9), covariance_types=('full', 'tied', 'diag', 'spherical'),
+              seeds=(42, 0, 1), n_jobs=None, subsample=None, refine_top=3, criterion='bic',
+              early_stop_margin=0.05, max_iter=100):
+    """
+    Fit a grid of GMM configurations in parallel and select the best one.
+    
+    Parameters:
+        features_df (pd.DataFrame): DataFrame containing the features for clustering.
+        n_components_grid (iterable): Numbers of components to try.
+        covariance_types (iterable): Covariance types to try.
+        seeds (iterable): Random seeds; the first one is used for screening.
+        n_jobs (int): Number of worker processes (default: all CPUs).
+        subsample (int): Screen on this many randomly chosen rows and refine the best fits
+                         on the full data (default: use the full data throughout).
+        refine_top (int): Number of best fits refitted on the full data after subsampling.
+        criterion (str): 'bic' or 'aic' (lower is better).
+        early_stop_margin (float): Drop configurations whose screening criterion exceeds the best
+                                   one by more than this fraction of its magnitude.
+        max_iter (int): Maximum number of EM iterations per fit.
+    
+    Returns:
+        tuple: (results_df, best_model) - One row per fit, and the winning GaussianMixture
+    """
+    if criterion not in ('bic', 'aic'):
+        raise ValueError(f"Unknown criterion '{criterion}', expected 'bic' or 'aic'")
+    seeds = list(seeds)
+    X_full = features_df.to_numpy(dtype=float)
+    datasets = {'full': X_full}
+    screen = 'full'
+    if subsample is not None and subsample < len(X_full):
+        rng = np.random.default_rng(seeds[0])
+        datasets['subsample'] = X_full[np.sort(rng.choice(len(X_full), subsample, replace=False))]
+        screen = 'subsample'
+    
+    configs = [(k, c) for k in n_components_grid for c in covariance_types]
+    results = []
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(datasets,)) as executor:
+        run = lambda tasks: results.extend(executor.map(_fit_candidate, tasks))
+    
+        # Stage 1: screen every configuration with the first seed.
+        run([(screen, k, c, seeds[0], max_iter) for k, c in configs])
+        scores = {(r['n_components'], r['covariance_type']): r[criterion] for r in results}
+        best = min(scores.values())
+        threshold = best + early_stop_margin * abs(best)
+        survivors = [config for config in configs if scores[config] <= threshold]
+    
+        # Stage 2: remaining seeds for the configurations that are still competitive.
+        run([(screen, k, c, seed, max_iter) for k, c in survivors for seed in seeds[1:]])
+    
+        # Stage 3: refine the best screening fits on the full data.
+        if screen == 'subsample':
+            ranked = sorted(results, key=lambda r: r[criterion])[:refine_top]
+            run([('full', r['n_components'], r['covariance_type'], r['seed'], max_iter) for r in ranked])
+    
+    final = [r for r in results if r['stage'] == 'full']
+    best_result = min(final, key=lambda r: r[criterion])
+    best_model = best_result['model']
+    if all(isinstance(name, str) for name in features_df.columns):
+        best_model.feature_names_in_ = np.asarray(features_df.columns, dtype=object)
+    
+    results_df = pd.DataFrame([{k: v for k, v in r.items() if k != 'model'} for r in results])
+    results_df['pruned'] = False
+    screened = results_df['stage'] == screen
+    pruned_configs = set(configs) - set(survivors)
+    results_df.loc[screened, 'pruned'] = [
+        (k, c) in pruned_configs for k, c in zip(results_df.loc[screened, 'n_components'],
+                                                 results_df.loc[screened, 'covariance_type'])
+    ]
+    results_df['selected'] = False
+    results_df.loc[
+        (results_df['stage'] == 'full')
+        & (results_df['n_components'] == best_result['n_components'])
+        & (results_df['covariance_type'] == best_result['covariance_type'])
+        & (results_df['seed'] == best_result['seed']),
+        'selected'
+    ] = True
+    return results_df, best_model
+
+def main():
+    models_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Parallel GMM model-selection sweep.")
+    parser.add_argument('--features', default=os.path.join(models_dir, '..', 'data', 'processed', 'features.frame'))
+    parser.add_argument('--components', type=int, nargs='+', default=list(range(2, 9)))
+    parser.add_argument('--covariance-types', nargs='+', default=['full', 'tied', 'diag', 'spherical'])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[42, 0, 1])
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--subsample', type=int, default=None)
+    parser.add_argument('--refine-top', type=int, default=3)
+    parser.add_argument('--criterion', choices=['bic', 'aic'], default='bic')
+    parser.add_argument('--output-dir', default=os.path.join(models_dir, 'sweep'))
+    args = parser.parse_args()
+    
+    features_df = read_table(args.features)
+    results_df, best_model = sweep_gmm(
+        features_df, args.components, args.covariance_types, args.seeds, args.n_jobs,
+        args.subsample, args.refine_top, args.criterion
+    )
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = os.path.join(args.output_dir, 'sweep_results.csv')
+    results_df.to_csv(results_path, index=False)
+    print(results_df.sort_values(args.criterion).head(10).to_string(index=False))
+    print(f"Results saved to {results_path}")
+    save_model(best_model, os.path.join(args.output_dir, 'gmm_model.pkl'))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+alignment.py
+
+Time alignment of the magnetic field to the ion spectrum minutes.
+
+FGM data comes on its own epoch, at a much higher cadence than the FPI
+spectra (up to 128 samples/s in burst mode). BinnedMean decimates it while
+it streams in: every block of records is reduced to per-minute sums and
+counts, so the full-rate array never has to be held in memory. The binned
+means of several files are merged with count weights.
+
+align_Btot then joins the binned field to the spectrum minutes in a single
+sorted merge (pandas.merge_asof), with an optional tolerance for the nearest
+field minute and optional interpolation across short gaps.
+"""
+
+import numpy as np
+import pandas as pd
+
+class BinnedMean:
+    """
+    Streaming per-bin mean of a time series.
+    
+    Parameters:
+        freq (str): Bin width (default '1Min'); bins start at multiples of freq.
+    """
+    
+    def __init__(self, freq='1Min'):
+        self.freq = pd.Timedelta(freq)
+        self.bins = []
+        self.sums = []
+        self.counts = []
+    
+    def add(self, times, values):
+        """
+        Add a block of records.
+    
+        Parameters:
+            times (np.array): datetime64[ns] timestamps, in any order.
+            values (np.array): 1D values; NaN values are ignored, as in resample().mean().
+        """
+        times = np.asarray(times, dtype='datetime64[ns]')
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        bin_index = times.view(np.int64) // self.freq.value
+        first = bin_index.min() if len(bin_index) else 0
+        offset = bin_index - first
+        n_bins = int(offset.max()) + 1 if len(offset) else 0
+        counts = np.bincount(offset[valid], minlength=n_bins)
+        sums = np.bincount(offset[valid], weights=values[valid], minlength=n_bins)
+        present = np.bincount(offset, minlength=n_bins) > 0
+        self.bins.append(first + np.nonzero(present)[0])
+        self.sums.append(sums[present])
+        self.counts.append(counts[present])
+    
+    def result(self):
+        """
+        Returns:
+            pd.DataFrame: 'mean' and 'count' per bin that received records, indexed by bin start.
+        """
+        if not self.bins:
+            return pd.DataFrame({'mean': [], 'count': []}, index=pd.DatetimeIndex([]))
+        bins = np.concatenate(self.bins)
+        unique, inverse = np.unique(bins, return_inverse=True)
+        sums = np.bincount(inverse, weights=np.concatenate(self.sums), minlength=len(unique))
+        counts = np.bincount(inverse, weights=np.concatenate(self.counts), minlength=len(unique))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        index = pd.DatetimeIndex((unique * self.freq.value).astype('datetime64[ns]'))
+        return pd.DataFrame({'mean': np.where(counts > 0, means, np.nan), 'count': counts.astype(np.int64)},
+                            index=index)
+
+def merge_binned(frames, column='mean'):
+    """
+    Combine per-file binned means (a value column and 'count') into one count-weighted
+    mean per bin.
+    """
+    stacked = pd.concat(frames, axis=0)
+    weighted = (stacked[column].fillna(0) * stacked['count']).groupby(level=0).sum()
+    counts = stacked['count'].groupby(level=0).sum()
+    return pd.DataFrame({column: weighted / counts.where(counts > 0), 'count': counts})
+
+def align_Btot(minutes, Btot_series, tolerance=None, max_gap=None):
+    """
+    Align a (binned) Btot series to the spectrum minutes with one sorted merge.
+    
+    Parameters:
+        minutes (pd.DatetimeIndex): Time bins of the ion spectra.
+        Btot_series (pd.Series): Btot indexed by time bin.
+        tolerance (str or pd.Timedelta): Use the nearest non-NaN Btot bin within this distance
+                                         when a minute has none (default: exact matches only).
+        max_gap (str or pd.Timedelta): Linearly interpolate across interior gaps of at most this
+                                       length that remain after the merge (default: leave NaN).
+    
+    Returns:
+        np.array: Btot for every minute, NaN where no value could be assigned.
+    """
+    minutes = pd.DatetimeIndex(minutes)
+    Btot_series = Btot_series.dropna()
+    if not Btot_series.index.is_monotonic_increasing:
+        Btot_series = Btot_series.sort_index()
+    if tolerance is None or pd.Timedelta(tolerance) == pd.Timedelta(0):
+        Btot = Btot_series.reindex(minutes).to_numpy(dtype=float)
+    else:
+        times = minutes.values.astype('datetime64[ns]')
+        order = np.argsort(times, kind='stable')
+        left = pd.DataFrame({'time': times[order]})
+        right = pd.DataFrame({'time': Btot_series.index.values.astype('datetime64[ns]'),
+                              'Btot': Btot_series.to_numpy(dtype=float)})
+        merged = pd.merge_asof(left, right, on='time', direction='nearest', tolerance=pd.Timedelta(tolerance))
+        Btot = np.empty(len(minutes))
+        Btot[order] = merged['Btot'].to_numpy()
+    
+    if max_gap is not None and np.isnan(Btot).any():
+        Btot = _interpolate_gaps(minutes, Btot, pd.Timedelta(max_gap))
+    return Btot
+
+def _interpolate_gaps(times, values, max_gap):
+    """
+    Linearly interpolate NaN values whose surrounding valid samples are at most max_gap apart.
+    """
+    t = times.values.astype('datetime64[ns]').view(np.int64)
+    order = np.argsort(t, kind='stable')
+    t, sorted_values = t[order], values[order]
+    valid = ~np.isnan(sorted_values)
+    if valid.sum() < 2:
+        return values
+    tv, vv = t[valid], sorted_values[valid]
+    nxt = np.searchsorted(tv, t, side='left')
+    prev = nxt - 1
+    inside = ~valid & (prev >= 0) & (nxt < len(tv))
+    inside[inside] &= (tv[nxt[inside]] - tv[prev[inside]]) <= max_gap.value
+    sorted_values[inside] = np.interp(t[inside], tv, vv)
+    result = np.empty_like(values)
+    result[order] = sorted_values
+    return result
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+cache.py
+
+Persistent per-file cache for the CDF processing pipeline.
+
+Every CDF file is processed on its own into 1-minute resampled ion spectra and
+B field, the number of records behind each minute, and the extracted features.
+These segments are stored under a key derived from the file path, size and
+modification time (optionally a content hash), the feature code version and
+the processing parameters. A re-run only decodes and processes files whose key
+is not in the cache and merges the cached segments, so adding one new file to
+the archive costs one file's worth of work.
+
+Minutes covered by more than one file (files that overlap or split a minute)
+are merged as count-weighted means and their features are recomputed; all
+other minutes are taken from the cache unchanged.
+
+Usage:
+    python -m scripts.cache info
+    python -m scripts.cache evict --max-bytes 1000000000
+    python -m scripts.cache invalidate data/mms1_fpi_fast_l2_dis-moms_20151017040000_v3.4.0.cdf
+    python -m scripts.cache clear
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from scripts.feature_engineering import FEATURE_VERSION, extract_features
+from scripts.instrumentation import instrumented
+from scripts.read_cdf import read_cdf_file
+from scripts.storage import read_table, write_table
+
+# Bump when the layout of cache entries changes.
+CACHE_FORMAT_VERSION = 1
+
+DEFAULT_CACHE_DIR = 'data/cache'
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+ENTRY_META_FILE = 'entry.json'
+
+def _content_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_key(path, params=None, content_hash=False):
+    """
+    Compute the cache key of a source file.
+    
+    Parameters:
+        path (str): Path to the source file.
+        params (dict): JSON-serializable processing parameters that affect the output.
+        content_hash (bool): Key on a SHA-256 of the file contents instead of its mtime.
+    
+    Returns:
+        str: Hex digest identifying the file version and processing configuration.
+    """
+    stat = os.stat(path)
+    description = {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'format_version': CACHE_FORMAT_VERSION,
+        'feature_version': FEATURE_VERSION,
+        'params': params or {}
+    }
+    if content_hash:
+        description['sha256'] = _content_hash(path)
+    else:
+        description['mtime_ns'] = stat.st_mtime_ns
+    encoded = json.dumps(description, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+class FileCache:
+    """
+    Directory of cache entries, one per (source file version, parameters) key.
+    Each entry holds named DataFrames as binary tables (see storage.py). Entries are
+    evicted least-recently-used first once the cache grows beyond max_bytes.
+    """
+    
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+    
+    def _entries(self):
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(os.path.join(path, ENTRY_META_FILE)):
+                yield path
+    
+    def get(self, key):
+        """
+        Return the DataFrames stored under key, or None if there is no such entry.
+        """
+        entry = self._entry_dir(key)
+        if not os.path.isfile(os.path.join(entry, ENTRY_META_FILE)):
+            return None
+        with open(os.path.join(entry, ENTRY_META_FILE)) as f:
+            meta = json.load(f)
+        frames = {name: read_table(os.path.join(entry, f'{name}.frame')) for name in meta['frames']}
+        os.utime(entry)  # Mark as recently used.
+        return frames
+    
+    def put(self, key, frames, source=None):
+        """
+        Store named DataFrames under key and evict old entries if the cache is too large.
+    
+        Parameters:
+            key (str): Cache key (see file_key).
+            frames (dict): Mapping of name to DataFrame.
+            source (str): Source file the entry was computed from, used by invalidate.
+        """
+        entry = self._entry_dir(key)
+        staging = f'{entry}.tmp-{os.getpid()}'
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        for name, df in frames.items():
+            write_table(df, os.path.join(staging, f'{name}.frame'))
+        meta = {
+            'source': os.path.abspath(source) if source else None,
+            'frames': list(frames),
+            'created': time.time()
+        }
+        with open(os.path.join(staging, ENTRY_META_FILE), 'w') as f:
+            json.dump(meta, f)
+    
+        # Entries become visible atomically, so a crash never leaves a partial entry.
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.rename(staging, entry)
+        self.evict()
+    
+    def entry_size(self, entry):
+        total = 0
+        for root, _, files in os.walk(entry):
+            total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return total
+    
+    def size(self):
+        """
+        Total size of all entries in bytes.
+        """
+        return sum(self.entry_size(entry) for entry in self._entries())
+    
+    def evict(self, max_bytes=None):
+        """
+        Remove least-recently-used entries until the cache fits into max_bytes
+        (default: the limit given at construction).
+    
+        Returns:
+            int: Number of removed entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        sizes = {entry: self.entry_size(entry) for entry in entries}
+        total = sum(sizes.values())
+        removed = 0
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry)
+            total -= sizes[entry]
+            removed += 1
+        return removed
+    
+    def invalidate(self, source=None):
+        """
+        Remove the entries computed from a source file, or all entries if source is None.
+    
+        Returns:
+            int: Number of removed entries.
+        """
+        source = os.path.abspath(source) if source else None
+        removed = 0
+        for entry in list(self._entries()):
+            if source is not None:
+                with open(os.path.join(entry, ENTRY_META_FILE)) as f:
+                    if json.load(f)['source'] != source:
+                        continue
+            shutil.rmtree(entry)
+            removed += 1
+        return removed
+    
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        return self.invalidate()
+
+@instrumented('cdf.resample')
+def _resample_with_counts(df):
+    """
+    Resample a native-cadence frame to 1-minute means and record counts per minute.
+    """
+    df = df.sort_index()
+    df = df[~df.index.duplicated(keep='first')]
+    resampler = df.resample('1Min')
+    return resampler.mean(), resampler.size()
+
+def _process_file(cdf_file, energy_bins):
+    """
+    Decode and process a single CDF file into its cacheable segments.
+    """
+    ion_df, B_df = read_cdf_file(cdf_file)
+    ion_spec, ion_counts = _resample_with_counts(ion_df)
+    B_field, B_counts = _resample_with_counts(B_df)
+    counts = pd.DataFrame({'ion': ion_counts, 'B': B_counts}).fillna(0)
+    features = extract_features(ion_spec, B_field['Btot'], energy_bins)
+    return {'ion_spec': ion_spec, 'B_field': B_field, 'counts': counts, 'features': features}
+
+def _weighted_merge(frames, weights):
+    """
+    Combine per-file minute means into overall minute means, weighting each file's
+    value by its record count. Minutes present in one file keep their value.
+    """
+    stacked = pd.concat(frames, axis=0)
+    stacked_weights = pd.concat(weights, axis=0)
+    duplicated = stacked.index.duplicated(keep=False)
+    single = stacked[~duplicated]
+    if not duplicated.any():
+        return single, stacked.index[:0]
+    
+    # Per column, only records with a value contribute (as in resample().mean()).
+    shared = stacked[duplicated]
+    values = shared.to_numpy()
+    w = stacked_weights[duplicated].to_numpy()[:, None] * ~np.isnan(values)
+    sums = pd.DataFrame(np.nan_to_num(values) * w, index=shared.index).groupby(level=0).sum()
+    totals = pd.DataFrame(w, index=shared.index).groupby(level=0).sum()
+    merged = sums / totals.where(totals > 0)
+    merged.columns = shared.columns
+    return pd.concat([single, merged], axis=0).sort_index(), merged.index
+
+def process_cdf_files_cached(data_dir, energy_bins, cache=None, content_hash=False):
+    """
+    Resample and extract features for all CDF files of a directory, reusing the
+    cached segments of files that have not changed.
+    
+    Parameters:
+        data_dir (str): Path to directory containing CDF files.
+        energy_bins (np.array): 1D array of energy values corresponding to the 32 channels.
+        cache (FileCache): Cache to use (default: FileCache() in data/cache).
+        content_hash (bool): Detect changed files by content hash instead of mtime.
+    
+    Returns:
+        tuple: (ion_spec_df, B_field_df, features_df) covering all files at 1-minute resolution
+    """
+    cache = FileCache() if cache is None else cache
+    params = {'resample': '1Min', 'energy_bins': np.asarray(energy_bins).tolist()}
+    
+    segments = []
+    for cdf_file in sorted(glob.glob(os.path.join(data_dir, '*.cdf'))):
+        key = file_key(cdf_file, params, content_hash)
+        frames = cache.get(key)
+        if frames is not None:
+            print(f"Cached: {os.path.basename(cdf_file)}")
+        else:
+            try:
+                frames = _process_file(cdf_file, energy_bins)
+            except Exception as e:
+                print(f"Error loading {cdf_file}: {str(e)}")
+                continue
+            cache.put(key, frames, source=cdf_file)
+            print(f"Loaded: {os.path.basename(cdf_file)}")
+        segments.append(frames)
+    
+    if not segments:
+        raise ValueError("No valid CDF files were loaded")
+    
+    ion_spec_df, ion_shared = _weighted_merge(
+        [s['ion_spec'] for s in segments], [s['counts']['ion'] for s in segments]
+    )
+    B_field_df, B_shared = _weighted_merge(
+        [s['B_field'] for s in segments], [s['counts']['B'] for s in segments]
+    )
+    
+    # Fill the minutes between files with NaN, as a single resample would.
+    minutes = pd.date_range(ion_spec_df.index[0], ion_spec_df.index[-1], freq='1Min')
+    ion_spec_df = ion_spec_df.reindex(minutes)
+    B_field_df = B_field_df.reindex(pd.date_range(B_field_df.index[0], B_field_df.index[-1], freq='1Min'))
+    
+    # Cached features are valid except for minutes whose spectrum or Btot was merged
+    # across files and gaps between files.
+    features_df = pd.concat([s['features'] for s in segments], axis=0)
+    features_df = features_df[~features_df.index.duplicated(keep=False)].reindex(minutes)
+    stale = (features_df.index.isin(ion_shared) | features_df.index.isin(B_shared)
+             | features_df.isna().all(axis=1).to_numpy())
+    if stale.any():
+        features_df.loc[stale] = extract_features(
+            ion_spec_df[stale], B_field_df['Btot'], energy_bins
+        ).to_numpy()
+    
+    return ion_spec_df, B_field_df, features_df
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the per-file processing cache.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('info', help="Show the number and total size of cache entries")
+    subparsers.add_parser('clear', help="Remove all cache entries")
+    evict = subparsers.add_parser('evict', help="Evict least-recently-used entries")
+    evict.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES)
+    invalidate = subparsers.add_parser('invalidate', help="Remove the entries of source files")
+    invalidate.add_argument('sources', nargs='+')
+    args = parser.parse_args()
+    
+    cache = FileCache(args.cache_dir)
+    if args.command == 'info':
+        entries = list(cache._entries())
+        print(f"{len(entries)} entries, {cache.size() / 1024**2:.1f} MiB in {args.cache_dir}")
+    elif args.command == 'clear':
+        print(f"Removed {cache.clear()} entries")
+    elif args.command == 'evict':
+        print(f"Removed {cache.evict(args.max_bytes)} entries")
+    elif args.command == 'invalidate':
+        removed = sum(cache.invalidate(source) for source in args.sources)
+        print(f"Removed {removed} entries")
+
+if __name__ == "__main__":
+    main()
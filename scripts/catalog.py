@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+catalog.py
+
+Persistent SQLite catalog of the CDF archive.
+
+For every file the catalog records its size, modification time, probe,
+instrument, version string, record count and time bounds, and for every
+variable its shape, CDF data type, record count, time variable and time
+bounds. The entries come from the same pycdf inspection as the time index
+(see cdf_index.py), so files that are already indexed are not opened again.
+Catalog.update scans only new or modified files and drops files that no
+longer exist.
+
+Loaders select files with Catalog.files by time range, variable and probe,
+instead of globbing a directory and opening each match:
+
+    catalog = Catalog()
+    catalog.update('data')
+    files = catalog.files(start='2015-10-17 05:00', end='2015-10-17 09:00',
+                          variable='mms1_dis_energyspectr_px_fast')
+
+Usage:
+    python -m scripts.catalog update data
+    python -m scripts.catalog files --start "2015-10-17 05:00" --end "2015-10-17 09:00" --probe mms1
+    python -m scripts.catalog variables data/mms1_fpi_fast_l2_dis-moms_20151017040000_v3.4.0.cdf
+"""
+
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import re
+import sqlite3
+import pandas as pd
+from spacepy import pycdf
+from scripts.cdf_index import CDFIndex
+from scripts.read_cdf import probe_from_filename
+
+DEFAULT_CATALOG_PATH = 'data/cache/catalog.sqlite'
+
+VERSION_PATTERN = re.compile(r'_v(\d+(?:\.\d+)*)\.cdf$', re.IGNORECASE)
+INSTRUMENT_PATTERN = re.compile(r'^mms[1-4]_([a-z]+)_', re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    probe TEXT,
+    instrument TEXT,
+    version TEXT,
+    n_records INTEGER,
+    start_ns INTEGER,
+    end_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS variables (
+    path TEXT REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT,
+    shape TEXT,
+    dtype TEXT,
+    n_records INTEGER,
+    depend_0 TEXT,
+    start_ns INTEGER,
+    end_ns INTEGER,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS files_time ON files (start_ns, end_ns);
+CREATE INDEX IF NOT EXISTS variables_name ON variables (name, start_ns, end_ns);
+"""
+
+def _file_rows(path, entry):
+    """
+    Rows of the files and variables tables for one index entry (see cdf_index.build_file_index).
+    """
+    name = os.path.basename(path)
+    version = VERSION_PATTERN.search(name)
+    instrument = INSTRUMENT_PATTERN.match(name)
+    epochs = entry['epochs']
+    variables = []
+    for var, info in entry['variables'].items():
+        if 'error' in info:
+            continue
+        depend_0 = info['attrs'].get('DEPEND_0')
+        epoch = epochs.get(var) or epochs.get(depend_0)
+        variables.append((path, var, json.dumps(info['shape']), pycdf.lib.cdftypenames.get(info['type'], str(info['type'])),
+                          info['n_records'], depend_0,
+                          epoch['times_ns'][0] if epoch else None, epoch['times_ns'][-1] if epoch else None))
+    stat = os.stat(path)
+    spans = [(epoch['times_ns'][0], epoch['times_ns'][-1]) for epoch in epochs.values()]
+    record_var = epochs.get('Epoch') or next(iter(epochs.values()), None)
+    file_row = (path, stat.st_size, stat.st_mtime_ns, probe_from_filename(path),
+                instrument.group(1).lower() if instrument else None, version.group(1) if version else None,
+                record_var['n_records'] if record_var else 0,
+                min(s for s, _ in spans) if spans else None, max(e for _, e in spans) if spans else None)
+    return file_row, variables
+
+class Catalog:
+    """
+    SQLite catalog of CDF files and their variables.
+    
+    Parameters:
+        path (str): Database file (created if missing).
+        index (CDFIndex): Index used to inspect new or modified files (default: CDFIndex()).
+    """
+    
+    def __init__(self, path=DEFAULT_CATALOG_PATH, index=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.index = index
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+    
+    def close(self):
+        self.connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def update(self, data_dir, pattern='*.cdf', recursive=True):
+        """
+        Bring the catalog up to date with the files below data_dir that match pattern. Only
+        files whose size or modification time changed are inspected; matching files that
+        disappeared are removed. Cataloged files outside pattern (or, without recursive,
+        in subdirectories) are left as they are.
+    
+        Returns:
+            dict: Number of 'added', 'updated', 'removed' and 'unchanged' files.
+        """
+        search = os.path.join(data_dir, '**', pattern) if recursive else os.path.join(data_dir, pattern)
+        paths = sorted(os.path.abspath(p) for p in glob.glob(search, recursive=recursive))
+        root = os.path.join(os.path.abspath(data_dir), '')
+        # Only files inside the scanned scope (pattern and recursion) can be found missing.
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.connection.execute(
+            'SELECT path, size, mtime_ns FROM files WHERE substr(path, 1, ?) = ?', (len(root), root))
+            if fnmatch.fnmatch(os.path.basename(path), pattern)
+            and (recursive or os.path.dirname(path) == root.rstrip(os.sep))}
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        index = self.index or CDFIndex()
+        with self.connection:
+            for path in paths:
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    counts['unchanged'] += 1
+                    continue
+                try:
+                    file_row, variable_rows = _file_rows(path, index.get(path))
+                except Exception as e:
+                    print(f"Error cataloging {path}: {e}")
+                    continue
+                counts['updated' if path in known else 'added'] += 1
+                self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+                self.connection.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', file_row)
+                self.connection.executemany('INSERT INTO variables VALUES (?, ?, ?, ?, ?, ?, ?, ?)', variable_rows)
+            removed = set(known) - set(paths)
+            self.connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+            counts['removed'] = len(removed)
+        return counts
+    
+    def files(self, start=None, end=None, variable=None, probe=None, instrument=None, directory=None, pattern=None):
+        """
+        Files whose records overlap [start, end).
+    
+        Parameters:
+            start, end: Time range; None leaves that side open.
+            variable (str): Only files containing this variable, using its own time bounds.
+            probe (str): Only files of this spacecraft.
+            instrument (str): Only files of this instrument ('fpi', 'fgm', ...).
+            directory (str): Only files below this directory.
+            pattern (str): Only files whose name matches this glob pattern.
+    
+        Returns:
+            list: Absolute paths, in name order.
+        """
+        table = 'files' if variable is None else 'variables JOIN files USING (path)'
+        bounds = 'files' if variable is None else 'variables'
+        conditions, args = [], []
+        if variable is not None:
+            conditions.append('variables.name = ?')
+            args.append(variable)
+        if start is not None:
+            conditions.append(f'{bounds}.end_ns >= ?')
+            args.append(pd.Timestamp(start).value)
+        if end is not None:
+            conditions.append(f'{bounds}.start_ns < ?')
+            args.append(pd.Timestamp(end).value)
+        for column, value in (('probe', probe), ('instrument', instrument)):
+            if value is not None:
+                conditions.append(f'files.{column} = ?')
+                args.append(value)
+        if directory is not None:
+            root = os.path.join(os.path.abspath(directory), '')
+            conditions.append('substr(files.path, 1, ?) = ?')
+            args.extend([len(root), root])
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        paths = [row[0] for row in self.connection.execute(f'SELECT files.path FROM {table}{where}', args)]
+        if pattern is not None:
+            paths = [path for path in paths if fnmatch.fnmatch(os.path.basename(path), pattern)]
+        return sorted(paths, key=os.path.basename)
+    
+    def summary(self):
+        """
+        Returns:
+            pd.DataFrame: One row per cataloged file, with its time bounds as timestamps.
+        """
+        df = pd.read_sql_query('SELECT * FROM files ORDER BY path', self.connection)
+        for column in ('start', 'end'):
+            df[column] = pd.to_datetime(df.pop(f'{column}_ns'))
+        return df
+    
+    def variables(self, path):
+        """
+        Returns:
+            pd.DataFrame: The variables of one file (name, shape, dtype, n_records, depend_0, start, end).
+        """
+        df = pd.read_sql_query('SELECT name, shape, dtype, n_records, depend_0, start_ns, end_ns FROM variables '
+                               'WHERE path = ? ORDER BY name', self.connection, params=(os.path.abspath(path),))
+        df['shape'] = [tuple(json.loads(shape)) for shape in df['shape']]
+        for column in ('start', 'end'):
+            df[column] = pd.to_datetime(df.pop(f'{column}_ns'))
+        return df
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite catalog of the CDF archive.")
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update = subparsers.add_parser('update', help="Scan new or modified files of a directory")
+    update.add_argument('data_dir')
+    update.add_argument('--pattern', default='*.cdf')
+    files = subparsers.add_parser('files', help="List the files of a time range")
+    files.add_argument('--start', default=None)
+    files.add_argument('--end', default=None)
+    files.add_argument('--variable', default=None)
+    files.add_argument('--probe', default=None)
+    variables = subparsers.add_parser('variables', help="List the variables of a file")
+    variables.add_argument('path')
+    args = parser.parse_args()
+    
+    with Catalog(args.catalog) as catalog:
+        if args.command == 'update':
+            counts = catalog.update(args.data_dir, args.pattern)
+            print(', '.join(f"{n} {status}" for status, n in counts.items()))
+        elif args.command == 'files':
+            for path in catalog.files(args.start, args.end, args.variable, args.probe):
+                print(path)
+        else:
+            print(catalog.variables(args.path).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+cdf_index.py
+
+Persistent per-file metadata and time index for CDF files, and time-range
+reads that use it.
+
+The first time a file is seen, its variables (shape, CDF type, attributes)
+and a sparse index of every time variable are recorded. The time index keeps
+the first record, every `stride`-th record and the last record. The entry is
+stored as JSON in the index directory, keyed by the file path, size and
+modification time, so a changed file is indexed again.
+
+read_range answers a request for [start, end) from the index alone: it
+selects the covering files, narrows the record range to the index samples
+around start and end, and reads only those records with pycdf slicing. No
+variable is read as a whole. inspect_cdf uses the same metadata instead of
+opening every file.
+
+Usage:
+    python -m scripts.cdf_index data                    # index all files of a directory
+    python -m scripts.cdf_index data "2015-10-17 04:55" "2015-10-17 05:10"
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from spacepy import pycdf
+from scripts.read_cdf import B_FIELD_VAR, ION_SPEC_VAR, _epoch_block, probe_from_filename
+
+DEFAULT_INDEX_DIR = 'data/cache/cdf_index'
+DEFAULT_STRIDE = 1024
+
+# Bump when the layout of index entries changes.
+INDEX_VERSION = 2
+
+def _time_type(variable):
+    return variable.type() in (pycdf.const.CDF_TIME_TT2000.value, pycdf.const.CDF_EPOCH.value,
+                               pycdf.const.CDF_EPOCH16.value)
+
+def build_file_index(cdf_file, stride=DEFAULT_STRIDE):
+    """
+    Collect the variable metadata and the sparse time index of one CDF file.
+    
+    Returns:
+        dict: 'variables' (name -> shape, type, n_records, attrs) and 'epochs'
+              (time variable -> n_records, stride, record numbers and their times in ns)
+    """
+    entry = {'version': INDEX_VERSION, 'variables': {}, 'epochs': {}}
+    with pycdf.CDF(cdf_file) as cdf:
+        for name in cdf:
+            try:
+                variable = cdf[name]
+                entry['variables'][name] = {
+                    'shape': list(variable.shape),
+                    'type': variable.type(),
+                    'n_records': len(variable) if variable.rv() else None,
+                    'attrs': {attr: f'{value}' for attr, value in variable.attrs.items()}
+                }
+            except Exception as e:
+                entry['variables'][name] = {'error': str(e)}
+                continue
+            n_records = len(variable)
+            if not _time_type(variable) or n_records == 0:
+                continue
+            # A strided hyperslab read: only the sampled records are decoded.
+            records = np.arange(0, n_records, stride)
+            times = list(variable[::stride])
+            if records[-1] != n_records - 1:
+                records = np.append(records, n_records - 1)
+                times.append(variable[n_records - 1])
+            times = pd.to_datetime(times).values
+            entry['epochs'][name] = {
+                'n_records': n_records,
+                'stride': stride,
+                'records': records.tolist(),
+                'times_ns': times.astype('datetime64[ns]').view(np.int64).tolist()
+            }
+    return entry
+
+class CDFIndex:
+    """
+    Directory of per-file index entries (see build_file_index), built on first use.
+    
+    Parameters:
+        index_dir (str): Where the entries are stored.
+        stride (int): Record spacing of the sparse time index.
+    """
+    
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, stride=DEFAULT_STRIDE):
+        self.index_dir = index_dir
+        self.stride = stride
+        self._entries = {}
+        os.makedirs(index_dir, exist_ok=True)
+    
+    def _key(self, cdf_file):
+        stat = os.stat(cdf_file)
+        description = f'{os.path.abspath(cdf_file)}|{stat.st_size}|{stat.st_mtime_ns}|{INDEX_VERSION}|{self.stride}'
+        return hashlib.sha256(description.encode()).hexdigest()
+    
+    def get(self, cdf_file):
+        """
+        Index entry of a file, read from the index directory or built and stored.
+        """
+        key = self._key(cdf_file)
+        if key in self._entries:
+            return self._entries[key]
+        path = os.path.join(self.index_dir, f'{key}.json')
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = build_file_index(cdf_file, self.stride)
+            entry['file'] = os.path.abspath(cdf_file)
+            staging = f'{path}.tmp-{os.getpid()}'
+            with open(staging, 'w') as f:
+                json.dump(entry, f)
+            os.replace(staging, path)
+        self._entries[key] = entry
+        return entry
+    
+    def time_span(self, cdf_file, epoch_var='Epoch'):
+        """
+        First and last time of a time variable of a file, or None if it has no records.
+        """
+        epoch = self.get(cdf_file)['epochs'].get(epoch_var)
+        if epoch is None:
+            return None
+        return pd.Timestamp(epoch['times_ns'][0]), pd.Timestamp(epoch['times_ns'][-1])
+    
+    def record_bounds(self, cdf_file, epoch_var, start, end):
+        """
+        Record range [first, last) that contains every record in [start, end), bracketed
+        by the index samples. The range is narrowed to the exact records by read_range.
+    
+        Returns:
+            tuple: (first, last) record numbers; first == last if the file has no such records.
+        """
+        epoch = self.get(cdf_file)['epochs'].get(epoch_var)
+        if epoch is None:
+            return 0, 0
+        records, times = np.asarray(epoch['records']), np.asarray(epoch['times_ns'])
+        start_ns = times[0] if start is None else pd.Timestamp(start).value
+        end_ns = times[-1] + 1 if end is None else pd.Timestamp(end).value
+        if start_ns > times[-1] or end_ns <= times[0]:
+            return 0, 0
+        # Last sample at or before start, first sample at or after end.
+        lo = records[max(np.searchsorted(times, start_ns, side='right') - 1, 0)]
+        hi_pos = np.searchsorted(times, end_ns, side='left')
+        hi = epoch['n_records'] if hi_pos >= len(records) else records[hi_pos] + 1
+        return int(lo), int(min(hi, epoch['n_records']))
+    
+    def inspect(self, cdf_file):
+        """
+        Variable metadata of a file: name -> {'shape', 'type', 'n_records', 'attrs'} (or {'error'}).
+        """
+        return self.get(cdf_file)['variables']
+
+def read_range(cdf_files, variable, start=None, end=None, index=None, epoch_var=None):
+    """
+    Read the records of a variable that fall into [start, end), from only the
+    files and record ranges that cover the interval.
+    
+    Parameters:
+        cdf_files (list): Candidate CDF files.
+        variable (str): Variable to read.
+        start, end: Time range; None leaves that side open.
+        index (CDFIndex): Index to use (default: CDFIndex() in data/cache/cdf_index).
+        epoch_var (str): Time variable of `variable` (default: its DEPEND_0, from the index).
+    
+    Returns:
+        pd.DataFrame: The records, indexed by time (one column per element of a record).
+    """
+    index = CDFIndex() if index is None else index
+    start_ns = None if start is None else pd.Timestamp(start).value
+    end_ns = None if end is None else pd.Timestamp(end).value
+    frames = []
+    for cdf_file in sorted(cdf_files):
+        meta = index.get(cdf_file)['variables'].get(variable)
+        if meta is None or 'error' in meta:
+            continue
+        time_var = epoch_var or meta['attrs'].get('DEPEND_0', 'Epoch')
+        if time_var not in index.get(cdf_file)['variables']:
+            time_var = 'Epoch'
+        first, last = index.record_bounds(cdf_file, time_var, start, end)
+        if first >= last:
+            continue
+        with pycdf.CDF(cdf_file) as cdf:
+            times = _epoch_block(cdf, time_var, first, last)
+            ns = times.view(np.int64)
+            lo = 0 if start_ns is None else np.searchsorted(ns, start_ns, side='left')
+            hi = len(ns) if end_ns is None else np.searchsorted(ns, end_ns, side='left')
+            if lo >= hi:
+                continue
+            values = cdf[variable][first + lo:first + hi]
+        frames.append(pd.DataFrame(np.asarray(values).reshape(hi - lo, -1), index=pd.DatetimeIndex(times[lo:hi])))
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([]))
+    df = pd.concat(frames, axis=0).sort_index()
+    return df[~df.index.duplicated(keep='first')]
+
+def load_time_range(data_dir, start, end, probe='mms1', pattern=None, resample=True, index=None, catalog=None):
+    """
+    Load the ion spectrogram and Btot of one interval, reading only what covers it.
+    Btot comes from the FGM files among the matches if there are any, and
+    otherwise from the FPI files (as in read_cdf.load_cdf_files).
+    
+    Parameters:
+        data_dir (str): Directory containing the CDF files.
+        start, end: Time range [start, end).
+        probe (str): Spacecraft (default 'mms1').
+        pattern (str): Glob pattern of the files (default: '<probe>_*.cdf').
+        resample (bool): Return 1-minute means (as load_cdf_files) instead of native-cadence records.
+        index (CDFIndex): Index to use (default: CDFIndex() in data/cache/cdf_index).
+        catalog (Catalog): Select the candidate files from this catalog (see catalog.py) instead of globbing data_dir.
+    
+    Returns:
+        tuple: (ion_spec_df, B_field_df)
+    """
+    index = CDFIndex() if index is None else index
+    if catalog is not None:
+        cdf_files = catalog.files(start, end, probe=probe, directory=data_dir, pattern=pattern)
+    else:
+        cdf_files = glob.glob(os.path.join(data_dir, pattern or f'{probe}_*.cdf'))
+    cdf_files = [f for f in cdf_files if probe_from_filename(f) == probe]
+    fgm_files = [f for f in cdf_files if '_fgm_' in os.path.basename(f).lower()]
+    fpi_files = [f for f in cdf_files if f not in fgm_files]
+    ion_df = read_range(fpi_files, ION_SPEC_VAR.format(probe=probe), start, end, index)
+    B_frames = [read_range(fgm_files or fpi_files, B_FIELD_VAR.format(probe=probe, rate=rate), start, end, index)
+                for rate in ('brst', 'srvy')]
+    B_frames = [frame for frame in B_frames if len(frame)]
+    if B_frames:
+        B_raw = pd.concat(B_frames, axis=0).sort_index()
+        B_df = pd.DataFrame({'Btot': np.sqrt(np.sum(B_raw.to_numpy()[:, :3]**2, axis=1))}, index=B_raw.index)
+    else:
+        B_df = pd.DataFrame({'Btot': []}, index=pd.DatetimeIndex([]))
+    if resample:
+        return ion_df.resample('1Min').mean(), B_df.resample('1Min').mean()
+    return ion_df, B_df
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 4):
+        print("Usage: python -m scripts.cdf_index DATA_DIR [START END]")
+        sys.exit(1)
+    index = CDFIndex()
+    cdf_files = sorted(glob.glob(os.path.join(sys.argv[1], '*.cdf')))
+    for cdf_file in cdf_files:
+        span = index.time_span(cdf_file)
+        print(f"{os.path.basename(cdf_file)}: {span[0] if span else '-'} to {span[1] if span else '-'}")
+    if len(sys.argv) == 4:
+        variable = ION_SPEC_VAR.format(probe=probe_from_filename(cdf_files[0]))
+        print(read_range(cdf_files, variable, sys.argv[2], sys.argv[3], index))
@@ -13,14 +13,39 @@ described in the research article. The extracted features are:
 A pseudofeature is also implemented: if the linear fit (via Pearson correlation) to the
 high‐energy (>300 eV) half of the spectrum yields r > 0.7—or if no valid peak is detected—
 the other features are set to zero.
+
+Besides the per-spectrum functions, the module provides batch equivalents
+(suffix ``_batch``) that evaluate the same features for an (N, num_channels)
+array of spectra with whole-array NumPy operations. They reproduce the
+SciPy-based per-spectrum results and are what process_all_spectra uses.
+SciPy is imported by the per-spectrum functions only, so importing this
+module for the batch path does not pay its import time.
+
+The batch path takes a dtype. With COMPACT_DTYPE (float32) the spectra stay
+in the float32 precision they are stored in by the CDF files and the log
+counts, peak search tables and feature block are float32, which halves their
+memory and bandwidth. ratio_high_low is still evaluated in float64 on the
+channels it uses, because the ratio of the two channel means is
+ill-conditioned when the low-energy mean is near 0. Compared with the
+float64 path on float32 input, every feature of a minute satisfies
+|compact - float64| <= COMPACT_TOLERANCE * max(1, |float64|), except for
+spectra that lie on a decision boundary (two peaks of equal height within
+float32 rounding, or a peak/Pearson threshold), which affect fewer than
+1e-4 of the minutes. `python -m benchmarks.bench_compact --minutes 500000
+--seed 0` measures this on the make_minute_data spectra (6 minutes, all in
+ratio_max_width); none of the 707 minutes of the bundled FPI spectra is
+affected.
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from scipy.signal import find_peaks, peak_widths
-from scipy.stats import pearsonr
+from scripts.alignment import align_Btot
+from scripts.instrumentation import instrumented, stage
+from scripts.storage import write_table
 
+@instrumented('features.peaks')
 def compute_peak_features(log_counts, num_channels=32):
     """
     Identify peaks in the log-transformed ion spectrum using SciPy's find_peaks,
@@ -33,6 +58,8 @@ def compute_peak_features(log_counts, num_channels=32):
     Returns:
         ratio_max_width (float or None): Computed ratio_max_width or None if no peak is found.
     """
+    from scipy.signal import find_peaks, peak_widths
+    
     # Use find_peaks with parameters: width=1, height=1, prominence=0.2
     peaks, properties = find_peaks(log_counts, height=1, prominence=0.2, width=1)
     if len(peaks) == 0:
@@ -91,6 +118,7 @@ def compute_norm_Bt(Btot):
     normalized = Btot / 50.0
     return normalized if normalized <= 1 else 1
 
+@instrumented('features.pseudofeature')
 def check_pseudofeature(log_counts, energy_bins):
     """
     Evaluate the pseudofeature condition by fitting a linear relationship
@@ -104,6 +132,8 @@ def check_pseudofeature(log_counts, energy_bins):
         trigger (bool): True if the Pearson correlation coefficient exceeds 0.7 or if there are insufficient data,
                         indicating that the pseudofeature condition is met.
     """
+    from scipy.stats import pearsonr
+    
     mask = energy_bins > 300
     if not np.any(mask):
         return True  # No high-energy channels; trigger pseudofeature.
@@ -172,7 +202,419 @@ def process_spectrum(spectrum, Btot, energy_bins, num_channels=32):
     }
     return features
 
-def process_all_spectra(ion_spec_df, Btot_series, energy_bins):
+# ---------------------------------------------------------------------------
+# Batch (vectorized) feature extraction
+# ---------------------------------------------------------------------------
+#
+# The functions below mirror the per-spectrum functions above but operate on a
+# 2D array of log counts with shape (N, num_channels). The peak search follows
+# the definitions used by scipy.signal.find_peaks / peak_prominences /
+# peak_widths (plateau midpoints, NaN handling, interpolation of the
+# half-height crossings) and evaluates the same floating point expressions,
+# so the results are identical to calling compute_peak_features row by row.
+# The searches to either side of a peak are answered with sparse range
+# tables instead of walking one channel at a time.
+
+def _find_local_maxima_batch(log_counts):
+    """
+    Locate local maxima along the channel axis, following scipy's
+    _local_maxima_1d: a peak is a sample (or the midpoint of a flat plateau)
+    whose left neighbour is strictly lower and whose first differing right
+    neighbour is strictly lower.
+    
+    Parameters:
+        log_counts (np.array): C-contiguous 2D array (N, num_channels) of log counts.
+    
+    Returns:
+        rows, cols (np.array): Row and channel indices of all local maxima,
+                               ordered by row and then by channel.
+    """
+    n = log_counts.shape[1]
+    flat = log_counts.ravel()
+    is_rise = np.zeros(log_counts.shape, dtype=bool)
+    is_rise[:, 1:n - 1] = log_counts[:, :n - 2] < log_counts[:, 1:n - 1]
+    rise = np.flatnonzero(is_rise)
+    values = flat[rise]
+    
+    # Walk right over plateaus (equal samples), stopping at the last channel.
+    ahead = rise + 1
+    idx = np.flatnonzero((ahead % n < n - 1) & (flat[ahead] == values))
+    while len(idx):
+        ahead[idx] += 1
+        keep = (ahead[idx] % n < n - 1) & (flat[ahead[idx]] == values[idx])
+        idx = idx[keep]
+    
+    is_peak = flat[ahead] < values
+    rise, ahead = rise[is_peak], ahead[is_peak]
+    rows = rise // n
+    left = rise - rows * n
+    right = ahead - 1 - rows * n
+    return rows, (left + right) // 2
+
+# Spectra are processed in blocks of this many rows to bound the size of the
+# range-query tables (levels x rows x channels floats).
+_BATCH_BLOCK_ROWS = 65536
+
+def _range_tables(values, reduce):
+    """
+    Build a sparse table for range-minimum/maximum queries along the channel axis:
+    tables[k, r, i] is reduce(values[r, i:i + 2**k]) (clipped at the last channel).
+    """
+    n = values.shape[1]
+    levels = max(1, (n - 1).bit_length())
+    tables = np.empty((levels,) + values.shape, dtype=values.dtype)
+    tables[0] = values
+    for k in range(1, levels):
+        half = 1 << (k - 1)
+        tables[k] = tables[k - 1]
+        reduce(tables[k - 1][:, :n - half], tables[k - 1][:, half:], out=tables[k][:, :n - half])
+    return tables
+
+def _extend_run(tables, rows, cols, step, inside):
+    """
+    Starting at each (row, col), move as far as possible in direction step (-1 or +1)
+    over channels whose table value satisfies inside(value, i), using binary lifting.
+    
+    Returns:
+        pos (np.array): Last channel of each run.
+    """
+    levels, n_rows, n = tables.shape
+    flat = tables.ravel()
+    pos = cols.copy()
+    for k in range(levels - 1, -1, -1):
+        span = 1 << k
+        if step < 0:
+            start = pos - span
+            ok = start >= 0
+        else:
+            start = pos + 1
+            ok = pos + span <= n - 1
+        i = np.flatnonzero(ok)
+        window = flat[(k * n_rows + rows[i]) * n + start[i]]
+        i = i[inside(window, i)]
+        pos[i] += step * span
+    return pos
+
+def _range_min(tables, rows, first, last):
+    """
+    Minimum of values[row, first:last + 1] for each row, from a min sparse table.
+    """
+    levels, n_rows, n = tables.shape
+    flat = tables.ravel()
+    k = np.zeros(len(rows), dtype=np.intp)
+    length = last - first + 1
+    for level in range(1, levels):
+        k[length >= (1 << level)] = level
+    base = (k * n_rows + rows) * n
+    return np.minimum(flat[base + first], flat[base + last - (1 << k) + 1])
+
+def _peak_prominences_batch(log_counts, rows, cols, max_tables, min_tables):
+    """
+    Compute peak prominences (scipy's _peak_prominences without a window length).
+    Each side of a peak extends while the samples do not exceed the peak height
+    (NaN stops the search); the prominence is measured from the higher of the
+    two minima found there.
+    
+    Returns:
+        prominences (np.array): One entry per peak.
+    """
+    heights = log_counts[rows, cols]
+    inside = lambda window, i: window <= heights[i]
+    left = _extend_run(max_tables, rows, cols, -1, inside)
+    right = _extend_run(max_tables, rows, cols, 1, inside)
+    left_min = _range_min(min_tables, rows, left, cols)
+    right_min = _range_min(min_tables, rows, cols, right)
+    return heights - np.maximum(left_min, right_min)
+
+def _peak_left_ips_batch(log_counts, rows, cols, prominences, min_tables, rel_height=0.5):
+    """
+    Compute peak widths and left intersection points (scipy's _peak_widths).
+    For peaks with a positive prominence the half-height crossing on each side
+    always lies between the peak and its base, so the bases need not be tracked.
+    
+    Returns:
+        widths, left_ips (np.array): One entry per peak.
+    """
+    height = log_counts[rows, cols] - prominences * rel_height
+    inside = lambda window, i: height[i] < window
+    
+    ips = []
+    for step in (-1, 1):
+        # First sample at or below the evaluation height, then interpolate.
+        pos = _extend_run(min_tables, rows, cols, step, inside) + step
+        ip = pos.astype(float)
+        x = log_counts[rows, pos]
+        i = np.flatnonzero(x < height)
+        ip[i] -= step * (height[i] - x[i]) / (log_counts[rows[i], pos[i] - step] - x[i])
+        ips.append(ip)
+    
+    left_ips, right_ips = ips
+    return right_ips - left_ips, left_ips
+
+@instrumented('features.peaks_batch')
+def compute_peak_features_batch(log_counts, num_channels=32, dtype=np.float64):
+    """
+    Batch version of compute_peak_features.
+    
+    Parameters:
+        log_counts (np.array): 2D array (N, num_channels) of log-transformed counts.
+        num_channels (int):  Number of energy channels (default is 32).
+        dtype: Floating point type of the computation (default float64).
+    
+    Returns:
+        ratio_max_width (np.array): Ratio per spectrum, NaN where no peak is found.
+    """
+    log_counts = np.ascontiguousarray(log_counts, dtype=dtype)
+    ratio_max_width = np.full(log_counts.shape[0], np.nan, dtype=dtype)
+    
+    for start in range(0, log_counts.shape[0], _BATCH_BLOCK_ROWS):
+        block = log_counts[start:start + _BATCH_BLOCK_ROWS]
+        
+        # Candidate peaks: local maxima passing the height=1 criterion of find_peaks.
+        rows, cols = _find_local_maxima_batch(block)
+        candidates = np.full(block.shape, -np.inf)
+        keep = block[rows, cols] >= 1
+        candidates[rows[keep], cols[keep]] = block[rows[keep], cols[keep]]
+        
+        # NaN ends a prominence search (max table) and a width search (min table).
+        max_tables = _range_tables(np.where(np.isnan(block), np.inf, block), np.maximum)
+        min_tables = _range_tables(np.where(np.isnan(block), -np.inf, block), np.minimum)
+        
+        # Only the highest peak that survives the prominence=0.2 and width=1
+        # criteria matters, so test candidates per spectrum in order of height
+        # (first one on ties, like np.argmax) until one survives.
+        pending = np.flatnonzero((candidates > -np.inf).any(axis=1))
+        while len(pending):
+            cols = np.argmax(candidates[pending], axis=1)
+            rows = pending
+            
+            prominences = _peak_prominences_batch(block, rows, cols, max_tables, min_tables)
+            valid = prominences >= 0.2
+            widths, left_ips = _peak_left_ips_batch(
+                block, rows[valid], cols[valid], prominences[valid], min_tables
+            )
+            valid[valid] = widths >= 1
+            
+            survived = np.flatnonzero(valid)
+            computed_width = 2 * (cols[survived] - left_ips[widths >= 1])
+            ratio_max_width[start + rows[survived]] = computed_width / num_channels
+            
+            failed = ~valid
+            candidates[rows[failed], cols[failed]] = -np.inf
+            pending = rows[failed]
+            pending = pending[(candidates[pending] > -np.inf).any(axis=1)]
+    return ratio_max_width
+
+def compute_ratio_high_low_batch(log_counts, energy_bins):
+    """
+    Batch version of compute_ratio_high_low.
+    
+    Returns:
+        ratio (np.array): Ratio per spectrum, NaN where compute_ratio_high_low returns None.
+    """
+    ratio, valid = _ratio_high_low_batch(log_counts, energy_bins)
+    ratio[~valid] = np.nan
+    return ratio
+
+def _ratio_high_low_batch(log_counts, energy_bins):
+    """
+    Compute ratio_high_low together with a mask of the rows for which the scalar
+    version would not return None (a NaN ratio from NaN counts is still valid there).
+    """
+    high_mask = energy_bins > 4000
+    low_mask = energy_bins < 100
+    
+    if not np.any(high_mask) or not np.any(low_mask):
+        return np.full(log_counts.shape[0], np.nan, dtype=log_counts.dtype), np.zeros(log_counts.shape[0], dtype=bool)
+    
+    # Contiguous rows keep np.mean's summation order identical to the 1D case.
+    high_mean = np.mean(np.ascontiguousarray(log_counts[:, high_mask]), axis=1)
+    low_mean = np.mean(np.ascontiguousarray(log_counts[:, low_mask]), axis=1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = high_mean / low_mean
+    return ratio, low_mean != 0
+
+def compute_norm_Bt_batch(Btot, dtype=np.float64):
+    """
+    Batch version of compute_norm_Bt. As in the scalar version, values that do not
+    compare <= 1 after normalization (including NaN) become 1.
+    """
+    dtype = np.dtype(dtype).type
+    normalized = np.asarray(Btot, dtype=dtype) / dtype(50.0)
+    return np.where(normalized <= 1, normalized, dtype(1.0))
+
+@instrumented('features.pseudofeature_batch')
+def check_pseudofeature_batch(log_counts, energy_bins):
+    """
+    Batch version of check_pseudofeature. The row-wise Pearson correlation is
+    evaluated with the same steps as scipy.stats.pearsonr (centering, scaling
+    by the maximum absolute deviation, normalization and dot product).
+    
+    Returns:
+        trigger (np.array): Boolean mask, True where the pseudofeature condition is met.
+    """
+    mask = energy_bins > 300
+    n_rows = log_counts.shape[0]
+    if not np.any(mask):
+        return np.ones(n_rows, dtype=bool)
+    
+    x = np.asarray(energy_bins[mask], dtype=log_counts.dtype)
+    y = log_counts[:, mask]
+    
+    if len(x) < 2:
+        return np.ones(n_rows, dtype=bool)
+    if len(x) == 2:
+        r = np.sign(x[1] - x[0]) * np.sign(y[:, 1] - y[:, 0])
+        return r > 0.7
+    
+    xm = x - x.mean()
+    ym = y - y.mean(axis=1, keepdims=True)
+    xmax = np.max(np.abs(xm))
+    ymax = np.max(np.abs(ym), axis=1, keepdims=True)
+    if xmax == 0:
+        return np.zeros(n_rows, dtype=bool)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xm = xm / xmax
+        ym = ym / ymax
+        normxm = np.linalg.norm(xm)
+        normym = np.linalg.norm(ym, axis=1, keepdims=True)
+        r = (ym / normym) @ (xm / normxm)
+    # Constant spectra give NaN, which (as in pearsonr) never triggers.
+    r = np.clip(r, -1.0, 1.0)
+    return r > 0.7
+
+def process_spectra_batch(spectra, Btot, energy_bins, num_channels=32, dtype=np.float64):
+    """
+    Process many 1-minute averaged ion spectra at once. Equivalent to calling
+    process_spectrum on every row.
+    
+    Parameters:
+        spectra (np.array): 2D array (N, num_channels) of ion spectrogram counts.
+        Btot (np.array): 1D array (N,) of total magnetic field magnitudes.
+        energy_bins (np.array): 1D array of energy values for each channel.
+        num_channels (int): Number of energy channels (default is 32).
+        dtype: Floating point type of the computation and the features (default float64,
+               COMPACT_DTYPE for the compact path).
+    
+    Returns:
+        features (dict): 'ratio_max_width', 'ratio_high_low' and 'norm_Bt' arrays, plus
+                         the boolean 'pseudofeature' mask of zeroed rows.
+    """
+    energy_bins = np.asarray(energy_bins)
+    dtype = np.dtype(dtype).type
+    log_counts = np.log10(np.asarray(spectra, dtype=dtype) + dtype(1e-6))
+    
+    ratio_max_width = compute_peak_features_batch(log_counts, num_channels, dtype)
+    if dtype == np.float64:
+        ratio_high_low, ratio_valid = _ratio_high_low_batch(log_counts, energy_bins)
+    else:
+        # The ratio of the two channel means is ill-conditioned when the low-energy mean
+        # is close to 0, so it is evaluated in float64 on the channels it uses.
+        used = (energy_bins > 4000) | (energy_bins < 100)
+        log_used = np.log10(np.asarray(spectra)[:, used].astype(np.float64) + 1e-6)
+        ratio_high_low, ratio_valid = _ratio_high_low_batch(log_used, energy_bins[used])
+        ratio_high_low = ratio_high_low.astype(dtype)
+    norm_Bt = compute_norm_Bt_batch(Btot, dtype)
+    
+    # No peak or no valid ratio_high_low triggers the pseudofeature; otherwise
+    # the linear-fit check decides.
+    pseudofeature = np.isnan(ratio_max_width) | ~ratio_valid
+    remaining = np.nonzero(~pseudofeature)[0]
+    if len(remaining):
+        pseudofeature[remaining] = check_pseudofeature_batch(log_counts[remaining], energy_bins)
+    
+    ratio_max_width[pseudofeature] = 0
+    ratio_high_low[pseudofeature] = 0
+    norm_Bt[pseudofeature] = 0
+    
+    return {
+        'ratio_max_width': ratio_max_width,
+        'ratio_high_low': ratio_high_low,
+        'norm_Bt': norm_Bt,
+        'pseudofeature': pseudofeature
+    }
+
+FEATURE_NAMES = ('ratio_max_width', 'ratio_high_low', 'norm_Bt')
+
+# Bump when a change to the feature code alters its output; cached features
+# computed with another version are not reused (see cache.py).
+FEATURE_VERSION = 1
+
+# Floating point type of the compact path, and the bound on the relative difference
+# of its features from the float64 path (see the module docstring).
+COMPACT_DTYPE = np.float32
+COMPACT_TOLERANCE = 1e-5
+
+def _process_chunk(chunk):
+    """
+    Worker for extract_features: process one (spectra, Btot, energy_bins, dtype) chunk
+    and return the feature columns.
+    """
+    spectra, Btot, energy_bins, dtype = chunk
+    features = process_spectra_batch(spectra, Btot, energy_bins, dtype=dtype)
+    return np.column_stack([features[name] for name in FEATURE_NAMES])
+
+@instrumented('features.extract')
+def extract_features(ion_spec_df, Btot_series, energy_bins, n_jobs=1, chunk_size=100000, tolerance=None,
+                     max_gap=None, dtype=np.float64):
+    """
+    Extract features for all 1-minute averaged ion spectra without exporting them.
+    
+    The time index is split into chunks of chunk_size minutes. With n_jobs > 1 the
+    chunks are processed in a pool of worker processes; the results are put back
+    together in time order, so the output is identical to the serial path.
+    
+    Parameters:
+        ion_spec_df (pd.DataFrame): DataFrame containing resampled ion spectrogram data.
+        Btot_series (pd.Series): Series containing the total magnetic field magnitude for each 1-minute bin.
+        energy_bins (np.array): 1D array of energy values corresponding to the 32 channels.
+        n_jobs (int): Number of worker processes (default 1, None uses all CPUs).
+        chunk_size (int): Number of 1-minute bins per chunk (default 100000).
+        tolerance (str or pd.Timedelta): Take Btot from the nearest bin within this distance when a
+                                         minute has none (default: exact matches only).
+        max_gap (str or pd.Timedelta): Interpolate Btot across gaps up to this length (default: none).
+        dtype: Floating point type of the computation and the features (default float64; with
+               COMPACT_DTYPE, float32 spectra are used without a copy).
+    
+    Returns:
+        features_df (pd.DataFrame): DataFrame with the computed features for each time bin.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    
+    # One sorted merge of the Btot bins onto the spectrum minutes; minutes without
+    # a Btot value (within the tolerance) get NaN.
+    with stage('features.btot_lookup'):
+        Btot = align_Btot(ion_spec_df.index, Btot_series, tolerance, max_gap)
+    spectra = ion_spec_df.to_numpy(dtype=dtype)
+    energy_bins = np.asarray(energy_bins)
+    
+    chunks = (
+        (spectra[start:start + chunk_size], Btot[start:start + chunk_size], energy_bins, dtype)
+        for start in range(0, len(spectra), chunk_size)
+    )
+    n_chunks = -(-len(spectra) // chunk_size)
+    
+    values = np.empty((len(spectra), len(FEATURE_NAMES)), dtype=dtype)
+    if n_jobs > 1 and n_chunks > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, n_chunks)) as executor:
+            results = executor.map(_process_chunk, chunks)
+            for i, result in enumerate(results):
+                values[i * chunk_size:i * chunk_size + len(result)] = result
+    else:
+        for i, chunk in enumerate(chunks):
+            result = _process_chunk(chunk)
+            values[i * chunk_size:i * chunk_size + len(result)] = result
+    
+    return pd.DataFrame(values, index=ion_spec_df.index, columns=list(FEATURE_NAMES))
+
+def process_all_spectra(ion_spec_df, Btot_series, energy_bins, n_jobs=1, chunk_size=100000,
+                        output_path='data/processed/features.frame', tolerance=None, max_gap=None,
+                        dtype=np.float64):
     """
     Process all 1-minute averaged ion spectra to extract features.
     
@@ -181,28 +623,42 @@ def process_all_spectra(ion_spec_df, Btot_series, energy_bins):
                                     Each row corresponds to one 1-minute time bin and has 32 channels.
         Btot_series (pd.Series): Series containing the total magnetic field magnitude for each 1-minute bin.
         energy_bins (np.array): 1D array of energy values corresponding to the 32 channels.
+        n_jobs (int): Number of worker processes (default 1, None uses all CPUs).
+        chunk_size (int): Number of 1-minute bins handed to a worker at a time (default 100000).
+        output_path (str): Binary table the features are written to (a '.csv' path exports CSV instead).
+        tolerance, max_gap: Btot alignment options (see extract_features).
+        dtype: Floating point type of the features (default float64, COMPACT_DTYPE for the compact path).
     
     Returns:
         features_df (pd.DataFrame): DataFrame with the computed features for each time bin.
     """
-    feature_list = []
-    for timestamp, row in ion_spec_df.iterrows():
-        spectrum = row.values
-        # Assumes the time indices align between the ion spectrum and the Btot data.
-        Btot = Btot_series.loc[timestamp] if timestamp in Btot_series.index else np.nan
-        features = process_spectrum(spectrum, Btot, energy_bins)
-        feature_list.append(features)
-    
-    features_df = pd.DataFrame(feature_list, index=ion_spec_df.index)
+    features_df = extract_features(ion_spec_df, Btot_series, energy_bins, n_jobs, chunk_size, tolerance, max_gap,
+                                   dtype)
     
-    # Export features to CSV
-    output_path = 'data/processed/features.csv'
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)  # Create directory if it doesn't exist
-    features_df.to_csv(output_path)
+    # Export features (see scripts/storage.py for the binary layout)
+    write_table(features_df, output_path)
     print(f"Features exported to: {output_path}")
     
     return features_df
 
+def extract_features_stream(chunks, energy_bins, n_jobs=1, chunk_size=100000, dtype=np.float64):
+    """
+    Extract features chunk by chunk from a stream of resampled data, such as the
+    one produced by read_cdf.stream_cdf_files, so only one chunk is held in memory.
+    
+    Parameters:
+        chunks (iterable): (ion_spec_df, B_field_df) pairs; B_field_df has a 'Btot' column.
+        energy_bins (np.array): 1D array of energy values corresponding to the 32 channels.
+        n_jobs (int): Number of worker processes per chunk (see extract_features).
+        chunk_size (int): Number of 1-minute bins per worker task (see extract_features).
+        dtype: Floating point type of the features (see extract_features).
+    
+    Yields:
+        features_df (pd.DataFrame): Features of the minutes in each input chunk.
+    """
+    for ion_spec_df, B_field_df in chunks:
+        yield extract_features(ion_spec_df, B_field_df['Btot'], energy_bins, n_jobs, chunk_size, dtype=dtype)
+
 if __name__ == "__main__":
     # Example usage / test run:
     # Create an energy_bins array (assuming 32 channels from 10 eV to 30 keV, logarithmically spaced)
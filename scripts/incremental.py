@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+incremental.py
+
+Incremental, append-only feature extraction for near-real-time ingestion.
+
+IncrementalFeatureExtractor remembers which CDF files it has processed, the
+start of the first minute it has not emitted yet and the records of that
+still-open minute. On every update it reads only the newly arrived files,
+completes the open minute with their records, extracts features for the
+minutes that are now closed, appends them to the feature store and labels
+them with the trained GMM. The work per update therefore depends on the
+amount of new data, not on the size of the archive.
+
+The feature and label tables live in the state directory by default, apart
+from the batch pipeline's data/processed/features.frame. Rows whose minute is
+not after the last minute already stored in a table are never appended, so
+pointing the extractor at a table that already holds those minutes does not
+duplicate them.
+
+Usage:
+    python -m scripts.incremental [data_dir]
+"""
+
+import glob
+import json
+import os
+import sys
+import joblib
+import numpy as np
+import pandas as pd
+from scripts.feature_engineering import FEATURE_NAMES, extract_features
+from scripts.instrumentation import stage
+from scripts.read_cdf import MinuteResampler, iter_cdf_files
+from scripts.storage import append_table, last_index, read_table, write_table
+
+DEFAULT_STATE_DIR = 'data/processed/incremental'
+
+def _after_last(df, path):
+    """
+    Rows of df after the last index already stored in the table at path.
+    """
+    last = last_index(path)
+    if last is None or len(df) == 0:
+        return df
+    skipped = int((df.index <= last).sum())
+    if skipped:
+        print(f"Skipping {skipped} minutes already in {path} (up to {last})")
+    return df[df.index > last]
+
+class IncrementalFeatureExtractor:
+    """
+    Append-only feature extraction over a growing directory of CDF files.
+    
+    Parameters:
+        energy_bins (np.array): 1D array of energy values corresponding to the 32 channels.
+        features_path (str): Feature table the new rows are appended to
+                             (default: features.frame in state_dir).
+        labels_path (str): Table the GMM cluster labels are appended to (default: labels.frame in state_dir).
+        model_path (str): Trained GMM (joblib). If None, rows are not labeled.
+        state_dir (str): Directory holding the processing state between updates.
+    """
+    
+    def __init__(self, energy_bins, features_path=None, labels_path=None, model_path='models/gmm_model.pkl',
+                 state_dir=DEFAULT_STATE_DIR):
+        self.energy_bins = np.asarray(energy_bins)
+        self.features_path = features_path or os.path.join(state_dir, 'features.frame')
+        self.labels_path = labels_path or os.path.join(state_dir, 'labels.frame')
+        self.state_dir = state_dir
+        # The model is loaded once and reused for every update.
+        self.model = None
+        if model_path:
+            with stage('io.load_model'):
+                self.model = joblib.load(model_path)
+        self.ion_resampler = MinuteResampler()
+        self.B_resampler = MinuteResampler()
+        self.processed_files = {}
+        self._load_state()
+    
+    def _state_file(self):
+        return os.path.join(self.state_dir, 'state.json')
+    
+    def _load_state(self):
+        if not os.path.isfile(self._state_file()):
+            return
+        with open(self._state_file()) as f:
+            state = json.load(f)
+        self.processed_files = state['processed_files']
+        for name, resampler in (('ion_spec', self.ion_resampler), ('B_field', self.B_resampler)):
+            if state['next_bin'] is not None:
+                resampler.next_bin = pd.Timestamp(state['next_bin'])
+            buffer_path = os.path.join(self.state_dir, f'{name}_buffer.frame')
+            if os.path.isdir(buffer_path):
+                resampler.buffer = read_table(buffer_path, mmap=False)
+    
+    def _save_state(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        for name, resampler in (('ion_spec', self.ion_resampler), ('B_field', self.B_resampler)):
+            if resampler.buffer is not None:
+                write_table(resampler.buffer, os.path.join(self.state_dir, f'{name}_buffer.frame'))
+        next_bin = self.ion_resampler.next_bin
+        state = {
+            'processed_files': self.processed_files,
+            'next_bin': None if next_bin is None else next_bin.isoformat()
+        }
+        staging = self._state_file() + '.tmp'
+        with open(staging, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(staging, self._state_file())
+    
+    @property
+    def last_timestamp(self):
+        """
+        Start of the first minute that has not been emitted yet (None before the first update).
+        """
+        return self.ion_resampler.next_bin
+    
+    def new_files(self, data_dir):
+        """
+        CDF files in data_dir that have not been processed in their current version.
+        """
+        files = []
+        for cdf_file in sorted(glob.glob(os.path.join(data_dir, '*.cdf'))):
+            stat = os.stat(cdf_file)
+            if self.processed_files.get(os.path.abspath(cdf_file)) != [stat.st_size, stat.st_mtime_ns]:
+                files.append(cdf_file)
+        return files
+    
+    def update(self, data_dir, flush=False):
+        """
+        Process the files that arrived since the last update.
+        
+        Minutes are emitted once they are closed, i.e. once data from a later minute
+        has been seen; the last, partially filled minute waits for the next update
+        unless flush is set (e.g. at the end of a mission phase).
+        
+        Parameters:
+            data_dir (str): Directory containing the CDF files.
+            flush (bool): Also emit the last, possibly incomplete minute.
+        
+        Returns:
+            pd.DataFrame: Features of the newly emitted minutes, with a 'cluster' column
+                          if a model is loaded.
+        """
+        for result in iter_cdf_files(self.new_files(data_dir)):
+            if result['error'] is not None:
+                print(f"Error loading {result['file']}: {result['error']}")
+                continue
+            print(f"Loaded: {os.path.basename(result['file'])}")
+            self.ion_resampler.push(result['ion_df'])
+            self.B_resampler.push(result['B_df'])
+            stat = os.stat(result['file'])
+            self.processed_files[os.path.abspath(result['file'])] = [stat.st_size, stat.st_mtime_ns]
+        
+        open_bins = [self.ion_resampler.open_bin(), self.B_resampler.open_bin()]
+        if None in open_bins:
+            self._save_state()
+            return pd.DataFrame(columns=list(FEATURE_NAMES))
+        until = min(open_bins)
+        if flush:
+            until = max(open_bins) + pd.Timedelta('1Min')
+        ion_spec_df = self.ion_resampler.pop(until)
+        B_field_df = self.B_resampler.pop(until)
+        
+        features_df = extract_features(ion_spec_df, B_field_df['Btot'], self.energy_bins)
+        features_df = _after_last(features_df, self.features_path)
+        if len(features_df):
+            append_table(features_df, self.features_path)
+            if self.model is not None:
+                with stage('gmm.predict'):
+                    labels = self.model.predict(features_df[list(FEATURE_NAMES)])
+                labels_df = _after_last(pd.DataFrame({'cluster': labels}, index=features_df.index), self.labels_path)
+                if len(labels_df):
+                    append_table(labels_df, self.labels_path)
+                features_df = features_df.assign(cluster=labels)
+        self._save_state()
+        return features_df
+
+if __name__ == "__main__":
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    energy_bins = np.logspace(np.log10(10), np.log10(30000), 32)
+    extractor = IncrementalFeatureExtractor(energy_bins)
+    new_rows = extractor.update(data_dir)
+    print(f"Appended {len(new_rows)} minutes; next minute to process: {extractor.last_timestamp}")
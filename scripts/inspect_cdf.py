@@ -1,60 +1,59 @@
-from spacepy import pycdf
 import os
 import sys
 from datetime import datetime
+from scripts.catalog import Catalog
+from scripts.cdf_index import CDFIndex
 
-def inspect_cdf_file(file_path, output_file):
+def inspect_cdf_file(file_path, output_file, index=None):
     """
     Inspect the contents of a CDF file and write information about its variables to a file
     
     Parameters:
         file_path (str): Path to the CDF file
         output_file (file): File object to write output to
+        index (CDFIndex): Metadata index to take the variables from (see cdf_index.py);
+                          the file is only opened when it is not indexed yet
     """
     output_file.write(f"\nInspecting: {os.path.basename(file_path)}\n")
     output_file.write("-" * 80 + "\n")
     
-    with pycdf.CDF(file_path) as cdf:
-        # Get list of variables
-        variables = cdf.keys()
-        
-        output_file.write("Available variables:\n")
-        output_file.write("-" * 80 + "\n")
-        
-        for var in variables:
-            try:
-                # Get variable info
-                data = cdf[var]
-                shape = data.shape if hasattr(data, 'shape') else 'scalar'
-                
-                # Get attributes for this variable
-                attrs = cdf[var].attrs
-                
-                output_file.write(f"\nVariable: {var}\n")
-                output_file.write(f"Shape: {shape}\n")
-                output_file.write("Attributes:\n")
-                for attr, value in attrs.items():
-                    output_file.write(f"  {attr}: {value}\n")
-                
-            except Exception as e:
-                output_file.write(f"Error reading {var}: {str(e)}\n")
-        
-        output_file.write("\n" + "=" * 80 + "\n")
+    variables = (index or CDFIndex()).inspect(file_path)
+    
+    output_file.write("Available variables:\n")
+    output_file.write("-" * 80 + "\n")
+    
+    for var, info in variables.items():
+        if 'error' in info:
+            output_file.write(f"Error reading {var}: {info['error']}\n")
+            continue
+        output_file.write(f"\nVariable: {var}\n")
+        output_file.write(f"Shape: {tuple(info['shape'])}\n")
+        output_file.write("Attributes:\n")
+        for attr, value in info['attrs'].items():
+            output_file.write(f"  {attr}: {value}\n")
+    
+    output_file.write("\n" + "=" * 80 + "\n")
 
-if __name__ == "__main__":
-    # Create output directory if it doesn't exist
-    output_dir = 'data/cdf_inspection'
+def write_report(data_dir='data', output_dir='data/cdf_inspection'):
+    """
+    Bring the catalog up to date with data_dir and write an inspection report
+    of its CDF files to a timestamped text file in output_dir.
+    
+    Returns:
+        str: Path of the report.
+    """
     os.makedirs(output_dir, exist_ok=True)
     
     # Create output file with timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     output_path = os.path.join(output_dir, f'cdf_inspection_{timestamp}.txt')
     
-    # Specify path to CDF files
-    data_dir = '/Users/nathan/CursorProjects/gaussian_mixed_model_mms/data'
-    
-    # Get list of CDF files
-    cdf_files = [f for f in os.listdir(data_dir) if f.endswith('.cdf')]
+    # Bring the catalog up to date (only new or modified files are scanned) and list the files from it
+    index = CDFIndex()
+    with Catalog(index=index) as catalog:
+        counts = catalog.update(data_dir)
+        print(f"Catalog: {counts['added']} added, {counts['updated']} updated, {counts['removed']} removed")
+        cdf_files = catalog.files(directory=data_dir)
     
     with open(output_path, 'w') as output_file:
         # Write header
@@ -63,10 +62,14 @@ if __name__ == "__main__":
         output_file.write("=" * 80 + "\n")
         
         if cdf_files:
-            for cdf_file in cdf_files:
-                file_path = os.path.join(data_dir, cdf_file)
-                inspect_cdf_file(file_path, output_file)
+            for file_path in cdf_files:
+                inspect_cdf_file(file_path, output_file, index)
             print(f"Inspection report saved to: {output_path}")
         else:
             output_file.write("\nNo CDF files found in directory\n")
-            print("No CDF files found in directory") 
\ No newline at end of file
+            print("No CDF files found in directory")
+    return output_path
+
+if __name__ == "__main__":
+    # Specify path to CDF files
+    write_report(sys.argv[1] if len(sys.argv) > 1 else 'data')
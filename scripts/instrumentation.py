@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+instrumentation.py
+
+Per-stage timing, memory and profiling hooks for the pipeline.
+
+The main stages are wrapped with `instrumented` (functions) or `stage` (code
+blocks), under names such as 'cdf.read', 'cdf.resample', 'features.peaks',
+'features.pseudofeature', 'features.btot_lookup', 'io.write_table' and
+'gmm.fit'. While instrumentation is disabled (the default) a wrapped call
+costs one flag check and `stage` returns a shared no-op context manager.
+
+Once enabled, every stage records its call count and the latency of each
+call; with memory=True the net change of traced Python memory per call is
+recorded as well (tracemalloc, which slows the run down noticeably). One stage
+can additionally be run under cProfile, with the statistics written to a
+.prof file for pstats or snakeviz.
+
+Stages that run in worker processes (n_jobs > 1, executor='process') are not
+recorded; profile with a single process.
+
+Instrumentation can be switched on without touching code through environment
+variables, read when this module is first imported:
+    MMS_PROFILE=report.prom         enable and write the report on exit
+                                    (Prometheus text for .prom, JSON otherwise)
+    MMS_PROFILE_MEMORY=1            also record memory deltas
+    MMS_PROFILE_STAGE=cdf.read      run this stage under cProfile
+    MMS_PROFILE_STAGE_OUTPUT=x.prof where to write the cProfile statistics
+                                    (default: <stage>.prof)
+
+Usage:
+    MMS_PROFILE=profile.prom python -m scripts.feature_engineering
+"""
+
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+_enabled = False
+_memory = False
+_profile_stage = None
+_profile_path = None
+_profiler = None
+_profile_depth = 0
+
+_stats = {}
+_lock = threading.Lock()
+
+class _NullStage:
+    """
+    Context manager that does nothing, returned by stage() while disabled.
+    """
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    """
+    Context manager that times one execution of a stage and records it.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __enter__(self):
+        global _profiler, _profile_depth
+        if self.name == _profile_stage:
+            if _profiler is None:
+                _profiler = cProfile.Profile()
+            if _profile_depth == 0:
+                _profiler.enable()
+            _profile_depth += 1
+        self.memory = tracemalloc.get_traced_memory()[0] if _memory else None
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        global _profile_depth
+        seconds = time.perf_counter() - self.start
+        memory = tracemalloc.get_traced_memory()[0] - self.memory if self.memory is not None else None
+        if self.name == _profile_stage:
+            _profile_depth -= 1
+            if _profile_depth == 0:
+                _profiler.disable()
+        _record(self.name, seconds, memory)
+        return False
+
+def _record(name, seconds, memory):
+    with _lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = {'seconds': [], 'memory': []}
+        entry['seconds'].append(seconds)
+        if memory is not None:
+            entry['memory'].append(memory)
+
+def enable(memory=False, profile_stage=None, profile_path=None):
+    """
+    Start recording stage timings.
+    
+    Parameters:
+        memory (bool): Also record the change of traced memory per call (starts tracemalloc).
+        profile_stage (str): Name of a stage to run under cProfile.
+        profile_path (str): File the cProfile statistics are written to by disable()
+                            or write_profile() (default: '<profile_stage>.prof').
+    """
+    global _enabled, _memory, _profile_stage, _profile_path
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _profile_stage = profile_stage
+    _profile_path = profile_path or (f'{profile_stage}.prof' if profile_stage else None)
+    _enabled = True
+
+def disable():
+    """
+    Stop recording. Collected statistics are kept until reset(); cProfile
+    statistics of the profiled stage are written out.
+    """
+    global _enabled, _memory
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+    write_profile()
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """
+    Discard all collected statistics.
+    """
+    global _profiler
+    with _lock:
+        _stats.clear()
+    _profiler = None
+
+def stage(name):
+    """
+    Context manager that records the enclosed block as one call of stage `name`.
+    
+    Example:
+        with stage('cdf.resample'):
+            resampled = df.resample('1Min').mean()
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+def instrumented(name):
+    """
+    Decorator that records every call of the function as one call of stage `name`.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def report():
+    """
+    Summarize the collected statistics.
+    
+    Returns:
+        pd.DataFrame: One row per stage with the call count, total, mean, p50, p90, p99 and
+                      max latency in seconds and, if memory was recorded, the total and
+                      maximum memory delta in bytes. Sorted by total time.
+    """
+    with _lock:
+        stats = {name: (np.array(entry['seconds']), np.array(entry['memory'])) for name, entry in _stats.items()}
+    rows = []
+    for name, (seconds, memory) in stats.items():
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+        row = {
+            'stage': name,
+            'count': len(seconds),
+            'total_seconds': seconds.sum(),
+            'mean_seconds': seconds.mean(),
+            'p50_seconds': p50,
+            'p90_seconds': p90,
+            'p99_seconds': p99,
+            'max_seconds': seconds.max()
+        }
+        if len(memory):
+            row['memory_delta_bytes'] = int(memory.sum())
+            row['max_memory_delta_bytes'] = int(memory.max())
+        rows.append(row)
+    if not rows:
+        return pd.DataFrame(columns=['count', 'total_seconds'])
+    return pd.DataFrame(rows).set_index('stage').sort_values('total_seconds', ascending=False)
+
+def _prometheus_text(summary, prefix='mms_pipeline'):
+    lines = [
+        f'# HELP {prefix}_stage_seconds Latency of pipeline stages.',
+        f'# TYPE {prefix}_stage_seconds summary'
+    ]
+    for name, row in summary.iterrows():
+        for quantile, column in (('0.5', 'p50_seconds'), ('0.9', 'p90_seconds'), ('0.99', 'p99_seconds')):
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{quantile}"}} {row[column]:.9g}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {row["total_seconds"]:.9g}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {int(row["count"])}')
+    if 'memory_delta_bytes' in summary:
+        lines.append(f'# HELP {prefix}_stage_memory_delta_bytes Net change of traced memory over all calls of a stage.')
+        lines.append(f'# TYPE {prefix}_stage_memory_delta_bytes gauge')
+        for name, row in summary.dropna(subset=['memory_delta_bytes']).iterrows():
+            lines.append(f'{prefix}_stage_memory_delta_bytes{{stage="{name}"}} {int(row["memory_delta_bytes"])}')
+    return '\n'.join(lines) + '\n'
+
+def write_report(path):
+    """
+    Write the report to a file: Prometheus text exposition format if the path ends
+    in '.prom' (e.g. for the node_exporter textfile collector), JSON otherwise.
+    """
+    summary = report()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        if path.endswith('.prom'):
+            f.write(_prometheus_text(summary))
+        else:
+            json.dump(summary.reset_index().to_dict(orient='records'), f, indent=2)
+
+def write_profile(path=None):
+    """
+    Write the cProfile statistics of the profiled stage, if it has run.
+    
+    Returns:
+        str: Path of the written file, or None.
+    """
+    if _profiler is None:
+        return None
+    path = path or _profile_path
+    _profiler.dump_stats(path)
+    return path
+
+def _configure_from_env():
+    report_path = os.environ.get('MMS_PROFILE')
+    if not report_path:
+        return
+    enable(
+        memory=os.environ.get('MMS_PROFILE_MEMORY', '') not in ('', '0'),
+        profile_stage=os.environ.get('MMS_PROFILE_STAGE') or None,
+        profile_path=os.environ.get('MMS_PROFILE_STAGE_OUTPUT') or None
+    )
+    
+    def finish():
+        disable()
+        write_report(report_path)
+        print(f"Profile report written to {report_path}")
+    atexit.register(finish)
+
+_configure_from_env()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+partitions.py
+
+Partitioned processing of many spacecraft and days.
+
+The CDF archive is split into partitions keyed by (spacecraft, day). Each
+partition is built from every FPI file whose records cover part of that day,
+so a file that runs past midnight also feeds the following day(s). The time
+span of each file comes from the catalog or the CDF index. The magnetic
+field comes from the partition's FGM files if there are any, and otherwise
+from the FPI files (see read_cdf.read_cdf_file).
+
+Partitions are processed independently in a process pool. Each writes the
+1-minute features of its own day to a binary table (see storage.py) in a
+directory layout keyed by probe and day:
+
+    data/processed/partitions/
+        probe=mms1/day=20151017/features.frame
+        probe=mms2/day=20151017/features.frame
+        ...
+
+read_partitioned answers time-range and probe queries. It picks the matching
+partitions from the directory names and reads only those, memory-mapped,
+slicing each to the requested range.
+
+Usage:
+    python -m scripts.partitions process data --probes mms1 mms2 --start 2015-10-01 --end 2015-11-01
+    python -m scripts.partitions query --start "2015-10-17 05:00" --end "2015-10-17 09:00" --probes mms1
+"""
+
+import argparse
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scripts.feature_engineering import extract_features
+from scripts.alignment import merge_binned
+from scripts.read_cdf import PROBES, read_B_field_binned, read_cdf_file, read_ion_spec_file
+from scripts.storage import read_table, write_table
+
+DEFAULT_OUTPUT_DIR = 'data/processed/partitions'
+
+# e.g. mms1_fpi_fast_l2_dis-moms_20151017040000_v3.4.0.cdf, mms2_fgm_srvy_l2_20151017_v4.18.0.cdf
+FILENAME_PATTERN = re.compile(r'^(mms[1-4])_(fpi|fgm)_.*_(\d{8})(\d{6})?_v[\d.]+\.cdf$', re.IGNORECASE)
+
+def parse_filename(cdf_file):
+    """
+    Split an MMS CDF file name into its partition key.
+    
+    Returns:
+        dict: 'probe', 'instrument' ('fpi' or 'fgm'), 'day' (YYYYMMDD) and 'start'
+              (pd.Timestamp), or None if the name does not follow the MMS convention.
+    """
+    match = FILENAME_PATTERN.match(os.path.basename(cdf_file))
+    if match is None:
+        return None
+    probe, instrument, day, clock = match.groups()
+    return {
+        'probe': probe.lower(),
+        'instrument': instrument.lower(),
+        'day': day,
+        'start': pd.Timestamp(day + (clock or '000000'))
+    }
+
+def _day(timestamp):
+    return None if timestamp is None else pd.Timestamp(timestamp).strftime('%Y%m%d')
+
+def _file_end(cdf_file, catalog_ends, index):
+    """
+    Time of the last record of a file, or None if it cannot be determined.
+    """
+    if catalog_ends is not None:
+        file_end = catalog_ends.get(os.path.abspath(cdf_file))
+        return None if pd.isna(file_end) else file_end
+    try:
+        span = index.time_span(cdf_file)
+    except Exception:
+        return None
+    return None if span is None else span[1]
+
+def discover_partitions(data_dir, probes=PROBES, start=None, end=None, catalog=None, index=None):
+    """
+    Group the CDF files below data_dir (searched recursively) by (probe, day). A file
+    belongs to every day its records cover, from its start to its last record.
+    
+    Parameters:
+        data_dir (str): Root of the CDF archive.
+        probes (iterable): Spacecraft to include.
+        start, end: Optional first and last day (inclusive) to include.
+        catalog (Catalog): Take the file list and time spans from this catalog (see catalog.py)
+                           instead of searching data_dir.
+        index (CDFIndex): Index giving the time spans without a catalog (default: CDFIndex()).
+                          A file without a span is taken to end where the next file starts.
+    
+    Returns:
+        dict: (probe, day) -> {'fpi': [...], 'fgm': [...]}, file lists in time order.
+    """
+    files = {}
+    if catalog is not None:
+        cdf_files = catalog.files(directory=data_dir)
+        summary = catalog.summary()
+        catalog_ends = dict(zip(summary['path'], summary['end']))
+    else:
+        from scripts.cdf_index import CDFIndex
+        cdf_files = glob.glob(os.path.join(data_dir, '**', '*.cdf'), recursive=True)
+        catalog_ends, index = None, index or CDFIndex()
+    for cdf_file in cdf_files:
+        info = parse_filename(cdf_file)
+        if info is None or info['probe'] not in probes:
+            continue
+        files.setdefault((info['probe'], info['instrument']), []).append((info['start'], cdf_file))
+    
+    first, last = _day(start), _day(end)
+    partitions = {}
+    for (probe, instrument), entries in files.items():
+        entries.sort()
+        for i, (file_start, cdf_file) in enumerate(entries):
+            file_end = _file_end(cdf_file, catalog_ends, index)
+            if file_end is None:
+                file_end = entries[i + 1][0] - pd.Timedelta(1) if i + 1 < len(entries) else file_start
+            # Records running past midnight make the file part of the following day(s) too.
+            for day in pd.date_range(file_start.normalize(), max(file_start, file_end).normalize(), freq='D'):
+                day = day.strftime('%Y%m%d')
+                if (first and day < first) or (last and day > last):
+                    continue
+                partitions.setdefault((probe, day), {'fpi': [], 'fgm': []})[instrument].append(cdf_file)
+    return {key: partitions[key] for key in sorted(partitions)}
+
+def partition_path(output_dir, probe, day):
+    return os.path.join(output_dir, f'probe={probe}', f'day={day}', 'features.frame')
+
+def _concat(frames):
+    df = pd.concat(frames, axis=0).sort_index()
+    return df[~df.index.duplicated(keep='first')]
+
+def process_partition(probe, day, files, energy_bins, output_dir=DEFAULT_OUTPUT_DIR, tolerance=None, max_gap=None):
+    """
+    Resample and extract the features of one (probe, day) partition and write
+    them to its table. tolerance and max_gap control the Btot alignment
+    (see feature_engineering.extract_features).
+    
+    Returns:
+        dict: 'probe', 'day', 'n_minutes', 'seconds' and 'error' (None on success)
+    """
+    start = time.perf_counter()
+    try:
+        day_start = pd.Timestamp(day)
+        day_end = day_start + pd.Timedelta(days=1)
+        if files['fgm']:
+            # High-rate FGM data is decimated to minute means while it is read.
+            ion_df = _concat([read_ion_spec_file(f, probe) for f in files['fpi']])
+            B_binned = merge_binned([read_B_field_binned(f, probe) for f in files['fgm']], 'Btot')
+            Btot = B_binned['Btot'][(B_binned.index >= day_start) & (B_binned.index < day_end)]
+        else:
+            pairs = [read_cdf_file(f, probe) for f in files['fpi']]
+            ion_df = _concat([ion for ion, _ in pairs])
+            B_df = _concat([B for _, B in pairs])
+            Btot = B_df[(B_df.index >= day_start) & (B_df.index < day_end)].resample('1Min').mean()['Btot']
+        ion_spec_df = ion_df[(ion_df.index >= day_start) & (ion_df.index < day_end)].resample('1Min').mean()
+        features_df = extract_features(ion_spec_df, Btot, energy_bins, tolerance=tolerance, max_gap=max_gap)
+        write_table(features_df, partition_path(output_dir, probe, day))
+        n_minutes, error = len(features_df), None
+    except Exception as e:
+        n_minutes, error = 0, f"{type(e).__name__}: {e}"
+    return {
+        'probe': probe,
+        'day': day,
+        'n_minutes': n_minutes,
+        'seconds': time.perf_counter() - start,
+        'error': error
+    }
+
+def _is_fresh(path, files):
+    meta = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta):
+        return False
+    sources = files['fpi'] + files['fgm']
+    return os.path.getmtime(meta) >= max(os.path.getmtime(f) for f in sources)
+
+def process_partitions(data_dir, energy_bins, output_dir=DEFAULT_OUTPUT_DIR, probes=PROBES, start=None,
+                       end=None, n_jobs=None, skip_fresh=True, tolerance=None, max_gap=None, catalog=None,
+                       index=None):
+    """
+    Process all (probe, day) partitions of an archive in parallel.
+    
+    Parameters:
+        data_dir (str): Root of the CDF archive.
+        energy_bins (np.array): 1D array of energy values corresponding to the 32 channels.
+        output_dir (str): Root of the partitioned feature tables.
+        probes (iterable): Spacecraft to process.
+        start, end: Optional first and last day (inclusive) to process.
+        n_jobs (int): Number of worker processes (default: all CPUs).
+        skip_fresh (bool): Skip partitions whose table is newer than all of their CDF files.
+        tolerance, max_gap: Btot alignment options (see feature_engineering.extract_features).
+        catalog (Catalog): Catalog to discover the files from (see discover_partitions).
+        index (CDFIndex): Index giving the file time spans without a catalog.
+    
+    Returns:
+        pd.DataFrame: One row per partition (probe, day, n_minutes, seconds, error, skipped).
+    """
+    partitions = discover_partitions(data_dir, probes, start, end, catalog, index)
+    tasks, summary = [], []
+    for (probe, day), files in partitions.items():
+        if not files['fpi']:
+            continue
+        if skip_fresh and _is_fresh(partition_path(output_dir, probe, day), files):
+            summary.append({'probe': probe, 'day': day, 'n_minutes': None, 'seconds': 0.0,
+                            'error': None, 'skipped': True})
+        else:
+            tasks.append((probe, day, files))
+    
+    energy_bins = np.asarray(energy_bins)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(process_partition, probe, day, files, energy_bins, output_dir, tolerance, max_gap)
+                   for probe, day, files in tasks]
+        for future in futures:
+            result = future.result()
+            if result['error'] is None:
+                print(f"Processed {result['probe']} {result['day']}: {result['n_minutes']} minutes")
+            else:
+                print(f"Error processing {result['probe']} {result['day']}: {result['error']}")
+            summary.append(dict(result, skipped=False))
+    return pd.DataFrame(summary, columns=['probe', 'day', 'n_minutes', 'seconds', 'error', 'skipped'])
+
+def list_partitions(output_dir=DEFAULT_OUTPUT_DIR):
+    """
+    Partitions present under output_dir.
+    
+    Returns:
+        list: (probe, day) pairs in sorted order.
+    """
+    found = []
+    for path in glob.glob(os.path.join(output_dir, 'probe=*', 'day=*', 'features.frame')):
+        day_dir = os.path.dirname(path)
+        probe = os.path.basename(os.path.dirname(day_dir)).split('=', 1)[1]
+        found.append((probe, os.path.basename(day_dir).split('=', 1)[1]))
+    return sorted(found)
+
+def read_partitioned(output_dir=DEFAULT_OUTPUT_DIR, start=None, end=None, probes=None):
+    """
+    Read the features of a time range and set of probes from the partitioned tables.
+    Only partitions whose day overlaps [start, end] are opened.
+    
+    Parameters:
+        output_dir (str): Root of the partitioned feature tables.
+        start, end: Time range (inclusive); None leaves that side open.
+        probes (iterable): Spacecraft to read (default: all present).
+    
+    Returns:
+        pd.DataFrame: Features indexed by time, with a 'probe' column, sorted by probe and time.
+    """
+    first, last = _day(start), _day(end)
+    frames = []
+    for probe, day in list_partitions(output_dir):
+        if probes is not None and probe not in probes:
+            continue
+        if (first and day < first) or (last and day > last):
+            continue
+        df = read_table(partition_path(output_dir, probe, day))
+        df = df.loc[start:end] if (start is not None or end is not None) else df
+        if len(df):
+            frames.append(df.assign(probe=probe))
+    if not frames:
+        return pd.DataFrame(columns=['probe'])
+    return pd.concat(frames, axis=0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitioned (spacecraft, day) feature processing.")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    process = subparsers.add_parser('process', help="Process the partitions of a CDF archive")
+    process.add_argument('data_dir')
+    process.add_argument('--n-jobs', type=int, default=None)
+    process.add_argument('--force', action='store_true', help="Reprocess partitions that are up to date")
+    query = subparsers.add_parser('query', help="Print the features of a time range")
+    for sub in (process, query):
+        sub.add_argument('--probes', nargs='+', default=list(PROBES), choices=PROBES)
+        sub.add_argument('--start', default=None)
+        sub.add_argument('--end', default=None)
+    args = parser.parse_args()
+    
+    if args.command == 'process':
+        energy_bins = np.logspace(np.log10(10), np.log10(30000), 32)
+        summary = process_partitions(args.data_dir, energy_bins, args.output_dir, args.probes,
+                                     args.start, args.end, args.n_jobs, skip_fresh=not args.force)
+        print(summary.to_string(index=False))
+    else:
+        features_df = read_partitioned(args.output_dir, args.start, args.end, args.probes)
+        print(features_df)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+
+Dependency graph of the pipeline stages and a runner that executes it.
+
+Every stage declares its input files, output files and the source files of
+the code it runs. A stage depends on the stages that produce its inputs, and
+is skipped when it is fresh:
+  - all of its outputs exist,
+  - the oldest output is newer than the newest input, and
+  - its signature (a hash of its code, parameters and input list, stored in a
+    stamp file next to the outputs) is unchanged since the last run.
+Stages whose dependencies are satisfied run concurrently in a process pool,
+so the ingest and feature stages of different partitions (spacecraft, date
+ranges) proceed in parallel.
+
+The graph is built from a JSON config (see DEFAULT_CONFIG and pipeline.json):
+    ingest:<partition>    CDF files -> 1-minute ion spectra and B field
+    features:<partition>  resampled data -> features
+    combine               partition features -> work_dir/features.frame
+    train                 features -> GMM model
+    plot                  features + model -> cluster figure
+
+With "dtype": "float32" the spectra, B field, features and GMM fit use the
+compact float32 path (see feature_engineering.py for its tolerance). A
+"coreset_size" trains on a weighted coreset of that many draws instead of
+every minute (see models/coreset.py).
+"""
+
+import ast
+import copy
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CONFIG = {
+    'work_dir': 'data/processed',
+    'energy_bins': {'min_eV': 10, 'max_eV': 30000, 'n_channels': 32},
+    'partitions': [
+        {'name': 'mms1', 'data_dir': 'data', 'pattern': '*.cdf'}
+    ],
+    'feature_chunk_size': 100000,
+    'dtype': 'float64',
+    'coreset_size': None,
+    'coreset_resolution': None,
+    'btot_tolerance': None,
+    'btot_max_gap': None,
+    'model_path': 'models/gmm_model.pkl',
+    'gmm': {'n_components': 4, 'covariance_type': 'full', 'random_state': 42},
+    'figure_path': 'output_figures/gmm_clusters.png',
+    'stages': ['ingest', 'features', 'combine', 'train', 'plot'],
+    'n_jobs': None
+}
+
+STAMP_DIR = '.pipeline'
+
+# Source files whose contents make up the code version of each stage. The
+# repository modules they import (directly or indirectly) are added by
+# _code_files, so e.g. alignment.py counts for both ingest and features.
+STAGE_CODE = {
+    'ingest': ['scripts/read_cdf.py', 'scripts/cdf_index.py', 'scripts/catalog.py', 'scripts/storage.py'],
+    'features': ['scripts/feature_engineering.py', 'scripts/storage.py'],
+    'combine': ['scripts/pipeline.py', 'scripts/storage.py'],
+    'train': ['models/clustering.py', 'models/coreset.py', 'models/inference.py', 'scripts/storage.py'],
+    'plot': ['visualization/density.py', 'visualization/vis_v3.py', 'models/inference.py', 'scripts/storage.py']
+}
+
+# Top-level packages of the repository.
+CODE_PACKAGES = ('scripts', 'models', 'visualization')
+
+# ---------------------------------------------------------------------------
+# Stage functions (run in worker processes)
+# ---------------------------------------------------------------------------
+
+def run_ingest(data_dir, pattern, fgm_pattern, ion_path, B_path, dtype):
+    from scripts.read_cdf import load_cdf_files
+    from scripts.storage import write_table
+    ion_spec_df, B_field_df = load_cdf_files(data_dir, pattern=pattern, fgm_pattern=fgm_pattern, dtype=dtype)
+    write_table(ion_spec_df, ion_path)
+    write_table(B_field_df, B_path)
+
+def run_features(ion_path, B_path, energy_bins, output_path, chunk_size, tolerance, max_gap, dtype):
+    from scripts.feature_engineering import process_all_spectra
+    from scripts.storage import read_table
+    ion_spec_df = read_table(ion_path)
+    B_field_df = read_table(B_path)
+    process_all_spectra(ion_spec_df, B_field_df['Btot'], np.asarray(energy_bins),
+                        chunk_size=chunk_size, output_path=output_path, tolerance=tolerance, max_gap=max_gap,
+                        dtype=dtype)
+
+def run_combine(feature_paths, output_path):
+    import pandas as pd
+    from scripts.storage import read_table, write_table
+    features_df = pd.concat([read_table(path, mmap=False) for path in feature_paths], axis=0).sort_index()
+    write_table(features_df, output_path)
+
+def run_train(features_path, model_path, n_components, covariance_type, random_state, dtype, coreset_size=None,
+              coreset_resolution=None):
+    from models.clustering import save_model, train_gmm
+    from scripts.storage import read_table
+    if coreset_size:
+        from models.coreset import train_gmm_coreset
+        gmm = train_gmm_coreset(features_path, n_components, covariance_type, random_state, coreset_size,
+                                coreset_resolution, dtype=dtype)
+    else:
+        gmm = train_gmm(read_table(features_path), n_components, covariance_type, random_state, dtype)
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+    save_model(gmm, model_path)
+
+def run_plot(features_path, model_path, figure_path):
+    import joblib
+    from scripts.storage import read_table
+    from visualization.density import plot_clusters_density
+    plot_clusters_density(read_table(features_path), joblib.load(model_path), figure_path)
+
+# ---------------------------------------------------------------------------
+# Graph
+# ---------------------------------------------------------------------------
+
+class Stage:
+    """
+    One node of the pipeline graph.
+    
+    Parameters:
+        name (str): Unique stage name.
+        kind (str): Stage type, a key of STAGE_CODE.
+        func (callable): Module-level function that performs the stage.
+        kwargs (dict): JSON-serializable keyword arguments of func.
+        inputs (list): Files or table directories read by the stage.
+        outputs (list): Files or table directories written by the stage.
+    """
+    
+    def __init__(self, name, kind, func, kwargs, inputs, outputs):
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.kwargs = kwargs
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = set()
+
+def _resolve(path):
+    return path if os.path.isabs(path) else os.path.join(REPO_DIR, path)
+
+def load_config(path=None, overrides=None):
+    """
+    Read a JSON pipeline config and fill in the defaults of DEFAULT_CONFIG.
+    Relative paths are taken relative to the repository root.
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    config.update(overrides or {})
+    return config
+
+def build_graph(config):
+    """
+    Build the stages selected by config['stages'] and link each stage to the
+    stages that produce its inputs.
+    
+    Returns:
+        dict: Stage name -> Stage, in declaration order.
+    """
+    work_dir = _resolve(config['work_dir'])
+    bins = config['energy_bins']
+    energy_bins = np.logspace(np.log10(bins['min_eV']), np.log10(bins['max_eV']), bins['n_channels']).tolist()
+    features_path = os.path.join(work_dir, 'features.frame')
+    model_path = _resolve(config['model_path'])
+    figure_path = _resolve(config['figure_path'])
+    
+    stages = []
+    partition_features = []
+    for partition in config['partitions']:
+        name = partition['name']
+        data_dir = _resolve(partition['data_dir'])
+        pattern = partition.get('pattern', '*.cdf')
+        fgm_pattern = partition.get('fgm_pattern')
+        out_dir = _resolve(partition['output_dir']) if 'output_dir' in partition else os.path.join(work_dir, name)
+        ion_path = os.path.join(out_dir, 'ion_spec.frame')
+        B_path = os.path.join(out_dir, 'B_field.frame')
+        part_features = os.path.join(out_dir, 'features.frame')
+        partition_features.append(part_features)
+        stages.append(Stage(
+            f'ingest:{name}', 'ingest', run_ingest,
+            {'data_dir': data_dir, 'pattern': pattern, 'fgm_pattern': fgm_pattern,
+             'ion_path': ion_path, 'B_path': B_path, 'dtype': config['dtype']},
+            sorted(set(glob.glob(os.path.join(data_dir, pattern)))
+                   | set(glob.glob(os.path.join(data_dir, fgm_pattern)) if fgm_pattern else [])),
+            [ion_path, B_path]
+        ))
+        stages.append(Stage(
+            f'features:{name}', 'features', run_features,
+            {'ion_path': ion_path, 'B_path': B_path, 'energy_bins': energy_bins,
+             'output_path': part_features, 'chunk_size': config['feature_chunk_size'],
+             'tolerance': config['btot_tolerance'], 'max_gap': config['btot_max_gap'], 'dtype': config['dtype']},
+            [ion_path, B_path], [part_features]
+        ))
+    stages.append(Stage(
+        'combine', 'combine', run_combine,
+        {'feature_paths': partition_features, 'output_path': features_path},
+        partition_features, [features_path]
+    ))
+    stages.append(Stage(
+        'train', 'train', run_train,
+        dict(config['gmm'], features_path=features_path, model_path=model_path, dtype=config['dtype'],
+             coreset_size=config['coreset_size'], coreset_resolution=config['coreset_resolution']),
+        [features_path], [model_path]
+    ))
+    stages.append(Stage(
+        'plot', 'plot', run_plot,
+        {'features_path': features_path, 'model_path': model_path, 'figure_path': figure_path},
+        [features_path, model_path], [figure_path]
+    ))
+    
+    graph = {stage.name: stage for stage in stages if stage.kind in config['stages']}
+    producers = {output: stage.name for stage in graph.values() for output in stage.outputs}
+    for stage in graph.values():
+        stage.deps = {producers[path] for path in stage.inputs if path in producers}
+    return graph
+
+# ---------------------------------------------------------------------------
+# Freshness
+# ---------------------------------------------------------------------------
+
+_code_hashes = {}
+
+def _code_hash(relative_path):
+    if relative_path not in _code_hashes:
+        with open(os.path.join(REPO_DIR, relative_path), 'rb') as f:
+            _code_hashes[relative_path] = hashlib.sha256(f.read()).hexdigest()
+    return _code_hashes[relative_path]
+
+def _imported_files(relative_path):
+    """
+    Repository source files imported anywhere in a source file (including imports inside functions).
+    """
+    with open(os.path.join(REPO_DIR, relative_path)) as f:
+        tree = ast.parse(f.read())
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.add(node.module)
+        elif isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+    paths = (module.replace('.', '/') + '.py' for module in modules if module.split('.')[0] in CODE_PACKAGES)
+    return [path for path in paths if os.path.exists(os.path.join(REPO_DIR, path))]
+
+_code_files_cache = {}
+
+def _code_files(kind):
+    """
+    STAGE_CODE[kind] plus every repository module it imports, transitively, sorted.
+    """
+    if kind not in _code_files_cache:
+        files, pending = set(), list(STAGE_CODE[kind])
+        while pending:
+            path = pending.pop()
+            if path not in files:
+                files.add(path)
+                # The stage functions here import the modules of every stage; those count for their own stage.
+                if path != 'scripts/pipeline.py':
+                    pending.extend(_imported_files(path))
+        _code_files_cache[kind] = sorted(files)
+    return _code_files_cache[kind]
+
+def _mtime(path):
+    """
+    Modification time of a file, or the newest file inside a table directory.
+    """
+    if os.path.isdir(path):
+        times = [os.path.getmtime(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files]
+        return max(times, default=os.path.getmtime(path))
+    return os.path.getmtime(path)
+
+def _oldest_mtime(path):
+    if os.path.isdir(path):
+        times = [os.path.getmtime(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files]
+        return min(times, default=os.path.getmtime(path))
+    return os.path.getmtime(path)
+
+def signature(stage):
+    """
+    Hash of everything besides input timestamps that determines the stage outputs.
+    """
+    description = {
+        'code': {path: _code_hash(path) for path in _code_files(stage.kind)},
+        'kwargs': stage.kwargs,
+        'inputs': stage.inputs
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def _stamp_path(stage):
+    directory = os.path.join(os.path.dirname(stage.outputs[0]), STAMP_DIR)
+    return os.path.join(directory, stage.name.replace(':', '_') + '.json')
+
+def is_fresh(stage):
+    """
+    Whether the outputs of a stage are up to date with its inputs and code.
+    """
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return False
+    if any(not os.path.exists(path) for path in stage.inputs):
+        return False
+    try:
+        with open(_stamp_path(stage)) as f:
+            if json.load(f)['signature'] != signature(stage):
+                return False
+    except (OSError, ValueError, KeyError):
+        return False
+    if not stage.inputs:
+        return True
+    return min(_oldest_mtime(path) for path in stage.outputs) >= max(_mtime(path) for path in stage.inputs)
+
+def _write_stamp(stage, seconds):
+    path = _stamp_path(stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'signature': signature(stage), 'seconds': seconds, 'finished': time.time()}, f)
+
+def _timed_call(func, kwargs):
+    start = time.perf_counter()
+    func(**kwargs)
+    return time.perf_counter() - start
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def run_pipeline(config, force=False, dry_run=False, n_jobs=None):
+    """
+    Run every stage of the graph that is not fresh, in dependency order, with
+    independent stages running concurrently.
+    
+    A stage that is not fresh also reruns everything downstream of it. When a
+    stage fails, its dependents are not run; independent stages continue.
+    
+    Parameters:
+        config (dict): Pipeline config (see load_config).
+        force (bool): Run all stages, fresh or not.
+        dry_run (bool): Only report which stages would run.
+        n_jobs (int): Number of worker processes (default: config['n_jobs'], None uses all CPUs).
+    
+    Returns:
+        dict: Stage name -> {'status': 'ran'|'fresh'|'failed'|'blocked'|'pending', 'seconds', 'error'}
+    """
+    graph = build_graph(config)
+    n_jobs = n_jobs if n_jobs is not None else config.get('n_jobs')
+    results = {name: {'status': 'pending', 'seconds': 0.0, 'error': None} for name in graph}
+    
+    # Decide up front which stages must run; anything downstream of them runs as well.
+    stale = set()
+    for name, stage in graph.items():
+        if force or stage.deps & stale or not is_fresh(stage):
+            stale.add(name)
+        else:
+            results[name]['status'] = 'fresh'
+    
+    if dry_run:
+        for name in graph:
+            print(f"{name:<24}{'run' if name in stale else 'fresh'}")
+        return results
+    
+    done = {name for name in graph if name not in stale}
+    remaining = [name for name in graph if name in stale]
+    running = {}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        while remaining or running:
+            for name in list(remaining):
+                stage = graph[name]
+                if any(results[dep]['status'] in ('failed', 'blocked') for dep in stage.deps):
+                    results[name]['status'] = 'blocked'
+                    remaining.remove(name)
+                elif stage.deps <= done:
+                    print(f"Running {name}")
+                    running[executor.submit(_timed_call, stage.func, stage.kwargs)] = name
+                    remaining.remove(name)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    results[name].update(status='failed', error=f"{type(e).__name__}: {e}")
+                    print(f"Failed {name}: {results[name]['error']}")
+                    continue
+                _write_stamp(graph[name], seconds)
+                results[name].update(status='ran', seconds=seconds)
+                done.add(name)
+                print(f"Finished {name} in {seconds:.2f} s")
+    return results
@@ -3,87 +3,473 @@ import numpy as np
 import pandas as pd
 import glob
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from scripts.alignment import BinnedMean, merge_binned
+from scripts.instrumentation import instrumented, stage
+from scripts.storage import write_table
 
-def load_cdf_files(data_dir):
+# CDF variable names; {probe} is the spacecraft (mms1 ... mms4), {rate} the FGM data rate.
+ION_SPEC_VAR = '{probe}_dis_energyspectr_px_fast'
+B_FIELD_VAR = '{probe}_fgm_b_gse_{rate}_l2'
+
+PROBES = ('mms1', 'mms2', 'mms3', 'mms4')
+
+def probe_from_filename(cdf_file, default='mms1'):
+    """
+    Spacecraft of an MMS CDF file, taken from its file name (e.g. 'mms2_fpi_fast_l2_...' -> 'mms2').
+    """
+    prefix = os.path.basename(cdf_file)[:4].lower()
+    return prefix if prefix in PROBES else default
+
+@instrumented('cdf.read')
+def read_cdf_file(cdf_file, probe=None):
+    """
+    Read the ion spectrogram and magnetic field data of a single CDF file.
+    
+    Parameters:
+        cdf_file (str): Path to the CDF file
+        probe (str): Spacecraft whose variables are read (default: from the file name)
+        
+    Returns:
+        tuple: (ion_df, B_df) - DataFrames at the native cadence, indexed by epoch
+    """
+    probe = probe or probe_from_filename(cdf_file)
+    
+    # Open the CDF file
+    with pycdf.CDF(cdf_file) as cdf:
+        # Extract the epoch and ion spectrogram data
+        epoch = cdf['Epoch'][:]
+        ion_spec = cdf[ION_SPEC_VAR.format(probe=probe)][:]
+        
+        # Extract magnetic field data on its own time variable
+        B_var = B_FIELD_VAR.format(probe=probe, rate='brst')  # Adjust variable name if needed
+        B_field = cdf[B_var][:]
+        B_epoch = cdf[_epoch_var(cdf, B_var)][:]
+    
+    # Create DataFrames for this file
+    ion_df = pd.DataFrame(ion_spec, index=pd.to_datetime(epoch))
+    
+    # For B field, calculate the magnitude (Btot)
+    Btot = np.sqrt(np.sum(B_field[:, :3]**2, axis=1))  # Using only x,y,z components
+    B_df = pd.DataFrame({'Btot': Btot}, index=pd.to_datetime(B_epoch))
+    
+    return ion_df, B_df
+
+@instrumented('cdf.read')
+def read_ion_spec_file(cdf_file, probe=None):
+    """
+    Read only the ion spectrogram of an FPI CDF file.
+    
+    Returns:
+        pd.DataFrame: Ion spectra at the native cadence, indexed by epoch
+    """
+    probe = probe or probe_from_filename(cdf_file)
+    with pycdf.CDF(cdf_file) as cdf:
+        epoch = cdf['Epoch'][:]
+        ion_spec = cdf[ION_SPEC_VAR.format(probe=probe)][:]
+    return pd.DataFrame(ion_spec, index=pd.to_datetime(epoch))
+
+def _B_var(cdf_file, probe):
+    rate = 'srvy' if '_srvy_' in os.path.basename(cdf_file) else 'brst'
+    return B_FIELD_VAR.format(probe=probe, rate=rate)
+
+def _epoch_var(cdf, variable):
+    """
+    Name of the time variable a CDF variable depends on (its DEPEND_0 attribute).
+    """
+    epoch = cdf[variable].attrs.get('DEPEND_0', 'Epoch')
+    return epoch if epoch in cdf else 'Epoch'
+
+@instrumented('cdf.read')
+def read_B_field_file(cdf_file, probe=None):
+    """
+    Read the magnetic field of an FGM CDF file on the file's own epoch.
+    The data rate (brst or srvy) is taken from the file name.
+    
+    Returns:
+        pd.DataFrame: 'Btot' at the native FGM cadence, indexed by epoch
+    """
+    probe = probe or probe_from_filename(cdf_file)
+    B_var = _B_var(cdf_file, probe)
+    with pycdf.CDF(cdf_file) as cdf:
+        epoch = cdf[_epoch_var(cdf, B_var)][:]
+        B_field = cdf[B_var][:]
+    Btot = np.sqrt(np.sum(B_field[:, :3]**2, axis=1))
+    return pd.DataFrame({'Btot': Btot}, index=pd.to_datetime(epoch))
+
+def _epoch_block(cdf, epoch_var, start, stop):
+    """
+    Records start:stop of a time variable as datetime64[ns].
+    
+    TT2000 epochs are converted without creating datetime objects: within a
+    block that contains no leap second, UTC is the raw TT2000 value minus a
+    constant offset, which is determined from the first record.
+    """
+    variable = cdf[epoch_var]
+    if variable.type() == pycdf.const.CDF_TIME_TT2000.value:
+        raw = cdf.raw_var(epoch_var)[start:stop].astype(np.int64)
+        if len(raw) == 0:
+            return raw.astype('datetime64[ns]')
+        first = pycdf.lib.tt2000_to_datetime(int(raw[0]))
+        offset = pycdf.lib.datetime_to_tt2000(first) - pd.Timestamp(first).value
+        last = pycdf.lib.tt2000_to_datetime(int(raw[-1]))
+        if pycdf.lib.datetime_to_tt2000(last) - pd.Timestamp(last).value == offset:
+            return (raw - offset).astype('datetime64[ns]')
+    # Other epoch types, or a leap second inside the block.
+    return pd.to_datetime(variable[start:stop]).values.astype('datetime64[ns]')
+
+@instrumented('cdf.read_binned')
+def read_B_field_binned(cdf_file, probe=None, freq='1Min', block_records=1000000):
+    """
+    Decimate the magnetic field of a CDF file to per-bin means while streaming it,
+    reading block_records records at a time, so high-rate burst data is never
+    held in memory at full resolution.
+    
+    Parameters:
+        cdf_file (str): FGM (or combined) CDF file.
+        probe (str): Spacecraft whose variables are read (default: from the file name).
+        freq (str): Bin width (default '1Min').
+        block_records (int): Records read per block.
+    
+    Returns:
+        pd.DataFrame: 'Btot' mean and record 'count' per bin, indexed by bin start
+    """
+    probe = probe or probe_from_filename(cdf_file)
+    B_var = _B_var(cdf_file, probe)
+    binned = BinnedMean(freq)
+    with pycdf.CDF(cdf_file) as cdf:
+        epoch_var = _epoch_var(cdf, B_var)
+        n_records = len(cdf[B_var])
+        for start in range(0, n_records, block_records):
+            stop = min(start + block_records, n_records)
+            B_field = cdf[B_var][start:stop]
+            Btot = np.sqrt(np.sum(B_field[:, :3]**2, axis=1))
+            binned.add(_epoch_block(cdf, epoch_var, start, stop), Btot)
+    return binned.result().rename(columns={'mean': 'Btot'})
+
+def load_B_field_binned(cdf_files, freq='1Min', block_records=1000000):
+    """
+    Decimate the magnetic field of several FGM files to one Btot series per bin
+    (see read_B_field_binned). Bins covered by more than one file are combined
+    with record-count weights.
+    
+    Returns:
+        pd.DataFrame: 'Btot' on a contiguous grid of bins (NaN where there is no data),
+                      like resample(freq).mean() of the full-rate data
+    """
+    frames = []
+    for cdf_file in cdf_files:
+        try:
+            frames.append(read_B_field_binned(cdf_file, freq=freq, block_records=block_records))
+            print(f"Loaded: {os.path.basename(cdf_file)}")
+        except Exception as e:
+            print(f"Error loading {cdf_file}: {type(e).__name__}: {e}")
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        raise ValueError("No valid FGM files were loaded")
+    merged = merge_binned(frames, 'Btot')
+    grid = pd.date_range(merged.index[0], merged.index[-1], freq=freq)
+    return merged[['Btot']].reindex(grid)
+
+def _timed_read(cdf_file, ion_only=False):
+    """
+    Read a CDF file, capturing the elapsed time and any error instead of raising.
+    With ion_only set only the ion spectrogram is read and 'B_df' is None.
+    
+    Returns:
+        dict: 'file', 'ion_df', 'B_df', 'load_seconds', 'n_records' and 'error' (None on success)
+    """
+    start = time.perf_counter()
+    try:
+        if ion_only:
+            ion_df, B_df = read_ion_spec_file(cdf_file), None
+        else:
+            ion_df, B_df = read_cdf_file(cdf_file)
+        error = None
+    except Exception as e:
+        ion_df, B_df = None, None
+        error = f"{type(e).__name__}: {e}"
+    return {
+        'file': cdf_file,
+        'ion_df': ion_df,
+        'B_df': B_df,
+        'load_seconds': time.perf_counter() - start,
+        'n_records': 0 if ion_df is None else len(ion_df),
+        'error': error
+    }
+
+def iter_cdf_files(cdf_files, n_workers=1, prefetch=None, executor='thread', ion_only=False):
+    """
+    Read CDF files and yield the results in the given order.
+    
+    With n_workers > 1 the files are decoded concurrently in a thread or process
+    pool. At most `prefetch` files are read ahead of the consumer, which bounds
+    the memory held by decoded but not yet consumed files.
+    
+    Parameters:
+        cdf_files (list): Paths of the CDF files, in the order they should be yielded
+        n_workers (int): Number of concurrent readers (default 1 reads serially)
+        prefetch (int): Maximum number of files in flight (default 2 * n_workers)
+        executor (str): 'thread' or 'process'
+        ion_only (bool): Read only the ion spectrograms (B field from separate FGM files)
+        
+    Yields:
+        dict: Per-file result as returned by _timed_read
+    """
+    if n_workers <= 1:
+        for cdf_file in cdf_files:
+            yield _timed_read(cdf_file, ion_only)
+        return
+    
+    if executor not in ('thread', 'process'):
+        raise ValueError(f"Unknown executor '{executor}', expected 'thread' or 'process'")
+    pool_class = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+    prefetch = max(prefetch or 2 * n_workers, 1)
+    
+    with pool_class(max_workers=n_workers) as pool:
+        pending = deque()
+        files = iter(cdf_files)
+        for cdf_file in files:
+            pending.append(pool.submit(_timed_read, cdf_file, ion_only))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for cdf_file in files:
+                pending.append(pool.submit(_timed_read, cdf_file, ion_only))
+                break
+            yield result
+
+def _log_result(result, report):
+    """
+    Print the outcome of a file read and append its summary to the load report.
+    """
+    if result['error'] is None:
+        print(f"Loaded: {os.path.basename(result['file'])}")
+    else:
+        print(f"Error loading {result['file']}: {result['error']}")
+    report.append({key: result[key] for key in ('file', 'load_seconds', 'n_records', 'error')})
+
+def load_cdf_files(data_dir, n_workers=1, prefetch=None, executor='thread', return_report=False, pattern='*.cdf',
+                   fgm_pattern=None, catalog=None, start=None, end=None, dtype=None):
     """
     Load and concatenate multiple CDF files from a directory. Still missing to download cdfs
     containig the B field data. Possibly FGM (Fluxgate Magnetometer) data.
     
     Parameters:
         data_dir (str): Path to directory containing CDF files
+        n_workers (int): Number of files decoded concurrently (default 1)
+        prefetch (int): Maximum number of files read ahead (default 2 * n_workers)
+        executor (str): 'thread' or 'process' pool for n_workers > 1
+        return_report (bool): Also return the per-file load report
+        pattern (str): Glob pattern selecting the files of data_dir (default '*.cdf')
+        fgm_pattern (str): Glob pattern of separate FGM files. If given, the B field is read from
+                           these files on their own epoch and decimated while streaming
+                           (see load_B_field_binned); otherwise it is read from the matched files.
+        catalog (Catalog): Select the files from this catalog (see catalog.py) instead of globbing data_dir
+        start, end: With a catalog, only load the files whose records overlap [start, end)
+        dtype: Cast the resampled spectra and Btot to this type (e.g. float32 for the compact
+               path, see feature_engineering.COMPACT_DTYPE); default: keep the loaded types
         
     Returns:
-        tuple: (ion_spec_df, B_field_df) - Resampled DataFrames for ion spectrogram and magnetic field
+        tuple: (ion_spec_df, B_field_df) - Resampled DataFrames for ion spectrogram and magnetic field,
+               followed by a report DataFrame (file, load_seconds, n_records, error) if return_report is set
     """
     # Get list of all CDF files in directory
-    cdf_files = glob.glob(os.path.join(data_dir, '*.cdf'))
+    if catalog is not None:
+        fgm_files = catalog.files(start, end, directory=data_dir, pattern=fgm_pattern) if fgm_pattern else []
+        cdf_files = sorted(set(catalog.files(start, end, directory=data_dir, pattern=pattern)) - set(fgm_files))
+    else:
+        fgm_files = sorted(glob.glob(os.path.join(data_dir, fgm_pattern))) if fgm_pattern else []
+        cdf_files = sorted(set(glob.glob(os.path.join(data_dir, pattern))) - set(fgm_files))
     
     # Lists to store DataFrames from each file
     ion_spec_list = []
     B_field_list = []
+    report = []
     
-    for cdf_file in sorted(cdf_files):
-        try:
-            # Open the CDF file
-            with pycdf.CDF(cdf_file) as cdf:
-                # Extract the epoch and ion spectrogram data
-                epoch = cdf['Epoch'][:]
-                ion_spec = cdf['mms1_dis_energyspectr_px_fast'][:]
-                
-                # Extract magnetic field data
-                B_field = cdf['mms1_fgm_b_gse_brst_l2'][:]  # Adjust variable name if needed
-                
-                # Create DataFrames for this file
-                ion_df = pd.DataFrame(ion_spec, index=pd.to_datetime(epoch))
-                
-                # For B field, calculate the magnitude (Btot)
-                Btot = np.sqrt(np.sum(B_field[:, :3]**2, axis=1))  # Using only x,y,z components
-                B_df = pd.DataFrame({'Btot': Btot}, index=pd.to_datetime(epoch))
-                
-                ion_spec_list.append(ion_df)
-                B_field_list.append(B_df)
-                
-                print(f"Loaded: {os.path.basename(cdf_file)}")
-                
-        except Exception as e:
-            print(f"Error loading {cdf_file}: {str(e)}")
+    for result in iter_cdf_files(cdf_files, n_workers, prefetch, executor, ion_only=bool(fgm_files)):
+        _log_result(result, report)
+        if result['error'] is None:
+            ion_spec_list.append(result['ion_df'])
+            if result['B_df'] is not None:
+                B_field_list.append(result['B_df'])
     
     # Concatenate all DataFrames
-    if ion_spec_list and B_field_list:
+    if ion_spec_list and (B_field_list or fgm_files):
         # Combine ion spectrogram data
         ion_spec_df = pd.concat(ion_spec_list, axis=0)
         ion_spec_df = ion_spec_df.sort_index()
         ion_spec_df = ion_spec_df[~ion_spec_df.index.duplicated(keep='first')]
         
-        # Combine B field data
-        B_field_df = pd.concat(B_field_list, axis=0)
-        B_field_df = B_field_df.sort_index()
-        B_field_df = B_field_df[~B_field_df.index.duplicated(keep='first')]
-        
         # Resample both to 1-minute intervals
-        ion_spec_resampled = ion_spec_df.resample('1Min').mean()
-        B_field_resampled = B_field_df.resample('1Min').mean()
+        with stage('cdf.resample'):
+            ion_spec_resampled = ion_spec_df.resample('1Min').mean()
+        if fgm_files:
+            B_field_resampled = load_B_field_binned(fgm_files)
+        else:
+            # Combine B field data
+            B_field_df = pd.concat(B_field_list, axis=0)
+            B_field_df = B_field_df.sort_index()
+            B_field_df = B_field_df[~B_field_df.index.duplicated(keep='first')]
+            with stage('cdf.resample'):
+                B_field_resampled = B_field_df.resample('1Min').mean()
+        
+        if dtype is not None:
+            ion_spec_resampled = ion_spec_resampled.astype(dtype, copy=False)
+            B_field_resampled = B_field_resampled.astype(dtype, copy=False)
         
         print("\nFinal Dataset:")
         print(f"Time range: {ion_spec_resampled.index[0]} to {ion_spec_resampled.index[-1]}")
         print(f"Total samples: {len(ion_spec_resampled)}")
         
+        if return_report:
+            return ion_spec_resampled, B_field_resampled, pd.DataFrame(report)
         return ion_spec_resampled, B_field_resampled
+    elif report and all(r['error'] and B_FIELD_VAR.format(probe=probe_from_filename(r['file']), rate='brst')
+                        in r['error'] for r in report):
+        # FPI moments files (such as the bundled ones) do not carry the FGM B field.
+        raise ValueError(f"No valid CDF files were loaded: the files of {data_dir} have no B field. "
+                         f"Add the FGM files and select them with fgm_pattern (e.g. 'mms1_fgm_*.cdf')")
     else:
         raise ValueError("No valid CDF files were loaded")
 
+class MinuteResampler:
+    """
+    Incremental 1-minute resampler for time-ordered chunks of a time series.
+    
+    Records are buffered until their minute is closed, so minutes that span a
+    file boundary are averaged over the records of both files. Records that
+    repeat an index already buffered, or that fall into a minute that has already
+    been emitted, are dropped as overlapping duplicates. The concatenation of all
+    emitted chunks equals a single resample('1Min').mean() of the de-duplicated data,
+    including the all-NaN rows of empty minutes.
+    """
+    
+    def __init__(self, freq='1Min'):
+        self.freq = freq
+        self.buffer = None
+        self.next_bin = None  # Start of the first minute that has not been emitted.
+    
+    def push(self, df):
+        """
+        Add a chunk of native-cadence records.
+        """
+        df = df[~df.index.duplicated(keep='first')]
+        if self.next_bin is not None:
+            df = df[df.index >= self.next_bin]
+        if self.buffer is not None:
+            df = pd.concat([self.buffer, df], axis=0)
+            df = df[~df.index.duplicated(keep='first')]
+        self.buffer = df.sort_index()
+    
+    def open_bin(self):
+        """
+        Start of the latest minute in the buffer (the one that may still receive records),
+        or None if the buffer is empty.
+        """
+        if self.buffer is None or len(self.buffer) == 0:
+            return None
+        return self.buffer.index[-1].floor(self.freq)
+    
+    @instrumented('cdf.resample')
+    def pop(self, until):
+        """
+        Emit the 1-minute means of all minutes that start before `until`.
+        
+        Returns:
+            pd.DataFrame: Resampled minutes, possibly empty.
+        """
+        closed = self.buffer[self.buffer.index < until]
+        self.buffer = self.buffer[self.buffer.index >= until]
+        
+        start = self.next_bin
+        if start is None:
+            if len(closed) == 0:
+                return closed
+            start = closed.index[0].floor(self.freq)
+        bins = pd.date_range(start, until, freq=self.freq, inclusive='left')
+        resampled = closed.resample(self.freq).mean().reindex(bins)
+        self.next_bin = until
+        return resampled
+    
+    def flush(self):
+        """
+        Emit all remaining minutes, including the last partially filled one.
+        """
+        open_bin = self.open_bin()
+        if open_bin is None:
+            return self.buffer if self.buffer is not None else pd.DataFrame()
+        return self.pop(open_bin + pd.Timedelta(self.freq))
+
+def stream_cdf_files(data_dir, n_workers=1, prefetch=None, executor='thread', report=None):
+    """
+    Stream the CDF files of a directory as 1-minute resampled chunks with bounded memory.
+    
+    Files are opened one at a time in time (file name) order. Each file is resampled
+    as it is read; the last, possibly incomplete minute is carried over to the next
+    file, so the concatenated output matches load_cdf_files.
+    
+    Parameters:
+        data_dir (str): Path to directory containing CDF files
+        n_workers (int): Number of files decoded concurrently (default 1)
+        prefetch (int): Maximum number of files read ahead (default 2 * n_workers)
+        executor (str): 'thread' or 'process' pool for n_workers > 1
+        report (list): Optional list that receives one dict per file
+                       (file, load_seconds, n_records, error)
+        
+    Yields:
+        tuple: (ion_spec_chunk, B_field_chunk) - Resampled DataFrames covering the same minutes
+    """
+    cdf_files = sorted(glob.glob(os.path.join(data_dir, '*.cdf')))
+    ion_resampler = MinuteResampler()
+    B_resampler = MinuteResampler()
+    loaded = 0
+    
+    report = [] if report is None else report
+    
+    for result in iter_cdf_files(cdf_files, n_workers, prefetch, executor):
+        _log_result(result, report)
+        if result['error'] is not None:
+            continue
+        loaded += 1
+        
+        ion_resampler.push(result['ion_df'])
+        B_resampler.push(result['B_df'])
+        
+        # Close every minute before the earliest open minute of both instruments.
+        open_bins = [ion_resampler.open_bin(), B_resampler.open_bin()]
+        if None in open_bins:
+            continue
+        until = min(open_bins)
+        ion_chunk, B_chunk = ion_resampler.pop(until), B_resampler.pop(until)
+        if len(ion_chunk) or len(B_chunk):
+            yield ion_chunk, B_chunk
+    
+    if not loaded:
+        raise ValueError("No valid CDF files were loaded")
+    
+    ion_chunk, B_chunk = ion_resampler.flush(), B_resampler.flush()
+    if len(ion_chunk) or len(B_chunk):
+        yield ion_chunk, B_chunk
+
 if __name__ == "__main__":
-    # Specify your data directory
-    data_dir = '/Users/nathan/CursorProjects/gaussian_mixed_model_mms/data'
+    import sys
+    # Data directory and, optionally, the glob pattern of its FGM files
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    fgm_pattern = sys.argv[2] if len(sys.argv) > 2 else None
     
     # Load and process all CDF files
-    ion_spec_df, B_field_df = load_cdf_files(data_dir)
+    ion_spec_df, B_field_df = load_cdf_files(data_dir, fgm_pattern=fgm_pattern,
+                                             pattern='*_fpi_*.cdf' if fgm_pattern else '*.cdf')
     
     # Save the concatenated and resampled data
     output_dir = 'data/processed'
     os.makedirs(output_dir, exist_ok=True)
     
-    ion_spec_df.to_csv(os.path.join(output_dir, 'concatenated_ion_spec.csv'))
-    B_field_df.to_csv(os.path.join(output_dir, 'concatenated_B_field.csv'))
+    write_table(ion_spec_df, os.path.join(output_dir, 'concatenated_ion_spec.frame'))
+    write_table(B_field_df, os.path.join(output_dir, 'concatenated_B_field.frame'))
     
     print(f"\nSaved concatenated data to: {output_dir}")
\ No newline at end of file
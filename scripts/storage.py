@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+storage.py
+
+Binary storage for the intermediate products of the pipeline (resampled ion
+spectra, B field and features), replacing CSV round-trips between stages.
+
+A table is stored as a directory (by convention with a '.frame' suffix) that
+holds the index and the values of a homogeneous numeric DataFrame as NumPy
+.npy files, plus a small JSON file with the column names:
+
+    features.frame/
+        meta.json
+        part-00000.index.npy    (datetime64[ns] timestamps)
+        part-00000.values.npy   (2D array, one column per DataFrame column)
+
+append_table adds rows as further parts (part-00001, ...) without rewriting
+the existing ones. The .npy files are memory-mapped on load, so reading a table does not parse
+or copy anything until the data is used. Paths ending in '.csv' are read and
+written as CSV, which remains available as an export format.
+"""
+
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import pandas as pd
+from scripts.instrumentation import instrumented
+
+META_FILE = 'meta.json'
+
+def _is_csv(path):
+    return str(path).lower().endswith('.csv')
+
+def _part_files(path, part):
+    return (os.path.join(path, f'{part}.index.npy'), os.path.join(path, f'{part}.values.npy'))
+
+def _read_meta(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+def _write_part(df, path, part):
+    """
+    Write the index and values of a DataFrame as one part of a table.
+    """
+    index_file, values_file = _part_files(path, part)
+    index = df.index
+    if isinstance(index, pd.DatetimeIndex):
+        index = index.tz_localize(None) if index.tz is not None else index
+        index_values = index.values.astype('datetime64[ns]')
+    else:
+        index_values = np.asarray(index)
+    np.save(index_file, index_values)
+    np.save(values_file, np.ascontiguousarray(df.to_numpy()))
+
+@instrumented('io.write_table')
+def write_table(df, path):
+    """
+    Write a DataFrame to a binary table directory, or to CSV if the path ends in '.csv'.
+    An existing table at the same path is replaced.
+    
+    Parameters:
+        df (pd.DataFrame): DataFrame with numeric columns of a single dtype.
+        path (str): Destination table directory or CSV file.
+    """
+    if _is_csv(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        df.to_csv(path)
+        return
+    
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    meta = {
+        'columns': [c if isinstance(c, (int, str)) else str(c) for c in df.columns],
+        'index_name': df.index.name,
+        'parts': ['part-00000']
+    }
+    _write_part(df, path, 'part-00000')
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+@instrumented('io.append_table')
+def append_table(df, path):
+    """
+    Append the rows of a DataFrame to a binary table as a new part, creating the
+    table if it does not exist. Existing parts are not rewritten.
+    
+    Parameters:
+        df (pd.DataFrame): Rows to append, with the same columns as the table.
+        path (str): Table directory.
+    """
+    if not os.path.isdir(path):
+        write_table(df, path)
+        return
+    
+    meta = _read_meta(path)
+    columns = [c if isinstance(c, (int, str)) else str(c) for c in df.columns]
+    if columns != meta['columns']:
+        raise ValueError(f"Cannot append columns {columns} to table with columns {meta['columns']}")
+    
+    part = f"part-{len(meta['parts']):05d}"
+    _write_part(df, path, part)
+    meta['parts'].append(part)
+    
+    # Replace the metadata atomically so readers never see a part list with missing files.
+    staging = os.path.join(path, META_FILE + '.tmp')
+    with open(staging, 'w') as f:
+        json.dump(meta, f)
+    os.replace(staging, os.path.join(path, META_FILE))
+
+def _read_part(path, part, meta, mmap):
+    index_file, values_file = _part_files(path, part)
+    mmap_mode = 'r' if mmap else None
+    index_values = np.load(index_file, mmap_mode=mmap_mode)
+    values = np.load(values_file, mmap_mode=mmap_mode)
+    if np.issubdtype(index_values.dtype, np.datetime64):
+        index = pd.DatetimeIndex(index_values, name=meta['index_name'])
+    else:
+        index = pd.Index(index_values, name=meta['index_name'])
+    return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+@instrumented('io.read_table')
+def read_table(path, mmap=True):
+    """
+    Read a table written by write_table (or a CSV file).
+    
+    Parameters:
+        path (str): Table directory or CSV file.
+        mmap (bool): Memory-map the stored arrays instead of reading them into memory.
+                     A single-part table is then returned without copying the values.
+    
+    Returns:
+        pd.DataFrame: The stored DataFrame (read-only when memory-mapped).
+    """
+    if _is_csv(path):
+        return pd.read_csv(path, index_col=0, parse_dates=True)
+    
+    meta = _read_meta(path)
+    frames = [_read_part(path, part, meta, mmap) for part in meta['parts']]
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, axis=0)
+
+def last_index(path):
+    """
+    Last index value of a binary table (its newest appended row), or None if the
+    table does not exist or is empty. Only the index file of the last non-empty
+    part is read.
+    """
+    if not os.path.isdir(path):
+        return None
+    meta = _read_meta(path)
+    for part in reversed(meta['parts']):
+        index_values = np.load(_part_files(path, part)[0], mmap_mode='r')
+        if len(index_values):
+            value = index_values[-1]
+            return pd.Timestamp(value) if np.issubdtype(index_values.dtype, np.datetime64) else value
+    return None
+
+def iter_table(path, chunk_size=100000):
+    """
+    Iterate over a table in chunks of at most chunk_size rows without loading it
+    as a whole. Chunks are views of the memory-mapped parts (or slices of a CSV).
+    
+    Parameters:
+        path (str): Table directory or CSV file.
+        chunk_size (int): Maximum number of rows per chunk.
+    
+    Yields:
+        pd.DataFrame: Consecutive chunks of the table.
+    """
+    if _is_csv(path):
+        yield from pd.read_csv(path, index_col=0, parse_dates=True, chunksize=chunk_size)
+        return
+    
+    meta = _read_meta(path)
+    for part in meta['parts']:
+        df = _read_part(path, part, meta, mmap=True)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+if __name__ == "__main__":
+    # Usage: python -m scripts.storage <table or csv> <destination table or csv>
+    if len(sys.argv) != 3:
+        print("Usage: python -m scripts.storage SOURCE DESTINATION")
+        sys.exit(1)
+    write_table(read_table(sys.argv[1]), sys.argv[2])
+    print(f"Converted {sys.argv[1]} to: {sys.argv[2]}")
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+density.py
+
+Cluster plots that scale to millions of feature minutes.
+
+vis_v1/vis_v2/vis_v3 draw one marker per minute, which takes minutes and a
+lot of memory for a full mission. Here the points are never drawn one by
+one:
+
+- density mode bins every pair of features into a 2D histogram per cluster
+  (a single np.bincount over all rows) and renders it as one image: the hue
+  of a pixel is its dominant cluster and the opacity its log point count.
+- sample mode draws a stratified subsample with a fixed number of points,
+  where every cluster keeps a minimum share so small clusters stay visible.
+
+Cluster labels are taken from the stored labels table (written by
+`main.py predict`) where it covers the minutes and is newer than the model.
+Only the remaining minutes are predicted, in chunks. The GMM ellipses of
+vis_v3.plot_gmm_ellipses are drawn over every panel. Figures are written
+headlessly (Agg backend) to output_figures/.
+
+Usage:
+    python -m visualization.density
+    python -m visualization.density --mode sample --max-points 200000
+"""
+
+import argparse
+import os
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
+import joblib
+import numpy as np
+from scripts.storage import read_table
+from visualization.vis_v3 import plot_gmm_ellipses
+
+FEATURES = ['ratio_max_width', 'ratio_high_low', 'norm_Bt']
+OUTPUT_DIR = 'output_figures'
+
+def cluster_labels(features_df, gmm_model, labels_path='data/processed/labels.frame', model_path=None,
+                   chunk_size=1000000):
+    """
+    Cluster label of every minute of features_df.
+    
+    Parameters:
+        features_df (pd.DataFrame): Features indexed by time.
+        gmm_model (GaussianMixture): Model used for minutes without a stored label.
+        labels_path (str): Stored labels table with a 'cluster' column (None: predict all).
+        model_path (str): File of gmm_model. Stored labels older than it are ignored.
+        chunk_size (int): Rows predicted at a time.
+    
+    Returns:
+        np.array: int labels, aligned with features_df.
+    """
+    labels = np.full(len(features_df), -1, dtype=np.int64)
+    if labels_path and os.path.exists(labels_path) and (
+            model_path is None or os.path.getmtime(labels_path) >= os.path.getmtime(model_path)):
+        stored = read_table(labels_path)['cluster']
+        stored = stored[~stored.index.duplicated(keep='last')]
+        labels = stored.reindex(features_df.index).fillna(-1).to_numpy(dtype=np.int64)
+    
+    missing = np.flatnonzero(labels < 0)
+    if len(missing):
+        from models.inference import GMMPredictor
+        predictor = GMMPredictor(gmm_model)
+        X = features_df[FEATURES]
+        for start in range(0, len(missing), chunk_size):
+            rows = missing[start:start + chunk_size]
+            labels[rows] = predictor.predict(X.iloc[rows].to_numpy(dtype=float))
+    return labels
+
+def feature_range(values, quantiles=(0.001, 0.999)):
+    """
+    Plot range of one feature: the given quantiles of its finite values, so that
+    a handful of outliers do not squeeze the bulk of the data into a few bins.
+    """
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return 0.0, 1.0
+    low, high = np.quantile(finite, quantiles)
+    return (low, high) if high > low else (low - 0.5, high + 0.5)
+
+def density_grid(x, y, labels, n_clusters, bins=400, extent=None):
+    """
+    Point counts per cluster on a bins x bins grid.
+    
+    Parameters:
+        x, y (np.array): Coordinates.
+        labels (np.array): Cluster of each point (0..n_clusters-1).
+        n_clusters (int): Number of clusters.
+        bins (int): Grid size along each axis.
+        extent (tuple): (xmin, xmax, ymin, ymax) (default: feature_range of x and y).
+    
+    Returns:
+        tuple: (counts of shape (n_clusters, bins, bins) indexed [cluster, y, x], extent)
+    """
+    if extent is None:
+        extent = feature_range(x) + feature_range(y)
+    xmin, xmax, ymin, ymax = extent
+    inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax) & (labels >= 0)
+    xi = np.minimum(((x[inside] - xmin) / (xmax - xmin) * bins).astype(np.int64), bins - 1)
+    yi = np.minimum(((y[inside] - ymin) / (ymax - ymin) * bins).astype(np.int64), bins - 1)
+    flat = (labels[inside] * bins + yi) * bins + xi
+    counts = np.bincount(flat, minlength=n_clusters * bins * bins).reshape(n_clusters, bins, bins)
+    return counts, extent
+
+def density_image(counts, cmap='viridis'):
+    """
+    RGBA image of a density grid: each pixel takes the color of its dominant
+    cluster, with an opacity that grows with the log of its total count.
+    """
+    n_clusters = counts.shape[0]
+    total = counts.sum(axis=0)
+    colors = plt.get_cmap(cmap)(np.linspace(0, 1, n_clusters))
+    image = colors[counts.argmax(axis=0)]
+    image[..., 3] = np.log1p(total) / np.log1p(max(total.max(), 1))
+    return image
+
+def stratified_sample(labels, max_points, min_share=0.02, seed=0):
+    """
+    Indices of a subsample of at most max_points rows that keeps the cluster
+    proportions, except that every cluster gets at least min_share of the points
+    (or all of its rows, if it has fewer).
+    
+    Returns:
+        np.array: Sorted row indices.
+    """
+    if len(labels) <= max_points:
+        return np.arange(len(labels))
+    rng = np.random.default_rng(seed)
+    clusters, sizes = np.unique(labels, return_counts=True)
+    quota = np.maximum(sizes / sizes.sum() * max_points, min_share * max_points)
+    quota = np.minimum(np.floor(quota * max_points / quota.sum()), sizes).astype(np.int64)
+    picked = [rng.choice(np.flatnonzero(labels == cluster), n, replace=False) for cluster, n in zip(clusters, quota)]
+    return np.sort(np.concatenate(picked))
+
+def _legend(ax, n_clusters, cmap='viridis'):
+    colors = plt.get_cmap(cmap)(np.linspace(0, 1, n_clusters))
+    ax.legend(handles=[Patch(color=colors[k], label=str(k)) for k in range(n_clusters)], title="Cluster")
+
+def plot_pair(ax, x, y, labels, n_clusters, mode='density', bins=400, max_points=100000, extent=None):
+    """
+    Draw one feature pair on ax, as a density image or a stratified scatter.
+    """
+    if mode == 'density':
+        counts, extent = density_grid(x, y, labels, n_clusters, bins, extent)
+        ax.imshow(density_image(counts), origin='lower', extent=extent, aspect='auto', interpolation='nearest')
+    else:
+        rows = stratified_sample(labels, max_points)
+        ax.scatter(x[rows], y[rows], c=labels[rows], cmap='viridis', vmin=0, vmax=max(n_clusters - 1, 1),
+                   s=2, linewidths=0, rasterized=True)
+        if extent is None:
+            extent = feature_range(x) + feature_range(y)
+        ax.set_xlim(extent[:2])
+        ax.set_ylim(extent[2:])
+
+def plot_clusters_density(features_df, gmm_model, output_path, labels=None, mode='density', bins=400,
+                          max_points=100000):
+    """
+    First two features colored by cluster, with the Gaussian ellipses (the vis_v3 figure),
+    rendered as a density image or a stratified sample.
+    """
+    labels = cluster_labels(features_df, gmm_model, labels_path=None) if labels is None else labels
+    fig, ax = plt.subplots(figsize=(8, 6))
+    plot_pair(ax, features_df[FEATURES[0]].to_numpy(dtype=float), features_df[FEATURES[1]].to_numpy(dtype=float),
+              labels, gmm_model.n_components, mode, bins, max_points)
+    plot_gmm_ellipses(ax, gmm_model, None)
+    ax.set_xlabel(FEATURES[0])
+    ax.set_ylabel(FEATURES[1])
+    ax.set_title(f"GMM Clusters with Gaussian Ellipses ({len(features_df):,} minutes)")
+    _legend(ax, gmm_model.n_components)
+    _save(fig, output_path)
+
+def plot_pairs(features_df, gmm_model, output_path, labels=None, mode='density', bins=400, max_points=100000):
+    """
+    All feature pairs (the vis_v1 pair plot without the diagonal), each with its GMM ellipses.
+    """
+    labels = cluster_labels(features_df, gmm_model, labels_path=None) if labels is None else labels
+    pairs = [(0, 1), (0, 2), (1, 2)]
+    fig, axes = plt.subplots(1, len(pairs), figsize=(6 * len(pairs), 5))
+    for ax, (i, j) in zip(axes, pairs):
+        plot_pair(ax, features_df[FEATURES[i]].to_numpy(dtype=float), features_df[FEATURES[j]].to_numpy(dtype=float),
+                  labels, gmm_model.n_components, mode, bins, max_points)
+        plot_gmm_ellipses(ax, gmm_model, None, dims=(i, j))
+        ax.set_xlabel(FEATURES[i])
+        ax.set_ylabel(FEATURES[j])
+    _legend(axes[-1], gmm_model.n_components)
+    fig.suptitle(f"Pairwise Cluster Density ({len(features_df):,} minutes)")
+    _save(fig, output_path)
+
+def plot_3d(features_df, gmm_model, output_path, labels=None, max_points=50000):
+    """
+    3D scatter of the three features (the vis_v2 figure) from a stratified sample.
+    """
+    labels = cluster_labels(features_df, gmm_model, labels_path=None) if labels is None else labels
+    rows = stratified_sample(labels, max_points)
+    X = features_df[FEATURES].to_numpy(dtype=float)[rows]
+    fig = plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(111, projection='3d')
+    sc = ax.scatter(X[:, 0], X[:, 1], X[:, 2], c=labels[rows], cmap='viridis', s=2, linewidths=0, rasterized=True)
+    ax.set_xlabel(FEATURES[0])
+    ax.set_ylabel(FEATURES[1])
+    ax.set_zlabel(FEATURES[2])
+    ax.set_title(f"3D Scatter Plot of GMM Clusters ({len(rows):,} of {len(features_df):,} minutes)")
+    fig.colorbar(sc, label='Cluster')
+    _save(fig, output_path)
+
+def _save(fig, output_path):
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    fig.savefig(output_path, dpi=150)
+    plt.close(fig)
+
+def render_figures(features_path='data/processed/features.frame', model_path='models/gmm_model.pkl',
+                   labels_path='data/processed/labels.frame', output_dir=OUTPUT_DIR, mode='density', bins=400,
+                   max_points=100000):
+    """
+    Write the density, pair and 3D cluster figures of a feature table to output_dir.
+    
+    Returns:
+        list: Paths of the written figures.
+    """
+    start = time.perf_counter()
+    features_df = read_table(features_path)
+    gmm_model = joblib.load(model_path)
+    labels = cluster_labels(features_df, gmm_model, labels_path or None, model_path)
+    print(f"Labeled {len(features_df)} minutes in {time.perf_counter() - start:.2f} s")
+    
+    paths = []
+    for name, plot in (('gmm_clusters_density.png', plot_clusters_density), ('gmm_pairs_density.png', plot_pairs)):
+        path = os.path.join(output_dir, name)
+        plot(features_df, gmm_model, path, labels, mode, bins, max_points)
+        print(f"Saved {path}")
+        paths.append(path)
+    path = os.path.join(output_dir, 'gmm_clusters_3d.png')
+    plot_3d(features_df, gmm_model, path, labels, max_points)
+    print(f"Saved {path}")
+    paths.append(path)
+    print(f"Done in {time.perf_counter() - start:.2f} s")
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Render cluster figures for large feature sets.")
+    parser.add_argument('--features', default='data/processed/features.frame')
+    parser.add_argument('--model', default='models/gmm_model.pkl')
+    parser.add_argument('--labels', default='data/processed/labels.frame',
+                        help="Stored cluster labels to reuse ('' to predict all minutes)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--mode', choices=['density', 'sample'], default='density')
+    parser.add_argument('--bins', type=int, default=400)
+    parser.add_argument('--max-points', type=int, default=100000)
+    args = parser.parse_args()
+    render_figures(args.features, args.model, args.labels, args.output_dir, args.mode, args.bins, args.max_points)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,30 @@
-import pandas as pd
 import joblib
+from scripts.storage import read_table
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-# Load the features (assuming you've saved them as features.csv)
-features_df = pd.read_csv('/Users/nathan/CursorProjects/gus_first_project/data/processed/features.csv', index_col=0)
+def plot_pairplot(features_df, gmm_model, output_path=None):
+    """
+    Pairwise scatter plots of the three features colored by GMM cluster.
+    The figure is saved to output_path if given, otherwise shown.
+    """
+    features_df = features_df.copy()
+    # Predict cluster labels for each data point
+    features_df['cluster'] = gmm_model.predict(features_df[['ratio_max_width', 'ratio_high_low', 'norm_Bt']])
+    
+    # Create pairwise scatter plots colored by cluster
+    grid = sns.pairplot(features_df, vars=['ratio_max_width', 'ratio_high_low', 'norm_Bt'], hue='cluster', palette='viridis')
+    grid.figure.suptitle("Pairwise Scatter Plots of Clusters", y=1.02)
+    if output_path:
+        grid.figure.savefig(output_path)
+        plt.close(grid.figure)
+    else:
+        plt.show()
 
-# Load the trained GMM model from your /models directory
-gmm_model = joblib.load('/Users/nathan/CursorProjects/gus_first_project/models/gmm_model.pkl')  # adjust path/extension if needed
-
-# Predict cluster labels for each data point
-features_df['cluster'] = gmm_model.predict(features_df[['ratio_max_width', 'ratio_high_low', 'norm_Bt']])
-
-# Create pairwise scatter plots colored by cluster
-sns.pairplot(features_df, vars=['ratio_max_width', 'ratio_high_low', 'norm_Bt'], hue='cluster', palette='viridis')
-plt.suptitle("Pairwise Scatter Plots of Clusters", y=1.02)
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    # Load the features saved by feature_engineering.py
+    features_df = read_table('data/processed/features.frame')
+    
+    # Load the trained GMM model from the /models directory
+    gmm_model = joblib.load('models/gmm_model.pkl')
+    plot_pairplot(features_df, gmm_model)
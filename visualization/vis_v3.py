@@ -1,14 +1,17 @@
 import numpy as np
-import pandas as pd
 import joblib
+from models.clustering import _full_covariances
+from scripts.storage import read_table
 import matplotlib.pyplot as plt
 from matplotlib.patches import Ellipse
 
-def plot_gmm_ellipses(ax, gmm, features):
+def plot_gmm_ellipses(ax, gmm, features, dims=(0, 1)):
     # For each component, plot an ellipse representing the Gaussian
+    dims = list(dims)  # The two features on the axes, by default the first two
+    covariances = _full_covariances(gmm)  # (K, D, D) whatever the covariance_type
     for i in range(gmm.n_components):
-        mean = gmm.means_[i][:2]  # Use the first two features
-        cov = gmm.covariances_[i][:2, :2]
+        mean = gmm.means_[i][dims]
+        cov = covariances[i][np.ix_(dims, dims)]
         eigenvals, eigenvecs = np.linalg.eigh(cov)
         # Sort eigenvalues in descending order
         order = eigenvals.argsort()[::-1]
@@ -18,17 +21,30 @@ def plot_gmm_ellipses(ax, gmm, features):
         ellipse = Ellipse(mean, width, height, angle=angle, edgecolor='black', facecolor='none', lw=2)
         ax.add_patch(ellipse)
 
-# Load features and model as before
-features_df = pd.read_csv('/Users/nathan/CursorProjects/gus_first_project/data/processed/features.csv', index_col=0)
-gmm_model = joblib.load('/Users/nathan/CursorProjects/gus_first_project/models/gmm_model.pkl')
-features_df['cluster'] = gmm_model.predict(features_df[['ratio_max_width', 'ratio_high_low', 'norm_Bt']])
+def plot_clusters(features_df, gmm_model, output_path=None):
+    """
+    Scatter the first two features colored by GMM cluster, with the Gaussian ellipses.
+    The figure is saved to output_path if given, otherwise shown.
+    """
+    features_df = features_df.copy()
+    features_df['cluster'] = gmm_model.predict(features_df[['ratio_max_width', 'ratio_high_low', 'norm_Bt']])
+    
+    # Plot using only the first two features for clarity
+    fig, ax = plt.subplots(figsize=(8, 6))
+    scatter = ax.scatter(features_df['ratio_max_width'], features_df['ratio_high_low'], c=features_df['cluster'], cmap='viridis', s=50)
+    ax.set_xlabel('ratio_max_width')
+    ax.set_ylabel('ratio_high_low')
+    ax.set_title("GMM Clusters with Gaussian Ellipses")
+    plot_gmm_ellipses(ax, gmm_model, features_df[['ratio_max_width', 'ratio_high_low']].values)
+    plt.legend(*scatter.legend_elements(), title="Cluster")
+    if output_path:
+        fig.savefig(output_path)
+        plt.close(fig)
+    else:
+        plt.show()
 
-# Plot using only the first two features for clarity
-fig, ax = plt.subplots(figsize=(8, 6))
-scatter = ax.scatter(features_df['ratio_max_width'], features_df['ratio_high_low'], c=features_df['cluster'], cmap='viridis', s=50)
-ax.set_xlabel('ratio_max_width')
-ax.set_ylabel('ratio_high_low')
-ax.set_title("GMM Clusters with Gaussian Ellipses")
-plot_gmm_ellipses(ax, gmm_model, features_df[['ratio_max_width', 'ratio_high_low']].values)
-plt.legend(*scatter.legend_elements(), title="Cluster")
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    # Load features and model as before
+    features_df = read_table('data/processed/features.frame')
+    gmm_model = joblib.load('models/gmm_model.pkl')
+    plot_clusters(features_df, gmm_model)